@@ -0,0 +1,62 @@
+""" Benchmark of the client side cost of QGConnector.request() logging.
+
+Times request() for a large host list from a local mock server, with the
+qualysapi loggers at WARNING (the default) and at DEBUG, formatted and
+written to os.devnull. Run on two revisions to compare:
+
+    python -m benchmarks.logging_overhead --hosts 20000 --requests 50 --repeat 5
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import logging
+import os
+import time
+
+from benchmarks.mockserver import MockConnector, MockServer, host_list
+
+
+def time_requests(conn, count, stream, repeat=1):
+    """ Return mean seconds per request() of count requests, best of repeat runs.
+
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        for _ in range(count):
+            response = conn.request('/api/2.0/fo/asset/host/', {'action': 'list'}, stream=stream)
+            if stream:
+                with response:
+                    for _ in response:
+                        pass
+        timings.append((time.time() - started) / count)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=20000, help='hosts per response')
+    parser.add_argument('--requests', type=int, default=50, help='requests per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements, the best is reported')
+    args = parser.parse_args()
+    content = host_list(args.hosts)
+    server = MockServer({'/api/2.0/fo/asset/host/': lambda handler, body: (200, {}, content)})
+    conn = MockConnector(server, rate_limiter=False, single_flight=False)
+    logger = logging.getLogger('qualysapi')
+    devnull = open(os.devnull, 'w')
+    logger.addHandler(logging.StreamHandler(devnull))
+    logger.propagate = False
+    print('%d byte response, %d requests per measurement.' % (len(content), args.requests))
+    # Warm up connection pool.
+    time_requests(conn, 2, False)
+    for level in (logging.WARNING, logging.DEBUG):
+        logger.setLevel(level)
+        for stream in (False, True):
+            print('%-7s %-8s %8.2f ms/request' % (logging.getLevelName(level), 'stream' if stream else 'buffered',
+                                                   time_requests(conn, args.requests, stream, args.repeat) * 1000))
+    server.stop()
+    devnull.close()
+
+
+if __name__ == '__main__':
+    main()
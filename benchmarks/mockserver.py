@@ -0,0 +1,420 @@
+""" Module that contains a local mock QualysGuard API server for benchmarks,
+and a connector that talks to it over plain HTTP.
+
+MockQualys serves synthetic API v1, v2, AM and WAS responses: host lists of
+any size (truncated into pages like the real API), scan lists, scan launches,
+and Portal API searches. It can also answer with 409 rate limit and concurrent
+scan limit errors, and add latency to every response.
+"""
+from __future__ import absolute_import
+import re
+import threading
+import time
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qsl, urlencode
+
+import qualysapi.connector
+import qualysapi.sharding
+
+# Host i has IPv4 address first_ip + i.
+first_ip = qualysapi.sharding.ip_to_int('10.0.0.0')
+
+# Hosts per chunk of a streamed host list.
+hosts_per_chunk = 1000
+
+concurrent_scans_error = (b'<?xml version="1.0" encoding="UTF-8" ?>\n<ServiceResponse>'
+                          b'<responseCode>INVALID_REQUEST</responseCode><responseErrorDetails>'
+                          b'<errorMessage>You have reached the maximum number of concurrent running scans '
+                          b'(2) for your account</errorMessage><errorResolution>Please wait until your previous '
+                          b'scans have completed</errorResolution></responseErrorDetails></ServiceResponse>')
+
+
+def host_elements(start, end, ids=None):
+    """ Return HOST elements for hosts start..end - 1 (only those in ids, unless None), as text.
+
+    """
+    return ''.join('<HOST><ID>%d</ID><IP>%s</IP><TRACKING_METHOD>IP</TRACKING_METHOD>'
+                   '<DNS><![CDATA[host%d.example.com]]></DNS><NETBIOS><![CDATA[HOST%d]]></NETBIOS>'
+                   '<OS><![CDATA[%s]]></OS><LAST_VULN_SCAN_DATETIME>2018-01-%02dT03:04:05Z</LAST_VULN_SCAN_DATETIME>'
+                   '</HOST>' % (i, qualysapi.sharding.int_to_ip(first_ip + i), i, i,
+                                ('Linux 3.10', 'Windows 2012 R2', 'Cisco IOS')[i % 3], 1 + i % 28)
+                   for i in range(start, end) if ids is None or i in ids)
+
+
+def iter_host_list(start, end, next_url=None, ids=None):
+    """ Yield api/2.0/fo/asset/host/ list response for hosts start..end - 1 (only those in ids, unless None)
+    as byte chunks, with a truncation warning pointing at next_url, if any.
+
+    """
+    yield (b'<?xml version="1.0" encoding="UTF-8" ?>\n'
+           b'<!DOCTYPE HOST_LIST_OUTPUT SYSTEM "https://qualysapi.qualys.com/api/2.0/fo/asset/host/host_list_output.dtd">\n'
+           b'<HOST_LIST_OUTPUT><RESPONSE><DATETIME>2018-01-02T03:04:05Z</DATETIME><HOST_LIST>')
+    for chunk_start in range(start, end, hosts_per_chunk):
+        yield host_elements(chunk_start, min(end, chunk_start + hosts_per_chunk), ids).encode('utf-8')
+    yield b'</HOST_LIST>'
+    if next_url:
+        yield ('<WARNING><CODE>1980</CODE><TEXT>%d record limit exceeded. Use URL to get next batch of results.'
+               '</TEXT><URL><![CDATA[%s]]></URL></WARNING>' % (end - start, next_url)).encode('utf-8')
+    yield b'</RESPONSE></HOST_LIST_OUTPUT>'
+
+
+def host_list(count, start=1):
+    """ Return api/2.0/fo/asset/host/ list response of count hosts, as bytes.
+
+    """
+    return b''.join(iter_host_list(start, start + count))
+
+
+def scan_list(count, launched=(), refs=None):
+    """ Return api/2.0/fo/scan/ list response of count finished scans, then of launched (ref, state, title)
+    scans, as bytes. Only scans whose reference is in refs are listed, unless refs is None.
+
+    """
+    scans = [('scan/1514764800.%05d' % i, 'Finished', 'Scan %d' % i) for i in range(count)] + list(launched)
+    elements = ''.join('<SCAN><REF>%s</REF><TYPE>On-Demand</TYPE><TITLE><![CDATA[%s]]></TITLE>'
+                       '<USER_LOGIN>user</USER_LOGIN><LAUNCH_DATETIME>2018-01-01T00:00:00Z</LAUNCH_DATETIME>'
+                       '<DURATION>00:10:00</DURATION><PROCESSED>1</PROCESSED><STATUS><STATE>%s</STATE></STATUS>'
+                       '<TARGET><![CDATA[10.0.%d.0-10.0.%d.255]]></TARGET><OPTION_PROFILE><TITLE><![CDATA[Initial '
+                       'Options]]></TITLE></OPTION_PROFILE><ASSET_GROUP_TITLE_LIST><ASSET_GROUP_TITLE><![CDATA[Group '
+                       '%d]]></ASSET_GROUP_TITLE></ASSET_GROUP_TITLE_LIST></SCAN>' %
+                       (ref, title, state, i % 256, i % 256, i % 10)
+                       for i, (ref, state, title) in enumerate(scans) if refs is None or ref in refs)
+    return ('<?xml version="1.0" encoding="UTF-8" ?>\n<SCAN_LIST_OUTPUT><RESPONSE><DATETIME>2018-01-02T03:04:05Z'
+            '</DATETIME><SCAN_LIST>%s</SCAN_LIST></RESPONSE></SCAN_LIST_OUTPUT>' % elements).encode('utf-8')
+
+
+def service_response(tag, start, end, total):
+    """ Return Portal API search ServiceResponse of tag records with ids start..end - 1 out of 1..total, as bytes.
+
+    """
+    records = ''.join('<%s><id>%d</id><name>%s %d</name><address>%s</address></%s>' %
+                      (tag, i, tag, i, qualysapi.sharding.int_to_ip(first_ip + i), tag) for i in range(start, end))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<ServiceResponse><responseCode>SUCCESS</responseCode>'
+            '<count>%d</count><hasMoreRecords>%s</hasMoreRecords>%s<data>%s</data></ServiceResponse>' %
+            (end - start, 'true' if end <= total else 'false', '<lastId>%d</lastId>' % (end - 1) if end > start else '',
+             records)).encode('utf-8')
+
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers every request with the route registered for its path, or 404.
+
+    Routes return content as bytes, or as an iterable of byte chunks sent with chunked transfer encoding.
+    An iterable is sent as is if the route sets Content-Length; the connection is then closed, so a shorter
+    body looks like a dropped connection.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers & body are written separately; don't let Nagle's algorithm hold the body back.
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        route = self.server.routes.get(self.path.split('?')[0])
+        if route is None:
+            status, headers, content = 404, {}, b'Not found'
+        else:
+            status, headers, content = route(self, body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if isinstance(content, bytes):
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        if 'Content-Length' in headers:
+            self.end_headers()
+            for chunk in content:
+                self.wfile.write(chunk)
+            self.close_connection = True
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in content:
+            self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii') + chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    do_GET = do_POST = _respond
+
+    def parameters(self, body):
+        """ Return dict of query string & form parameters.
+
+        """
+        query = self.path.partition('?')[2]
+        parameters = dict(parse_qsl(query))
+        if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            parameters.update(parse_qsl(body.decode('utf-8')))
+        return parameters
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Threaded mock QualysGuard API server on localhost, serving in a background thread.
+
+    routes maps a path (such as '/api/2.0/fo/asset/host/') to route(handler, body) returning
+    (status, headers, content). Every response is delayed by latency seconds.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, routes=None, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), MockHandler)
+        self.routes = routes or {}
+        self.latency = latency
+        thread = threading.Thread(target=self.serve_forever, name='qualysapi-mockserver')
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockQualys(MockServer):
+    """ MockServer answering like QualysGuard for:
+
+    msp/about.php                       API v1
+    msp/asset_group_list.php            API v1, asset_groups groups
+    api/2.0/fo/asset/group/             add, edit & delete succeed, without changing anything
+    api/2.0/fo/asset/host/              hosts hosts, filtered by ips (IPs & ranges), id_min & id_max, truncated
+                                        every truncation_limit hosts (default 1000, 0 for none)
+    api/2.0/fo/asset/host/vm/detection/ detections, mapping host id to (processed datetime, {QID: status}),
+                                        filtered by vm_processed_after
+    api/2.0/fo/knowledge_base/vuln/     vulns, mapping QID to its last modified datetime, filtered by
+                                        last_modified_after
+    api/2.0/fo/report/                  fetch returns report_content, from the offset asked for with Range unless
+                                        ignore_range, gzip compressed in transit if the client accepts it; the
+                                        next report_drops fetches are cut off halfway
+    api/2.0/fo/scan/                    list returns scans finished scans, then the scans launched (filtered
+                                        by scan_ref); launch fails with the concurrent scan limit error
+                                        concurrent_scan_errors times, then succeeds, adding the scan to launched
+                                        (a list of [reference, state, title])
+    api/2.0/fo/session/                 login sets a QualysSession cookie, logout ends the session
+    qps/rest/1.0/search/am/hostasset    assets HostAsset records, paged by startFromId & limitResults
+    qps/rest/3.0/search/was/webapp      webapps WebApp records, paged likewise
+
+    The next rate_limit_errors requests, whatever the call, get a 409 asking to wait one second.
+    API v2 calls without HTTP-Basic Authentication get a 401 unless their QualysSession cookie is one of
+    sessions; expire_sessions() ends them all. hits counts requests per path, and parameters holds the
+    parameters of the last request per path.
+    """
+
+    def __init__(self, hosts=1000, scans=100, asset_groups=10, assets=1000, webapps=100, latency=0):
+        MockServer.__init__(self, latency=latency)
+        self.hosts = hosts
+        self.scans = scans
+        self.asset_groups = asset_groups
+        self.assets = assets
+        self.webapps = webapps
+        self.rate_limit_errors = 0
+        self.concurrent_scan_errors = 0
+        self.launched = []
+        self.hits = {}
+        self.parameters = {}
+        self.detections = {}
+        self.vulns = {}
+        self.report_content = bytes(bytearray(i % 251 for i in range(300000)))
+        self.report_drops = 0
+        self.ignore_range = False
+        self.sessions = set()
+        self.logins = 0
+        self.logouts = 0
+        self._lock = threading.Lock()
+        for path, route in (('/msp/about.php', self.about),
+                            ('/msp/asset_group_list.php', self.asset_group_list),
+                            ('/api/2.0/fo/asset/group/', self.asset_group),
+                            ('/api/2.0/fo/asset/host/', self.host_list),
+                            ('/api/2.0/fo/asset/host/vm/detection/', self.detection_list),
+                            ('/api/2.0/fo/knowledge_base/vuln/', self.vuln_list),
+                            ('/api/2.0/fo/scan/', self.scan),
+                            ('/api/2.0/fo/report/', self.report),
+                            ('/api/2.0/fo/session/', self.session),
+                            ('/qps/rest/1.0/search/am/hostasset', self.search('HostAsset', 'assets')),
+                            ('/qps/rest/3.0/search/was/webapp', self.search('WebApp', 'webapps'))):
+            self.routes[path] = self._counted(path, route)
+
+    def _counted(self, path, route):
+        def counted(handler, body):
+            with self._lock:
+                self.hits[path] = self.hits.get(path, 0) + 1
+                self.parameters[path] = handler.parameters(body)
+                rate_limited = self.rate_limit_errors > 0
+                if rate_limited:
+                    self.rate_limit_errors -= 1
+            if rate_limited:
+                return 409, {'X-RateLimit-Remaining': '0', 'X-RateLimit-ToWait-Sec': '1'}, b'Rate limit exceeded.'
+            if (path.startswith('/api/2.0/') and path != '/api/2.0/fo/session/' and
+                    'Authorization' not in handler.headers and self.session_cookie(handler) not in self.sessions):
+                return 401, {}, b'Unauthorized'
+            return route(handler, body)
+        return counted
+
+    def session_cookie(self, handler):
+        """ Return QualysSession cookie sent with the request, if any.
+
+        """
+        for cookie in handler.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 'QualysSession':
+                return value
+        return None
+
+    def expire_sessions(self):
+        with self._lock:
+            self.sessions.clear()
+
+    def about(self, handler, body):
+        return 200, {}, (b'<?xml version="1.0" encoding="UTF-8" ?>\n<ABOUT><API-VERSION MAJOR="1" MINOR="4" />'
+                         b'<WEB-VERSION>8.10.0</WEB-VERSION><SCANNER-VERSION>9.0.0</SCANNER-VERSION></ABOUT>')
+
+    def asset_group_list(self, handler, body):
+        groups = ''.join('<ASSET_GROUP><ID>%d</ID><TITLE><![CDATA[Group %d]]></TITLE><SCANIPS><IP>10.0.%d.1</IP>'
+                         '</SCANIPS></ASSET_GROUP>' % (i, i, i % 256) for i in range(self.asset_groups))
+        return 200, {}, ('<?xml version="1.0" encoding="UTF-8" ?>\n<ASSET_GROUP_LIST>%s</ASSET_GROUP_LIST>' %
+                         groups).encode('utf-8')
+
+    def report(self, handler, body):
+        content = self.report_content
+        status, headers = 200, {}
+        if 'gzip' in handler.headers.get('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+            content = compressor.compress(content) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+        offset = re.match(r'bytes=(\d+)-$', handler.headers.get('Range', ''))
+        if offset and not self.ignore_range:
+            start = int(offset.group(1))
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, len(content) - 1, len(content))
+            status, content = 206, content[start:]
+        with self._lock:
+            dropped = self.report_drops > 0
+            if dropped:
+                self.report_drops -= 1
+        if dropped:
+            headers['Content-Length'] = str(len(content))
+            return status, headers, iter([content[:len(content) // 2]])
+        return status, headers, content
+
+    def session(self, handler, body):
+        action = handler.parameters(body).get('action')
+        headers = {}
+        with self._lock:
+            if action == 'login':
+                self.logins += 1
+                cookie = 'session%d' % self.logins
+                self.sessions.add(cookie)
+                headers['Set-Cookie'] = 'QualysSession=%s; path=/api' % cookie
+            elif action == 'logout':
+                self.logouts += 1
+                self.sessions.discard(self.session_cookie(handler))
+        return 200, headers, ('<?xml version="1.0" encoding="UTF-8" ?>\n<SIMPLE_RETURN><RESPONSE>'
+                              '<DATETIME>2018-01-02T03:04:05Z</DATETIME><TEXT>%s</TEXT></RESPONSE></SIMPLE_RETURN>' %
+                              ('Logged in' if action == 'login' else 'Logged out')).encode('utf-8')
+
+    def asset_group(self, handler, body):
+        action = handler.parameters(body).get('action', '')
+        return 200, {}, ('<?xml version="1.0" encoding="UTF-8" ?>\n<SIMPLE_RETURN><RESPONSE>'
+                         '<DATETIME>2018-01-02T03:04:05Z</DATETIME><TEXT>Asset Group %s successful</TEXT>'
+                         '</RESPONSE></SIMPLE_RETURN>' % action).encode('utf-8')
+
+    def host_list(self, handler, body):
+        parameters = handler.parameters(body)
+        start, end = 1, self.hosts + 1
+        ids = None
+        if 'ips' in parameters:
+            ids = set()
+            for ips in parameters['ips'].split(','):
+                low, _, high = ips.partition('-')
+                ids.update(range(qualysapi.sharding.ip_to_int(low) - first_ip,
+                                 qualysapi.sharding.ip_to_int(high or low) - first_ip + 1))
+            start = max(start, min(ids))
+            end = min(end, max(ids) + 1)
+        start = max(start, int(parameters.get('id_min', start)))
+        end = min(end, int(parameters.get('id_max', end - 1)) + 1)
+        limit = int(parameters.get('truncation_limit', 1000))
+        next_url = None
+        if limit and end - start > limit:
+            end = start + limit
+            parameters['id_min'] = end
+            next_url = 'https://%s/api/2.0/fo/asset/host/?%s' % (handler.headers.get('Host'),
+                                                                  urlencode(sorted(parameters.items())))
+        return 200, {}, iter_host_list(start, max(start, end), next_url, ids)
+
+    def detection_list(self, handler, body):
+        after = handler.parameters(body).get('vm_processed_after', '')
+        hosts = []
+        for host_id, (processed, detections) in sorted(self.detections.items()):
+            if processed < after:
+                continue
+            hosts.append('<HOST><ID>%d</ID><IP>%s</IP><DETECTION_LIST>%s</DETECTION_LIST></HOST>' % (
+                host_id, qualysapi.sharding.int_to_ip(first_ip + host_id),
+                ''.join('<DETECTION><QID>%d</QID><TYPE>Confirmed</TYPE><STATUS>%s</STATUS></DETECTION>' % detection
+                        for detection in sorted(detections.items()))))
+        return 200, {}, ('<?xml version="1.0" encoding="UTF-8" ?>\n<HOST_LIST_VM_DETECTION_OUTPUT><RESPONSE>'
+                         '<DATETIME>2018-01-02T03:04:05Z</DATETIME><HOST_LIST>%s</HOST_LIST></RESPONSE>'
+                         '</HOST_LIST_VM_DETECTION_OUTPUT>' % ''.join(hosts)).encode('utf-8')
+
+    def vuln_list(self, handler, body):
+        after = handler.parameters(body).get('last_modified_after', '')
+        vulns = ''.join('<VULN><QID>%d</QID><VULN_TYPE>Vulnerability</VULN_TYPE><SEVERITY_LEVEL>%d</SEVERITY_LEVEL>'
+                        '<TITLE><![CDATA[Vulnerability %d]]></TITLE><LAST_SERVICE_MODIFICATION_DATETIME>%s'
+                        '</LAST_SERVICE_MODIFICATION_DATETIME></VULN>' % (qid, 1 + qid % 5, qid, modified)
+                        for qid, modified in sorted(self.vulns.items()) if modified >= after)
+        return 200, {}, ('<?xml version="1.0" encoding="UTF-8" ?>\n<KNOWLEDGE_BASE_VULN_LIST_OUTPUT><RESPONSE>'
+                         '<DATETIME>2018-01-02T03:04:05Z</DATETIME><VULN_LIST>%s</VULN_LIST></RESPONSE>'
+                         '</KNOWLEDGE_BASE_VULN_LIST_OUTPUT>' % vulns).encode('utf-8')
+
+    def scan(self, handler, body):
+        parameters = handler.parameters(body)
+        if parameters.get('action') == 'launch':
+            with self._lock:
+                refused = self.concurrent_scan_errors > 0
+                if refused:
+                    self.concurrent_scan_errors -= 1
+                else:
+                    ref = 'scan/1514851200.%05d' % len(self.launched)
+                    self.launched.append([ref, 'Queued', parameters.get('scan_title', '')])
+            if refused:
+                return 200, {}, concurrent_scans_error
+            return 200, {}, ('<?xml version="1.0" encoding="UTF-8" ?>\n<SIMPLE_RETURN><RESPONSE>'
+                             '<DATETIME>2018-01-02T03:04:05Z</DATETIME><TEXT>New vm scan launched</TEXT>'
+                             '<ITEM_LIST><ITEM><KEY>ID</KEY><VALUE>%d</VALUE></ITEM><ITEM><KEY>REFERENCE</KEY>'
+                             '<VALUE>%s</VALUE></ITEM></ITEM_LIST></RESPONSE></SIMPLE_RETURN>' %
+                             (len(self.launched), ref)).encode('utf-8')
+        refs = parameters.get('scan_ref')
+        return 200, {}, scan_list(self.scans, [tuple(scan) for scan in self.launched],
+                                  set(refs.split(',')) if refs else None)
+
+    def search(self, tag, total):
+        def route(handler, body):
+            text = body.decode('utf-8')
+            start = re.search(r'<startFromId>(\d+)<', text)
+            limit = re.search(r'<limitResults>(\d+)<', text)
+            start = int(start.group(1)) if start else 1
+            limit = int(limit.group(1)) if limit else 100
+            end = min(getattr(self, total) + 1, start + limit)
+            return 200, {}, service_response(tag, start, max(start, end), getattr(self, total))
+        return route
+
+
+class MockConnector(qualysapi.connector.QGConnector):
+    """ QGConnector talking plain HTTP to a MockServer.
+
+    """
+
+    def __init__(self, server, **kwargs):
+        qualysapi.connector.QGConnector.__init__(self, ('user', 'password'), server=server.address, **kwargs)
+
+    def url_api_version(self, api_version):
+        return qualysapi.connector.QGConnector.url_api_version(self, api_version).replace('https://', 'http://', 1)
@@ -0,0 +1,259 @@
+""" Benchmark suite run against a local MockQualys server.
+
+Measures QGConnector.request throughput per API (v1, v2, AM, WAS),
+getHostRange & listScans parse time, peak RSS while reading 10k, 100k and 1M
+host lists, thread scaling of a shared connector, and the rate limit & concurrent
+scan retry paths. Results are written as JSON; pass an earlier result file with
+--compare to list regressions:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --compare before.json
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Unix only; peak RSS isn't measured on Windows.
+    resource = None
+
+import qualysapi.util
+import qualysapi.version
+from benchmarks.mockserver import MockConnector, MockQualys
+
+# Calls timed by request_throughput, per API.
+throughput_calls = (('v1', 'about.php', None),
+                    ('v2', '/api/2.0/fo/asset/host/', {'action': 'list', 'truncation_limit': 100}),
+                    ('am', 'search/am/hostasset', '<ServiceRequest><preferences><limitResults>100</limitResults>'
+                                                  '</preferences></ServiceRequest>'),
+                    ('was', 'search/was/webapp', '<ServiceRequest><preferences><limitResults>100</limitResults>'
+                                                 '</preferences></ServiceRequest>'))
+
+
+def timed(function, *args, **kwargs):
+    """ Return (seconds, result) of function(*args, **kwargs).
+
+    """
+    started = time.time()
+    result = function(*args, **kwargs)
+    return time.time() - started, result
+
+
+def connector(server, **kwargs):
+    kwargs.setdefault('rate_limiter', False)
+    kwargs.setdefault('single_flight', False)
+    return MockConnector(server, **kwargs)
+
+
+def request_throughput(requests):
+    """ Return requests per second of sequential request() calls, per API.
+
+    """
+    server = MockQualys(hosts=1000, assets=1000, webapps=1000)
+    conn = connector(server)
+    results = {}
+    for name, call, data in throughput_calls:
+        conn.request(call, data)
+        seconds, _ = timed(lambda: [conn.request(call, data) for _ in range(requests)])
+        results[name] = {'requests_per_second': requests / seconds}
+    server.stop()
+    return results
+
+
+def parse_time(hosts, scans):
+    """ Return seconds & records per second of getHostRange and listScans.
+
+    """
+    server = MockQualys(hosts=hosts, scans=scans)
+    conn = connector(server)
+    seconds, records = timed(conn.getHostRange, '10.0.0.1', '10.255.255.255')
+    results = {'getHostRange': {'records': len(records), 'seconds': seconds, 'pages': server.hits[
+        '/api/2.0/fo/asset/host/'], 'records_per_second': len(records) / seconds}}
+    seconds, records = timed(conn.listScans)
+    results['listScans'] = {'records': len(records), 'seconds': seconds, 'records_per_second': len(records) / seconds}
+    server.stop()
+    return results
+
+
+def peak_rss(hosts, method):
+    """ Return records, seconds & peak RSS growth (KiB) of reading a list of hosts with method, measured in a
+    fresh process. iter_records streams a single untruncated page; getHostRange keeps every Host.
+
+    """
+    if resource is None:
+        return None
+    output = subprocess.check_output([sys.executable, '-m', 'benchmarks.suite', '--rss-child', str(hosts), method])
+    return json.loads(output.decode('utf-8'))
+
+
+def rss_child(hosts, method):
+    """ Print JSON of peak RSS growth (KiB) & seconds reading hosts with method ('iter_records' or 'getHostRange').
+
+    """
+    server = MockQualys(hosts=hosts)
+    conn = connector(server)
+    parameters = {'action': 'list', 'truncation_limit': 0}
+    # Warm up imports & connection.
+    conn.request('/api/2.0/fo/asset/host/', {'action': 'list', 'truncation_limit': 0, 'id_max': 10})
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if method == 'getHostRange':
+        seconds, records = timed(conn.getHostRange, '10.0.0.1', '10.255.255.255')
+        count = len(records)
+    else:
+        seconds, count = timed(lambda: sum(1 for _ in conn.iter_records('/api/2.0/fo/asset/host/', parameters,
+                                                                         objectified=False)))
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    if sys.platform == 'darwin':
+        # Bytes, not KiB.
+        growth //= 1024
+    server.stop()
+    print(json.dumps({'records': count, 'seconds': seconds, 'rss_kib': growth}))
+
+
+def thread_scaling(thread_counts, requests, latency):
+    """ Return requests per second of threads sharing one connector, per number of threads.
+
+    Every response takes latency seconds, like a remote server would.
+    """
+    server = MockQualys(hosts=100, latency=latency)
+    conn = connector(server, pool_maxsize=max(thread_counts))
+    data = {'action': 'list', 'truncation_limit': 100}
+    results = {}
+    for count in thread_counts:
+        def work():
+            for _ in range(requests):
+                conn.request('/api/2.0/fo/asset/host/', data)
+        threads = [threading.Thread(target=work) for _ in range(count)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[str(count)] = {'requests_per_second': count * requests / (time.time() - started)}
+    server.stop()
+    return results
+
+
+def retries():
+    """ Return seconds & attempts of a request retried after a 409, and of a scan launch retried after
+    concurrent scan limit errors.
+
+    """
+    server = MockQualys(hosts=100)
+    conn = connector(server, rate_limiter=True)
+    server.rate_limit_errors = 1
+    seconds, _ = timed(conn.request, '/api/2.0/fo/asset/host/', {'action': 'list'})
+    results = {'rate_limit': {'seconds': seconds, 'attempts': conn.last_response.attempts}}
+    server.concurrent_scan_errors = 2
+    seconds, _ = timed(conn.request, '/api/2.0/fo/scan/', {'action': 'launch', 'scan_title': 'Benchmark'},
+                       concurrent_scans_retries=2)
+    results['concurrent_scans'] = {'seconds': seconds, 'attempts': conn.last_response.attempts}
+    server.stop()
+    return results
+
+
+def run(args):
+    """ Return dict of results of every benchmark.
+
+    """
+    results = {'request_throughput': request_throughput(args.requests),
+               'parse_time': parse_time(args.hosts, args.scans),
+               'peak_rss': dict(('%s_%d' % (method, hosts), peak_rss(hosts, method))
+                                for hosts in args.rss_sizes for method in ('iter_records', 'getHostRange')),
+               'thread_scaling': thread_scaling(args.threads, args.requests // 4, args.latency),
+               'retries': retries()}
+    return {'qualysapi': qualysapi.version.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': qualysapi.util.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'results': results}
+
+
+def flatten(results, prefix=''):
+    """ Return dict mapping each 'benchmark.case.metric' path to its number.
+
+    """
+    metrics = {}
+    for name, value in (results or {}).items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, prefix + name + '.'))
+        elif isinstance(value, (int, float)):
+            metrics[prefix + name] = value
+    return metrics
+
+
+def regressions(baseline, current, tolerance):
+    """ Return list of (metric, baseline, current) that got worse by more than tolerance (0.1 for 10%).
+
+    Rates (per_second) regress when they drop, times and memory when they grow; counts aren't compared.
+    Times within 10ms of the baseline are taken as noise.
+    """
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    worse = []
+    for metric in sorted(set(old) & set(new)):
+        if metric.endswith('per_second'):
+            change = (old[metric] - new[metric]) / float(old[metric] or 1)
+        elif metric.endswith('seconds') and new[metric] - old[metric] < 0.01:
+            continue
+        elif metric.endswith(('seconds', 'rss_kib')):
+            change = (new[metric] - old[metric]) / float(old[metric] or 1)
+        else:
+            continue
+        if change > tolerance:
+            worse.append((metric, old[metric], new[metric]))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per throughput measurement')
+    parser.add_argument('--hosts', type=int, default=50000, help='hosts listed by getHostRange')
+    parser.add_argument('--scans', type=int, default=10000, help='scans listed by listScans')
+    parser.add_argument('--rss-sizes', type=int, nargs='*', default=[10000, 100000, 1000000],
+                        help='host list sizes to measure peak RSS for')
+    parser.add_argument('--threads', type=int, nargs='*', default=[1, 2, 4, 8, 16], help='thread counts to scale to')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per response when scaling threads')
+    parser.add_argument('--output', help='result file (default benchmarks/results/<date>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='change counted as regression (0.1 is 10%%)')
+    parser.add_argument('--rss-child', nargs=2, metavar=('HOSTS', 'METHOD'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # Keep retries & errors reported by the connector off the results.
+    logging.getLogger('qualysapi').addHandler(logging.NullHandler())
+    logging.getLogger('qualysapi').propagate = False
+    if args.rss_child:
+        rss_child(int(args.rss_child[0]), args.rss_child[1])
+        return
+    current = run(args)
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results',
+                                         current['date'].replace(':', '') + '.json')
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as result_file:
+        json.dump(current, result_file, indent=2, sort_keys=True)
+    for metric, value in sorted(flatten(current['results']).items()):
+        print('%-50s %14.3f' % (metric, value))
+    print('Results written to %s' % output)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            worse = regressions(json.load(baseline_file), current, args.tolerance)
+        for metric, old, new in worse:
+            print('Regression: %s %.3f -> %.3f' % (metric, old, new))
+        if worse:
+            sys.exit(1)
+        print('No regressions against %s' % args.compare)
+
+
+if __name__ == '__main__':
+    main()
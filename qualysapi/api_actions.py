@@ -1,71 +1,167 @@
 from __future__ import absolute_import
-from lxml import objectify
+import logging
+import os
+import socket
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from urlparse import urlparse, parse_qsl
+
 import qualysapi.api_objects
+import qualysapi.routing
+import qualysapi.sharding
+import qualysapi.streaming
 from qualysapi.api_objects import *
 
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+
+def _normalize_ip(ip):
+    # Match requested IPs to IPs returned, which QualysGuard writes in canonical form.
+    try:
+        return qualysapi.sharding.int_to_ip(qualysapi.sharding.ip_to_int(ip))
+    except (socket.error, ValueError):
+        return ip.strip()
+
 
 class QGActions(object):
-    def getHost(host):
+    def iter_records(self, call, parameters=None, tag='HOST', truncation_limit=None, follow_truncation=True,
+                     prefetch=False, objectified=True, cache=True):
+        """ Return a lazy iterator over each tag element of the API response, parsed as it arrives.
+
+        Truncated API v2 lists (fo/asset/host/, fo/asset/host/vm/detection/, fo/knowledge_base/vuln/, ...)
+        are followed page by page through the id_min continuation of their WARNING URL, unless
+        follow_truncation is False. truncation_limit sets the page size. With prefetch=True, the next
+        page is fetched in the background while the caller consumes the current one. With
+        objectified=False, plain lxml.etree elements are yielded, which are cheaper to build. With
+        cache=False, pages are always fetched from QualysGuard, bypassing the response cache.
+        Yielded elements are cleared once the caller advances, so copy out what is needed.
+        """
+        records = self._iter_pages(call, parameters, tag, truncation_limit, follow_truncation, objectified, cache)
+        if prefetch:
+            records = qualysapi.streaming.iter_prefetched(records, truncation_limit or 1000)
+        return records
+
+    def iter_records_sharded(self, call, parameters=None, tag='HOST', id_range=None, ip_range=None, shards=4,
+                             truncation_limit=None, max_workers=None, objectified=True):
+        """ Return an iterator over tag elements fetched concurrently from shards of an id or IP range.
+
+        Exactly one of id_range, an (id_min, id_max) pair, or ip_range, a (start, end) IPv4 pair, is split
+        into shards. Shards are fetched (following truncation) on a thread pool sharing this connector's
+        session, and their records are merged into one stream in arrival order.
+        Concurrency is capped by max_workers, or else by the X-Concurrency-Limit-Limit header last seen
+        for call (2, the QualysGuard default, until a response has been received). objectified is as for
+        iter_records.
+        """
+        if (id_range is None) == (ip_range is None):
+            raise ValueError("Specify exactly one of id_range or ip_range.")
+        if id_range is not None:
+            shard_parameters = qualysapi.sharding.split_id_range(id_range[0], id_range[1], shards)
+        else:
+            shard_parameters = qualysapi.sharding.split_ip_range(ip_range[0], ip_range[1], shards)
+        return self._iter_shards(call, parameters, tag, shard_parameters, truncation_limit, max_workers, objectified)
+
+    def _iter_shards(self, call, parameters, tag, shard_parameters, truncation_limit, max_workers, objectified):
+        """ Return iterator merging tag elements of each shard's pages, fetched concurrently.
+
+        """
+        max_workers = max_workers or self._concurrency_limit(call)
+        logger.debug('Fetching %d shards with %d workers.', len(shard_parameters), max_workers)
+        sources = []
+        for shard in shard_parameters:
+            shard_parameter = dict(parameters or {})
+            shard_parameter.update(shard)
+            sources.append(self._iter_pages(call, shard_parameter, tag, truncation_limit, True, objectified, True))
+        return qualysapi.streaming.iter_merged(sources, max_workers, truncation_limit or 1000)
+
+    def _concurrency_limit(self, call):
+        """ Return concurrency limit last seen for call (2, the QualysGuard default, until a response has been received).
+
+        """
+        return self.concurrency_limit.get(qualysapi.routing.resolve(call).api_call, 2)
+
+    def _iter_pages(self, call, parameters, tag, truncation_limit, follow_truncation, objectified, cache):
+        """ Yield tag elements from each page of a (possibly truncated) API response.
+
+        """
+        parameters = dict(parameters or {})
+        if truncation_limit is not None:
+            parameters['truncation_limit'] = truncation_limit
+        while True:
+            response = self.request(call, parameters, stream=True, cache=cache)
+            if not response:
+                # Error already reported by request().
+                return
+            next_url = None
+            with response:
+                for record in qualysapi.streaming.iter_elements(response, (tag, 'WARNING'), objectified):
+                    if record.tag == 'WARNING' and tag != 'WARNING':
+                        # Truncation warning, URL holds the continuation of the list.
+                        next_url = record.findtext('URL')
+                        continue
+                    yield record
+            if not (follow_truncation and next_url):
+                break
+            logger.debug('Following truncated response to:\n%s', next_url)
+            # Continuation URL repeats the call with id_min set past the last record returned.
+            parameters.update(parse_qsl(urlparse(next_url.strip()).query))
+
+    def getHost(self, host):
+        return self.getHosts([host])[host]
+
+    def getHosts(self, ips, details='All', ips_per_request=1000, max_workers=None):
+        """ Return dict mapping each of ips to its Host, looked up in as few requests as possible.
+
+        ips are coalesced into comma-separated, range-compressed ips parameters of at most
+        ips_per_request entries each; requests run concurrently, capped as in iter_records_sharded.
+        IPs unknown to QualysGuard map to a placeholder Host whose last scan is 'never'.
+        """
         call = '/api/2.0/fo/asset/host/'
-        parameters = {'action': 'list', 'ips': host, 'details': 'All'}
-        hostData = objectify.fromstring(self.request(call, parameters)).RESPONSE
-        try:
-            hostData = hostData.HOST_LIST.HOST
-            return Host(hostData.DNS, hostData.ID, hostData.IP, hostData.LAST_VULN_SCAN_DATETIME, hostData.NETBIOS, hostData.OS, hostData.TRACKING_METHOD)
-        except AttributeError:
-            return Host("", "", host, "never", "", "", "")
+        ips = list(ips)
+        hostData = {}
+        if ips:
+            shard_parameters = qualysapi.sharding.split_ips(ips, ips_per_request)
+            for host in self._iter_shards(call, {'action': 'list', 'details': details}, 'HOST', shard_parameters,
+                                          None, max_workers, False):
+                host = Host.from_element(host)
+                hostData.setdefault(host.ip, host)
+        hosts = {}
+        for ip in ips:
+            host = hostData.get(_normalize_ip(ip))
+            hosts[ip] = host if host is not None else Host("", "", ip, "never", "", "", "")
+        return hosts
 
     def getHostRange(self, start, end):
         call = '/api/2.0/fo/asset/host/'
         parameters = {'action': 'list', 'ips': start + '-' + end}
-        hostData = objectify.fromstring(self.request(call, parameters))
         hostArray = []
-        for host in hostData.RESPONSE.HOST_LIST.HOST:
-            hostArray.append(Host(host.DNS, host.ID, host.IP, host.LAST_VULN_SCAN_DATETIME, host.NETBIOS, host.OS, host.TRACKING_METHOD))
+        for host in self.iter_records(call, parameters, 'HOST', objectified=False):
+            hostArray.append(Host.from_element(host))
 
         return hostArray
 
     def listAssetGroups(self, groupName=''):
         call = 'asset_group_list.php'
-        if groupName == '':
-            agData = objectify.fromstring(self.request(call))
-        else:
-            agData = objectify.fromstring(self.request(call, 'title=' + groupName)).RESPONSE
-
+        parameters = {'title': groupName} if groupName else None
         groupsArray = []
-        scanipsArray = []
-        scandnsArray = []
-        scannersArray = []
-        for group in agData.ASSET_GROUP:
-            try:
-                for scanip in group.SCANIPS:
-                    scanipsArray.append(scanip.IP)
-            except AttributeError:
-                scanipsArray = []  # No IPs defined to scan.
-
-            try:
-                for scanner in group.SCANNER_APPLIANCES.SCANNER_APPLIANCE:
-                    scannersArray.append(scanner.SCANNER_APPLIANCE_NAME)
-            except AttributeError:
-                scannersArray = []  # No scanner appliances defined for this group.
-
-            try:
-                for dnsName in group.SCANDNS:
-                    scandnsArray.append(dnsName.DNS)
-            except AttributeError:
-                scandnsArray = []  # No DNS names assigned to group.
-
-            groupsArray.append(AssetGroup(group.BUSINESS_IMPACT, group.ID, group.LAST_UPDATE, scanipsArray, scandnsArray, scannersArray, group.TITLE))
+        for group in self.iter_records(call, parameters, 'ASSET_GROUP', objectified=False):
+            groupsArray.append(AssetGroup.from_element(group))
 
         return groupsArray
 
     def listReportTemplates(self):
         call = 'report_template_list.php'
-        rtData = objectify.fromstring(self.request(call))
         templatesArray = []
-
-        for template in rtData.REPORT_TEMPLATE:
-            templatesArray.append(ReportTemplate(template.GLOBAL, template.ID, template.LAST_UPDATE, template.TEMPLATE_TYPE, template.TITLE, template.TYPE, template.USER))
+        for template in self.iter_records(call, None, 'REPORT_TEMPLATE', objectified=False):
+            templatesArray.append(ReportTemplate.from_element(template))
 
         return templatesArray
 
@@ -75,32 +171,112 @@ class QGActions(object):
         if id == 0:
             parameters = {'action': 'list'}
 
-            repData = objectify.fromstring(self.request(call, parameters)).RESPONSE
             reportsArray = []
 
-            for report in repData.REPORT_LIST.REPORT:
-                reportsArray.append(Report(report.EXPIRATION_DATETIME, report.ID, report.LAUNCH_DATETIME, report.OUTPUT_FORMAT, report.SIZE, report.STATUS, report.TYPE, report.USER_LOGIN))
+            for report in self.iter_records(call, parameters, 'REPORT', objectified=False):
+                reportsArray.append(Report.from_element(report))
 
             return reportsArray
 
         else:
             parameters = {'action': 'list', 'id': id}
-            repData = objectify.fromstring(self.request(call, parameters)).RESPONSE.REPORT_LIST.REPORT
-            return Report(repData.EXPIRATION_DATETIME, repData.ID, repData.LAUNCH_DATETIME, repData.OUTPUT_FORMAT, repData.SIZE, repData.STATUS, repData.TYPE, repData.USER_LOGIN)
-
-    def notScannedSince(self, days):
+            for repData in self.iter_records(call, parameters, 'REPORT', objectified=False):
+                return Report.from_element(repData)
+
+    def downloadReports(self, reports, directory, max_workers=None, decompress=False, progress=None):
+        """ Download finished reports concurrently into directory, as <id>.<output format>.
+
+        Returns dict mapping each report id to its file path, or to the exception its download raised.
+        Downloads run on max_workers threads, capped as in iter_records_sharded. decompress is as for
+        Report.download_to, and progress(report, received, total) is called as each report downloads.
+        """
+        pending = queue.Queue()
+        for report in reports:
+            pending.put(report)
+        results = {}
+
+        def download():
+            while True:
+                try:
+                    report = pending.get_nowait()
+                except queue.Empty:
+                    return
+                path = os.path.join(directory, '%s.%s' % (report.id, (report.output_format or 'dat').lower()))
+                report_progress = (lambda received, total: progress(report, received, total)) if progress else None
+                try:
+                    report.download_to(self, path, decompress=decompress, progress=report_progress)
+                    results[report.id] = path
+                except Exception as e:
+                    logger.error('Could not download report %s: %s', report.id, e)
+                    results[report.id] = e
+
+        workers = [threading.Thread(target=download)
+                   for _ in range(min(max_workers or self._concurrency_limit('/api/2.0/fo/report'), pending.qsize()))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def notScannedSince(self, days, details='All'):
+        # Filtered server side: only hosts without a vulnerability scan in the last days are listed.
+        since = datetime.date.today() - datetime.timedelta(days=days - 1)
+        return list(self.iter_hosts(details=details, no_vm_scan_since=since))
+
+    @staticmethod
+    def host_list_parameters(details='Basic', truncation_limit=None, **filters):
+        """ Return api/2.0/fo/asset/host/ list parameters, with filters formatted for the API.
+
+        filters are host list parameters, such as ips, ag_ids, os_pattern, vm_scan_since,
+        no_vm_scan_since or show_tags. Dates and datetimes are formatted as the API expects,
+        lists/tuples/sets are comma-separated and booleans become 1/0; None values are dropped.
+        The fields returned are chosen with details (None, Basic, Basic/AGs, All, All/AGs) and
+        the show_* flags.
+        """
+        parameters = {'action': 'list'}
+        if details is not None:
+            parameters['details'] = details
+        if truncation_limit is not None:
+            parameters['truncation_limit'] = truncation_limit
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = int(value)
+            elif isinstance(value, datetime.datetime):
+                value = value.strftime('%Y-%m-%dT%H:%M:%SZ')
+            elif isinstance(value, datetime.date):
+                value = value.strftime('%Y-%m-%d')
+            elif isinstance(value, (list, tuple, set)):
+                value = ','.join(str(item) for item in value)
+            parameters[name] = value
+        return parameters
+
+    def iter_hosts(self, details='Basic', truncation_limit=None, prefetch=False, **filters):
+        """ Yield a Host for each host matching filters, filtered by QualysGuard rather than locally.
+
+        Arguments are as for host_list_parameters; truncated lists are followed, and with
+        prefetch=True the next page is fetched while the current one is consumed.
+        """
         call = '/api/2.0/fo/asset/host/'
-        parameters = {'action': 'list', 'details': 'All'}
-        hostData = objectify.fromstring(self.request(call, parameters))
-        hostArray = []
-        today = datetime.date.today()
-        for host in hostData.RESPONSE.HOST_LIST.HOST:
-            last_scan = str(host.LAST_VULN_SCAN_DATETIME).split('T')[0]
-            last_scan = datetime.date(int(last_scan.split('-')[0]), int(last_scan.split('-')[1]), int(last_scan.split('-')[2]))
-            if (today - last_scan).days >= days:
-                hostArray.append(Host(host.DNS, host.ID, host.IP, host.LAST_VULN_SCAN_DATETIME, host.NETBIOS, host.OS, host.TRACKING_METHOD))
-
-        return hostArray
+        parameters = self.host_list_parameters(details, truncation_limit, **filters)
+        for host in self.iter_records(call, parameters, 'HOST', truncation_limit=truncation_limit,
+                                      prefetch=prefetch, objectified=False):
+            yield Host.from_element(host)
+
+    def getHostTable(self, details='All', truncation_limit=None, prefetch=False, **filters):
+        """ Return a HostTable (requires NumPy) of the hosts matching filters.
+
+        Arguments are as for host_list_parameters. The list is streamed straight into typed columns,
+        following truncation, so no Host object is built per host.
+        """
+        import qualysapi.hosttable
+        call = '/api/2.0/fo/asset/host/'
+        parameters = self.host_list_parameters(details, truncation_limit, **filters)
+        hosts = self.iter_records(call, parameters, 'HOST', truncation_limit=truncation_limit,
+                                  prefetch=prefetch, objectified=False)
+        return qualysapi.hosttable.HostTable.from_elements(hosts)
 
     def addIP(self, ips, vmpc):
         # 'ips' parameter accepts comma-separated list of IP addresses.
@@ -141,17 +317,9 @@ class QGActions(object):
         if user_login != "":
             parameters['user_login'] = user_login
 
-        scanlist = objectify.fromstring(self.request(call, parameters))
         scanArray = []
-        for scan in scanlist.RESPONSE.SCAN_LIST.SCAN:
-            try:
-                agList = []
-                for ag in scan.ASSET_GROUP_TITLE_LIST.ASSET_GROUP_TITLE:
-                    agList.append(ag)
-            except AttributeError:
-                agList = []
-
-            scanArray.append(Scan(agList, scan.DURATION, scan.LAUNCH_DATETIME, scan.OPTION_PROFILE.TITLE, scan.PROCESSED, scan.REF, scan.STATUS, scan.TARGET, scan.TITLE, scan.TYPE, scan.USER_LOGIN))
+        for scan in self.iter_records(call, parameters, 'SCAN', objectified=False):
+            scanArray.append(Scan.from_element(scan))
 
         return scanArray
 
@@ -165,17 +333,18 @@ class QGActions(object):
         if asset_groups == "":
             parameters.pop("asset_groups")
 
-        scan_ref = objectify.fromstring(self.request(call, parameters)).RESPONSE.ITEM_LIST.ITEM[1].VALUE
+        scan_ref = None
+        for item in self.iter_records(call, parameters, 'ITEM', objectified=False):
+            if item.findtext('KEY') == 'REFERENCE':
+                scan_ref = item.findtext('VALUE')
+        if scan_ref is None:
+            # Launch failed, error already reported by request().
+            return None
 
         call = '/api/2.0/fo/scan/'
         parameters = {'action': 'list', 'scan_ref': scan_ref, 'show_status': 1, 'show_ags': 1, 'show_op': 1}
 
-        scan = objectify.fromstring(self.request(call, parameters)).RESPONSE.SCAN_LIST.SCAN
-        try:
-            agList = []
-            for ag in scan.ASSET_GROUP_TITLE_LIST.ASSET_GROUP_TITLE:
-                agList.append(ag)
-        except AttributeError:
-            agList = []
-
-        return Scan(agList, scan.DURATION, scan.LAUNCH_DATETIME, scan.OPTION_PROFILE.TITLE, scan.PROCESSED, scan.REF, scan.STATUS, scan.TARGET, scan.TITLE, scan.TYPE, scan.USER_LOGIN)
+        for scan in self.iter_records(call, parameters, 'SCAN', objectified=False, cache=False):
+            return Scan.from_element(scan)
+        # Launched, but not listed yet.
+        return Scan.launched(scan_ref, title, option_title, asset_groups, ip)
@@ -1,31 +1,120 @@
 from __future__ import absolute_import
 import datetime
-from lxml import objectify
+import hashlib
+import logging
+import zlib
+
+import requests
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+try:
+    string_types = (basestring,)
+except NameError:
+    string_types = (str,)
+
+
+def _text(value):
+    """ Return text of an element (or plain value), '' for None. """
+    if value is None:
+        return ''
+    return value if isinstance(value, string_types) else str(value)
+
+
+def _int(value):
+    return int(value) if value else None
+
+
+def _datetime(value):
+    # '2013-07-03T10:31:57Z' --> datetime.datetime(2013, 7, 3, 10, 31, 57)
+    if not value or value == 'never':
+        return None
+    return datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                             int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+def _datetime_parts(value):
+    # '2013-07-03T10:31:57Z' --> ['2013-07-03', '10:31:57']
+    return value.replace('T', ' ').replace('Z', '').split(' ')
+
+
+def _targets(value):
+    return value.split(', ')
+
+
+class _lazy(object):
+    """ Attribute kept as raw text in a slot, and parsed on first access.
+
+    """
+
+    def __init__(self, slot, parse):
+        self.slot = slot
+        self.parse = parse
+
+    def __get__(self, record, cls):
+        if record is None:
+            return self
+        value = getattr(record, self.slot)
+        if isinstance(value, string_types):
+            # Still raw text, parse and keep result.
+            value = self.parse(value)
+            setattr(record, self.slot, value)
+        return value
+
+    def __set__(self, record, value):
+        setattr(record, self.slot, value)
 
 
 class Host(object):
+    __slots__ = ('dns', '_id', 'ip', '_last_scan', 'netbios', 'os', 'tracking_method')
+
+    id = _lazy('_id', _int)
+    last_scan = _lazy('_last_scan', _datetime)
+
     def __init__(self, dns, id, ip, last_scan, netbios, os, tracking_method):
-        self.dns = str(dns)
-        self.id = int(id)
-        self.ip = str(ip)
-        last_scan = str(last_scan).replace('T', ' ').replace('Z', '').split(' ')
-        date = last_scan[0].split('-')
-        time = last_scan[1].split(':')
-        self.last_scan = datetime.datetime(int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]))
-        self.netbios = str(netbios)
-        self.os = str(os)
-        self.tracking_method = str(tracking_method)
+        self.dns = _text(dns)
+        self._id = _text(id)
+        self.ip = _text(ip)
+        self._last_scan = _text(last_scan)
+        self.netbios = _text(netbios)
+        self.os = _text(os)
+        self.tracking_method = _text(tracking_method)
+
+    @classmethod
+    def from_element(cls, host):
+        """ Return Host built straight from a HOST element.
+
+        """
+        return cls(host.findtext('DNS'), host.findtext('ID'), host.findtext('IP'),
+                   host.findtext('LAST_VULN_SCAN_DATETIME'), host.findtext('NETBIOS'), host.findtext('OS'),
+                   host.findtext('TRACKING_METHOD'))
 
 
 class AssetGroup(object):
+    __slots__ = ('business_impact', '_id', 'last_update', 'scanips', 'scandns', 'scanner_appliances', 'title')
+
+    id = _lazy('_id', _int)
+
     def __init__(self, business_impact, id, last_update, scanips, scandns, scanner_appliances, title):
-        self.business_impact = str(business_impact)
-        self.id = int(id)
-        self.last_update = str(last_update)
+        self.business_impact = _text(business_impact)
+        self._id = _text(id)
+        self.last_update = _text(last_update)
         self.scanips = scanips
         self.scandns = scandns
         self.scanner_appliances = scanner_appliances
-        self.title = str(title)
+        self.title = _text(title)
+
+    @classmethod
+    def from_element(cls, group):
+        """ Return AssetGroup built straight from an ASSET_GROUP element.
+
+        """
+        return cls(group.findtext('BUSINESS_IMPACT'), group.findtext('ID'), group.findtext('LAST_UPDATE'),
+                   [ip.findtext('IP') for ip in group.iterfind('SCANIPS')],
+                   [dns.findtext('DNS') for dns in group.iterfind('SCANDNS')],
+                   group.xpath('SCANNER_APPLIANCES/SCANNER_APPLIANCE/SCANNER_APPLIANCE_NAME/text()'),
+                   group.findtext('TITLE'))
 
     def addAsset(self, conn, ip):
         call = '/api/2.0/fo/asset/group/'
@@ -40,26 +129,59 @@ class AssetGroup(object):
 
 
 class ReportTemplate(object):
+    __slots__ = ('_isGlobal', '_id', '_last_update', 'template_type', 'title', 'type', 'user')
+
+    isGlobal = _lazy('_isGlobal', _int)
+    id = _lazy('_id', _int)
+    last_update = _lazy('_last_update', _datetime_parts)
+
     def __init__(self, isGlobal, id, last_update, template_type, title, type, user):
-        self.isGlobal = int(isGlobal)
-        self.id = int(id)
-        self.last_update = str(last_update).replace('T', ' ').replace('Z', '').split(' ')
-        self.template_type = template_type
-        self.title = title
-        self.type = type
-        self.user = user.LOGIN
+        self._isGlobal = _text(isGlobal)
+        self._id = _text(id)
+        self._last_update = _text(last_update)
+        self.template_type = _text(template_type)
+        self.title = _text(title)
+        self.type = _text(type)
+        # USER element, or login.
+        self.user = _text(getattr(user, 'LOGIN', user))
+
+    @classmethod
+    def from_element(cls, template):
+        """ Return ReportTemplate built straight from a REPORT_TEMPLATE element.
+
+        """
+        return cls(template.findtext('GLOBAL'), template.findtext('ID'), template.findtext('LAST_UPDATE'),
+                   template.findtext('TEMPLATE_TYPE'), template.findtext('TITLE'), template.findtext('TYPE'),
+                   template.findtext('USER/LOGIN'))
 
 
 class Report(object):
+    __slots__ = ('_expiration_datetime', '_id', '_launch_datetime', 'output_format', 'size', 'status', 'type',
+                 'user_login')
+
+    expiration_datetime = _lazy('_expiration_datetime', _datetime_parts)
+    id = _lazy('_id', _int)
+    launch_datetime = _lazy('_launch_datetime', _datetime_parts)
+
     def __init__(self, expiration_datetime, id, launch_datetime, output_format, size, status, type, user_login):
-        self.expiration_datetime = str(expiration_datetime).replace('T', ' ').replace('Z', '').split(' ')
-        self.id = int(id)
-        self.launch_datetime = str(launch_datetime).replace('T', ' ').replace('Z', '').split(' ')
-        self.output_format = output_format
-        self.size = size
-        self.status = status.STATE
-        self.type = type
-        self.user_login = user_login
+        self._expiration_datetime = _text(expiration_datetime)
+        self._id = _text(id)
+        self._launch_datetime = _text(launch_datetime)
+        self.output_format = _text(output_format)
+        self.size = _text(size)
+        # STATUS element, or state.
+        self.status = _text(getattr(status, 'STATE', status))
+        self.type = _text(type)
+        self.user_login = _text(user_login)
+
+    @classmethod
+    def from_element(cls, report):
+        """ Return Report built straight from a REPORT element.
+
+        """
+        return cls(report.findtext('EXPIRATION_DATETIME'), report.findtext('ID'), report.findtext('LAUNCH_DATETIME'),
+                   report.findtext('OUTPUT_FORMAT'), report.findtext('SIZE'), report.findtext('STATUS/STATE'),
+                   report.findtext('TYPE'), report.findtext('USER_LOGIN'))
 
     def download(self, conn):
         call = '/api/2.0/fo/report'
@@ -67,25 +189,140 @@ class Report(object):
         if self.status == 'Finished':
             return conn.request(call, parameters)
 
+    def download_to(self, conn, destination, decompress=False, progress=None, max_resumes=3):
+        """ Stream report to destination (a path or binary file object); return SHA-256 hex digest of data written.
+
+        If the connection drops, the download resumes where it stopped with an HTTP Range request, up to
+        max_resumes times. The report is asked for without transfer encoding, so that bytes received are
+        offsets into it; if the server compresses it in transit anyway, a dropped download restarts from the
+        beginning instead. With decompress=True, a gzip or zlib compressed report is inflated on the fly.
+        progress(received, total) is called after each chunk; total is None if the server didn't send it.
+        """
+        if self.status != 'Finished':
+            raise ValueError("Report cannot be downloaded because its status is " + self.status)
+        call = '/api/2.0/fo/report'
+        parameters = {'action': 'fetch', 'id': self.id}
+        opened = not hasattr(destination, 'write')
+        fileobj = open(destination, 'wb') if opened else destination
+        try:
+            origin = fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            # Not seekable.
+            origin = None
+        try:
+            received = 0
+            total = None
+            resumes = 0
+            encoded = False
+            while True:
+                if received == 0:
+                    checksum = hashlib.sha256()
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if decompress else None
+                # Ask for the report as is, otherwise received would count decoded bytes rather than Range offsets.
+                headers = {'Accept-Encoding': 'identity'}
+                if received and not encoded:
+                    headers['Range'] = 'bytes=%d-' % received
+                try:
+                    response = conn.request(call, parameters, stream=True, headers=headers)
+                    if not response:
+                        raise IOError("Report %s could not be downloaded." % self.id)
+                    with response:
+                        if received and response.status_code != 206:
+                            # Range ignored (or not sent), the whole report is sent again.
+                            if origin is None:
+                                raise IOError("Report %s download can't resume, and destination can't be rewound." %
+                                              self.id)
+                            fileobj.seek(origin)
+                            fileobj.truncate()
+                            received = 0
+                            checksum = hashlib.sha256()
+                            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if decompress else None
+                        encoded = response.headers.get('Content-Encoding', 'identity') != 'identity'
+                        # 'bytes 100-199/200' when resuming; Content-Length doesn't count decoded bytes if encoded.
+                        length = response.headers.get('Content-Range', '').rpartition('/')[2]
+                        if not length and not encoded:
+                            length = response.headers.get('Content-Length')
+                        if length and length.isdigit():
+                            total = int(length)
+                        for chunk in response:
+                            received += len(chunk)
+                            data = decompressor.decompress(chunk) if decompressor else chunk
+                            fileobj.write(data)
+                            checksum.update(data)
+                            if progress:
+                                progress(received, total)
+                    dropped = total is not None and received < total
+                except requests.exceptions.HTTPError:
+                    raise
+                except requests.exceptions.RequestException as e:
+                    logger.warning('Report %s download dropped at %d bytes: %s', self.id, received, e)
+                    dropped = True
+                if not dropped:
+                    break
+                if resumes >= max_resumes:
+                    raise IOError("Report %s download dropped at %d of %s bytes." % (self.id, received, total))
+                resumes += 1
+                logger.info('Resuming report %s download at %d bytes.', self.id, received)
+            if decompressor:
+                data = decompressor.flush()
+                fileobj.write(data)
+                checksum.update(data)
+        finally:
+            if opened:
+                fileobj.close()
+        return checksum.hexdigest()
+
 
 class Scan(object):
+    __slots__ = ('assetgroups', 'duration', '_launch_datetime', 'option_profile', '_processed', 'ref', 'status',
+                 '_target', 'title', 'type', 'user_login')
+
+    launch_datetime = _lazy('_launch_datetime', _datetime)
+    processed = _lazy('_processed', _int)
+    target = _lazy('_target', _targets)
+
     def __init__(self, assetgroups, duration, launch_datetime, option_profile, processed, ref, status, target, title, type, user_login):
         self.assetgroups = assetgroups
-        self.duration = str(duration)
-        launch_datetime = str(launch_datetime).replace('T', ' ').replace('Z', '').split(' ')
-        date = launch_datetime[0].split('-')
-        time = launch_datetime[1].split(':')
-        self.launch_datetime = datetime.datetime(int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]))
-        self.option_profile = str(option_profile)
-        self.processed = int(processed)
-        self.ref = str(ref)
-        self.status = str(status.STATE)
-        self.target = str(target).split(', ')
-        self.title = str(title)
-        self.type = str(type)
-        self.user_login = str(user_login)
-
-    def cancel(self, conn):
+        self.duration = _text(duration)
+        self._launch_datetime = _text(launch_datetime)
+        self.option_profile = _text(option_profile)
+        self._processed = _text(processed)
+        self.ref = _text(ref)
+        # STATUS element, or state.
+        self.status = _text(getattr(status, 'STATE', status))
+        self._target = _text(target)
+        self.title = _text(title)
+        self.type = _text(type)
+        self.user_login = _text(user_login)
+
+    @classmethod
+    def from_element(cls, scan):
+        """ Return Scan built straight from a SCAN element.
+
+        """
+        return cls(scan.xpath('ASSET_GROUP_TITLE_LIST/ASSET_GROUP_TITLE/text()'), scan.findtext('DURATION'),
+                   scan.findtext('LAUNCH_DATETIME'), scan.findtext('OPTION_PROFILE/TITLE'), scan.findtext('PROCESSED'),
+                   scan.findtext('REF'), scan.findtext('STATUS/STATE'), scan.findtext('TARGET'), scan.findtext('TITLE'),
+                   scan.findtext('TYPE'), scan.findtext('USER_LOGIN'))
+
+    @classmethod
+    def launched(cls, ref, title, option_title, asset_groups='', ip=''):
+        """ Return Scan for a scan just launched as ref, from the launch parameters (status Submitted).
+
+        """
+        assetgroups = [group.strip() for group in asset_groups.split(',') if group.strip()]
+        return cls(assetgroups, '', '', option_title, '', ref, 'Submitted', ip, title, '', '')
+
+    def refresh(self, conn):
+        """ Update status from QualysGuard (a qualysapi.scanwatch.ScanWatcher refreshes many scans in one call).
+
+        """
+        call = '/api/2.0/fo/scan/'
+        parameters = {'action': 'list', 'scan_ref': self.ref, 'show_status': 1}
+        for scan in conn.iter_records(call, parameters, 'SCAN', objectified=False, cache=False):
+            self.status = scan.findtext('STATUS/STATE')
+
+    def cancel(self, conn, refresh=True):
         cancelled_statuses = ['Cancelled', 'Finished', 'Error']
         if any(self.status in s for s in cancelled_statuses):
             raise ValueError("Scan cannot be cancelled because its status is " + self.status)
@@ -94,10 +331,10 @@ class Scan(object):
             parameters = {'action': 'cancel', 'scan_ref': self.ref}
             conn.request(call, parameters)
 
-            parameters = {'action': 'list', 'scan_ref': self.ref, 'show_status': 1}
-            self.status = objectify.fromstring(conn.request(call, parameters)).RESPONSE.SCAN_LIST.SCAN.STATUS.STATE
+            if refresh:
+                self.refresh(conn)
 
-    def pause(self, conn):
+    def pause(self, conn, refresh=True):
         if self.status != "Running":
             raise ValueError("Scan cannot be paused because its status is " + self.status)
         else:
@@ -105,10 +342,10 @@ class Scan(object):
             parameters = {'action': 'pause', 'scan_ref': self.ref}
             conn.request(call, parameters)
 
-            parameters = {'action': 'list', 'scan_ref': self.ref, 'show_status': 1}
-            self.status = objectify.fromstring(conn.request(call, parameters)).RESPONSE.SCAN_LIST.SCAN.STATUS.STATE
+            if refresh:
+                self.refresh(conn)
 
-    def resume(self, conn):
+    def resume(self, conn, refresh=True):
         if self.status != "Paused":
             raise ValueError("Scan cannot be resumed because its status is " + self.status)
         else:
@@ -116,5 +353,5 @@ class Scan(object):
             parameters = {'action': 'resume', 'scan_ref': self.ref}
             conn.request(call, parameters)
 
-            parameters = {'action': 'list', 'scan_ref': self.ref, 'show_status': 1}
-            self.status = objectify.fromstring(conn.request(call, parameters)).RESPONSE.SCAN_LIST.SCAN.STATUS.STATE
+            if refresh:
+                self.refresh(conn)
@@ -0,0 +1,525 @@
+""" Module that contains AsyncQGConnector, an asyncio counterpart of QGConnector
+that lets many QualysGuard API requests share one thread and connection pool.
+
+Requires Python 3.6+ and aiohttp (pip install qualysapi[async]).
+"""
+import asyncio
+import base64
+import datetime
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from urllib.parse import urlparse, parse_qsl
+
+import aiohttp
+
+import qualysapi.api_methods
+import qualysapi.ratelimit
+import qualysapi.sharding
+import qualysapi.streaming
+from qualysapi.api_actions import QGActions, _normalize_ip
+from qualysapi.api_objects import AssetGroup, Host, Report, ReportTemplate, Scan
+from qualysapi.connector import QGConnector, concurrent_scans_exceeded, preview
+from qualysapi.scanwatch import ScanWatcher
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+
+class AsyncRateLimiter(object):
+    """ asyncio counterpart of qualysapi.ratelimit.RateLimiter, holding a TokenBucket per API call.
+
+    """
+
+    def __init__(self, slot_timeout=1800):
+        self.buckets = defaultdict(qualysapi.ratelimit.TokenBucket)
+        self.slot_timeout = slot_timeout
+        # Created on first use, inside the running event loop.
+        self._condition = None
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, api_call):
+        """ Wait until a request against api_call may be sent.
+
+        """
+        condition = self._get_condition()
+        async with condition:
+            bucket = self.buckets[api_call]
+            deadline = None
+            while True:
+                now = time.time()
+                wait = bucket.delay(now)
+                if not wait and not bucket.is_saturated():
+                    bucket.take(now)
+                    return
+                if wait:
+                    logger.info('Pacing %s, waiting %.2f seconds.', api_call, wait)
+                else:
+                    deadline = qualysapi.ratelimit.slot_deadline(deadline, now, self.slot_timeout, api_call, bucket)
+                    if deadline is not None:
+                        wait = deadline - now
+                # Woken early by release() in case a slot frees up or the headers changed.
+                try:
+                    await asyncio.wait_for(condition.wait(), wait or None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def update(self, api_call, headers):
+        """ Update the bucket of api_call from response headers, keeping the slot taken.
+
+        """
+        condition = self._get_condition()
+        async with condition:
+            self.buckets[api_call].update(headers, time.time())
+            condition.notify_all()
+
+    async def release(self, api_call, headers=None):
+        """ Release the slot taken by acquire(), updating the bucket from response headers if any.
+
+        """
+        condition = self._get_condition()
+        async with condition:
+            bucket = self.buckets[api_call]
+            bucket.running = max(0, bucket.running - 1)
+            if headers is not None:
+                bucket.update(headers, time.time())
+            condition.notify_all()
+
+
+class AsyncResponseStream(object):
+    """ Async iterable over a streamed QualysGuard API response, yielding raw byte chunks.
+
+    """
+
+    def __init__(self, response, first_chunk, on_close=None):
+        self.response = response
+        self.headers = response.headers
+        self.status_code = response.status
+        # First chunk was already consumed to check for errors; keep it buffered.
+        self._buffer = first_chunk
+        # Coroutine function awaited once, when the body has been read or the stream is closed.
+        self._on_close = on_close
+        self._loop = asyncio.get_event_loop()
+
+    def __aiter__(self):
+        return self._iter_chunks()
+
+    async def _iter_chunks(self):
+        if self._buffer:
+            buffered, self._buffer = self._buffer, b''
+            yield buffered
+        async for chunk in self.response.content.iter_chunked(qualysapi.streaming.CHUNK_SIZE):
+            yield chunk
+        await self._finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.response.release()
+        await self._finish()
+
+    async def read(self):
+        """ Return the remainder of the stream.
+
+        """
+        data = self._buffer + await self.response.content.read()
+        self._buffer = b''
+        await self._finish()
+        return data
+
+    async def _finish(self):
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            await on_close()
+
+    def close(self):
+        """ Release the underlying connection back to the pool.
+
+        """
+        self.response.release()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            # Not awaitable from here, run it soon.
+            asyncio.ensure_future(on_close())
+
+    def __del__(self):
+        # Don't hold the rate limiter slot if the stream is dropped without close().
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None and not self._loop.is_closed():
+            self.response.release()
+            self._loop.call_soon_threadsafe(self._loop.create_task, on_close())
+
+
+class AsyncQGActions(object):
+    """ Async versions of the QGActions helpers.
+
+    """
+
+    async def iter_records(self, call, parameters=None, tag='HOST', truncation_limit=None, follow_truncation=True,
+                           objectified=True):
+        """ Yield each tag element of the API response as it is parsed, following truncated responses.
+
+        Same semantics as QGActions.iter_records: yielded elements are cleared once the caller advances.
+        """
+        parameters = dict(parameters or {})
+        if truncation_limit is not None:
+            parameters['truncation_limit'] = truncation_limit
+        while True:
+            response = await self.request(call, parameters, stream=True)
+            if not response:
+                # Error already reported by request().
+                return
+            next_urls = []
+
+            def records(parser):
+                for record in qualysapi.streaming.read_elements(parser):
+                    if record.tag == 'WARNING' and tag != 'WARNING':
+                        # Truncation warning, URL holds the continuation of the list.
+                        next_urls.append(record.findtext('URL'))
+                        continue
+                    yield record
+
+            async with response:
+                parser = qualysapi.streaming.element_parser((tag, 'WARNING'), objectified)
+                async for chunk in response:
+                    parser.feed(chunk)
+                    for record in records(parser):
+                        yield record
+                parser.close()
+                for record in records(parser):
+                    yield record
+            if not (follow_truncation and next_urls and next_urls[-1]):
+                break
+            logger.debug('Following truncated response to:\n%s', next_urls[-1])
+            parameters.update(parse_qsl(urlparse(next_urls[-1].strip()).query))
+
+    async def getHost(self, host):
+        return (await self.getHosts([host]))[host]
+
+    async def getHosts(self, ips, details='All', ips_per_request=1000):
+        """ Return dict mapping each of ips to its Host, as QGActions.getHosts; requests run concurrently.
+
+        """
+        call = '/api/2.0/fo/asset/host/'
+        ips = list(ips)
+
+        async def fetch(shard):
+            parameters = {'action': 'list', 'details': details}
+            parameters.update(shard)
+            return [Host.from_element(host)
+                    async for host in self.iter_records(call, parameters, 'HOST', objectified=False)]
+
+        hostData = {}
+        shards = qualysapi.sharding.split_ips(ips, ips_per_request) if ips else []
+        for shard_hosts in await asyncio.gather(*[fetch(shard) for shard in shards]):
+            for host in shard_hosts:
+                hostData.setdefault(host.ip, host)
+        hosts = {}
+        for ip in ips:
+            host = hostData.get(_normalize_ip(ip))
+            hosts[ip] = host if host is not None else Host("", "", ip, "never", "", "", "")
+        return hosts
+
+    async def getHostRange(self, start, end):
+        call = '/api/2.0/fo/asset/host/'
+        parameters = {'action': 'list', 'ips': start + '-' + end}
+        hostArray = []
+        async for host in self.iter_records(call, parameters, 'HOST', objectified=False):
+            hostArray.append(Host.from_element(host))
+        return hostArray
+
+    async def listAssetGroups(self, groupName=''):
+        call = 'asset_group_list.php'
+        parameters = {'title': groupName} if groupName else None
+        groupsArray = []
+        async for group in self.iter_records(call, parameters, 'ASSET_GROUP', objectified=False):
+            groupsArray.append(AssetGroup.from_element(group))
+        return groupsArray
+
+    async def listReportTemplates(self):
+        call = 'report_template_list.php'
+        templatesArray = []
+        async for template in self.iter_records(call, None, 'REPORT_TEMPLATE', objectified=False):
+            templatesArray.append(ReportTemplate.from_element(template))
+        return templatesArray
+
+    async def listReports(self, id=0):
+        call = '/api/2.0/fo/report'
+        parameters = {'action': 'list'}
+        if id != 0:
+            parameters['id'] = id
+        reportsArray = []
+        async for report in self.iter_records(call, parameters, 'REPORT', objectified=False):
+            reportsArray.append(Report.from_element(report))
+        if id != 0:
+            return reportsArray[0] if reportsArray else None
+        return reportsArray
+
+    async def notScannedSince(self, days, details='All'):
+        # Filtered server side, as QGActions.notScannedSince.
+        since = datetime.date.today() - datetime.timedelta(days=days - 1)
+        return [host async for host in self.iter_hosts(details=details, no_vm_scan_since=since)]
+
+    host_list_parameters = staticmethod(QGActions.host_list_parameters)
+
+    async def iter_hosts(self, details='Basic', truncation_limit=None, **filters):
+        """ Yield a Host for each host matching filters, as QGActions.iter_hosts.
+
+        """
+        call = '/api/2.0/fo/asset/host/'
+        parameters = self.host_list_parameters(details, truncation_limit, **filters)
+        async for host in self.iter_records(call, parameters, 'HOST', truncation_limit=truncation_limit,
+                                            objectified=False):
+            yield Host.from_element(host)
+
+    async def addIP(self, ips, vmpc):
+        # 'ips' parameter accepts comma-separated list of IP addresses.
+        # 'vmpc' parameter accepts 'vm', 'pc', or 'both'. (Vulnerability Managment, Policy Compliance, or both)
+        call = '/api/2.0/fo/asset/ip/'
+        enablevm = 0 if vmpc == 'pc' else 1
+        enablepc = 1 if vmpc in ('pc', 'both') else 0
+        parameters = {'action': 'add', 'ips': ips, 'enable_vm': enablevm, 'enable_pc': enablepc}
+        await self.request(call, parameters)
+
+    async def listScans(self, launched_after="", state="", target="", type="", user_login=""):
+        call = '/api/2.0/fo/scan/'
+        parameters = {'action': 'list', 'show_ags': 1, 'show_op': 1, 'show_status': 1}
+        for key, value in (('launched_after_datetime', launched_after), ('state', state), ('target', target),
+                           ('type', type), ('user_login', user_login)):
+            if value != "":
+                parameters[key] = value
+        scanArray = []
+        async for scan in self.iter_records(call, parameters, 'SCAN', objectified=False):
+            scanArray.append(Scan.from_element(scan))
+        return scanArray
+
+    async def launchScan(self, title, option_title, iscanner_name, asset_groups="", ip=""):
+        call = '/api/2.0/fo/scan/'
+        parameters = {'action': 'launch', 'scan_title': title, 'option_title': option_title, 'iscanner_name': iscanner_name}
+        if ip != "":
+            parameters['ip'] = ip
+        if asset_groups != "":
+            parameters['asset_groups'] = asset_groups
+        scan_ref = None
+        async for item in self.iter_records(call, parameters, 'ITEM', objectified=False):
+            if item.findtext('KEY') == 'REFERENCE':
+                scan_ref = item.findtext('VALUE')
+        if scan_ref is None:
+            # Launch failed, error already reported by request().
+            return None
+
+        parameters = {'action': 'list', 'scan_ref': scan_ref, 'show_status': 1, 'show_ags': 1, 'show_op': 1}
+        async for scan in self.iter_records(call, parameters, 'SCAN', objectified=False):
+            return Scan.from_element(scan)
+        # Launched, but not listed yet.
+        return Scan.launched(scan_ref, title, option_title, asset_groups, ip)
+
+
+class AsyncQGConnector(AsyncQGActions):
+    """ asyncio Qualys Connection class, mirroring QGConnector.request on top of aiohttp.
+
+    Call, url, http method & payload formatting are shared with QGConnector. Use as an async
+    context manager, or await close(), to release the connection pool.
+    """
+
+    # Reuse QGConnector's call, url, http method & payload formatting.
+    format_api_version = QGConnector.format_api_version
+    which_api_version = QGConnector.which_api_version
+    url_api_version = QGConnector.url_api_version
+    format_http_method = QGConnector.format_http_method
+    preformat_call = QGConnector.preformat_call
+    format_call = QGConnector.format_call
+    format_payload = QGConnector.format_payload
+    prepare_request = QGConnector.prepare_request
+    update_rate_limits = QGConnector.update_rate_limits
+    _update_rate_limits = QGConnector._update_rate_limits
+
+    def __init__(self, auth, server='qualysapi.qualys.com', proxies=None, max_connections=100, rate_limiter=True,
+                 max_rate_limit_retries=3, connect_timeout=None, read_timeout=None):
+        self.auth = auth
+        # Remember QualysGuard API server.
+        self.server = server
+        # Remember rate & concurrency limits per call.
+        self.rate_limit_remaining = defaultdict(int)
+        self.concurrency_limit = {}
+        self._rate_limit_lock = threading.Lock()
+        if rate_limiter is True:
+            rate_limiter = AsyncRateLimiter()
+        self.rate_limiter = rate_limiter or None
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.api_methods = qualysapi.api_methods.api_methods
+        self.api_methods_with_trailing_slash = qualysapi.api_methods.api_methods_with_trailing_slash
+        # aiohttp takes a single proxy url per request.
+        self.proxy = (proxies or {}).get('https')
+        # Size of the pooled connection limit shared by all requests.
+        self.max_connections = max_connections
+        # Socket connect & read timeouts in seconds, None waits forever.
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        # Created on first request, inside the running event loop.
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """ Close the connection pool.
+
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self):
+        if self.session is None:
+            # HTTP-Basic Authentication header, sent by every request of the session.
+            credentials = base64.b64encode(('%s:%s' % self.auth).encode('utf-8')).decode('ascii')
+            self.session = aiohttp.ClientSession(headers={'Authorization': 'Basic %s' % credentials},
+                                                 connector=aiohttp.TCPConnector(limit=self.max_connections),
+                                                 timeout=self.timeout)
+        return self.session
+
+    async def request(self, api_call, data=None, api_version=None, http_method=None, concurrent_scans_retries=0,
+                      concurrent_scans_retry_delay=0, stream=False):
+        """ Return QualysGuard API response.
+
+        With stream=True, return an AsyncResponseStream instead of a string.
+        """
+        concurrent_scans_retries = int(concurrent_scans_retries)
+        concurrent_scans_retry_delay = int(concurrent_scans_retry_delay)
+        api_call, api_version, url, http_method, headers, data = self.prepare_request(api_call, data, api_version,
+                                                                                       http_method)
+        session = self._get_session()
+        # Make request at least once (more if concurrent_retry is enabled).
+        retries = 0
+        rate_limit_retries = 0
+        while retries <= concurrent_scans_retries:
+            logger.debug('url =\n%s', url)
+            # Wait for the rate limit scheduler to allow the call.
+            response = None
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(api_call)
+            try:
+                if http_method == 'get':
+                    response = await session.get(url, params=data, headers=headers, proxy=self.proxy)
+                else:
+                    response = await session.post(url, data=data, headers=headers, proxy=self.proxy)
+            except BaseException:
+                await self._release(api_call)
+                raise
+            if self.rate_limiter:
+                # Slot is released once the body has been read.
+                await self.rate_limiter.update(api_call, response.headers)
+            self.update_rate_limits(api_call, response.headers)
+            # Check for rate or concurrency limit exceeded.
+            towait = qualysapi.ratelimit.int_header(response.headers, 'x-ratelimit-towait-sec')
+            if response.status == 409 and towait and rate_limit_retries < self.max_rate_limit_retries:
+                rate_limit_retries += 1
+                response.release()
+                await self._release(api_call)
+                logger.warning('Rate limit exceeded for %s, waiting %d seconds until retry #%d.',
+                               api_call, towait, rate_limit_retries)
+                if not self.rate_limiter:
+                    await asyncio.sleep(towait)
+                continue
+            # Response received.
+            try:
+                if stream:
+                    # Only pull the first chunk off the wire; it is enough to detect QualysGuard errors.
+                    first_chunk = await response.content.read(qualysapi.streaming.CHUNK_SIZE)
+                    text = first_chunk.decode('utf-8', 'replace')
+                else:
+                    text = (await response.read()).decode('utf-8', 'replace')
+            except BaseException:
+                response.release()
+                await self._release(api_call)
+                raise
+            if not stream:
+                await self._release(api_call)
+            # Keep track of how many retries.
+            retries += 1
+            # Check for concurrent scans limit.
+            if not concurrent_scans_exceeded(text):
+                break
+            # Hit concurrent scan limit.
+            logger.critical(preview(text))
+            response.release()
+            if stream:
+                await self._release(api_call)
+            if retries <= concurrent_scans_retries:
+                logger.warning('Waiting %d seconds until next try.', concurrent_scans_retry_delay)
+                await asyncio.sleep(concurrent_scans_retry_delay)
+                logger.critical('Retry #%d', retries)
+            else:
+                logger.critical('Alert! Ran out of concurrent_scans_retries!')
+                return False
+        # Check to see if there was an error.
+        if response.status >= 400:
+            logger.error('Content = \n%s', preview(text))
+            logger.error('Headers = \n%s', preview(response.headers))
+            response.release()
+            if stream:
+                await self._release(api_call)
+            response.raise_for_status()
+        if '<RETURN status="FAILED" number="2007">' in text:
+            logger.error('Error! Your IP address is not in the list of secure IPs. Manager must include this IP (QualysGuard VM > Users > Security).')
+            logger.error('Content = \n%s', preview(text))
+            response.release()
+            if stream:
+                await self._release(api_call)
+            return False
+        if stream:
+            return AsyncResponseStream(response, first_chunk, lambda: self._release(api_call))
+        return text
+
+    async def _release(self, api_call):
+        """ Release the rate limiter slot taken for a request whose response is done with.
+
+        """
+        if self.rate_limiter:
+            await self.rate_limiter.release(api_call)
+
+
+class AsyncScanWatcher(ScanWatcher):
+    """ ScanWatcher for an AsyncQGConnector: poll() is a coroutine, and transitions are consumed with
+    async for transition in watcher.
+
+    """
+
+    async def poll(self):
+        """ Refresh all watched scans with one list call, and return list of ScanTransitions.
+
+        """
+        if not self.scans:
+            return []
+        transitions = []
+        listed = set()
+        async for element in self.conn.iter_records(self.call, self._list_parameters(), 'SCAN', objectified=False):
+            listed.add(element.findtext('REF'))
+            transition = self._update(element)
+            if transition:
+                transitions.append(transition)
+        transitions.extend(self._drop_missing(listed))
+        return transitions
+
+    async def watch(self):
+        """ Yield ScanTransitions as they happen, polling until every watched scan has finished.
+
+        """
+        while self.scans:
+            for transition in await self.poll():
+                yield transition
+            if self.scans:
+                await asyncio.sleep(self.interval())
+
+    def __aiter__(self):
+        return self.watch()
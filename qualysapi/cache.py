@@ -0,0 +1,264 @@
+""" Module that contains the response cache QGConnector can use to serve
+repeated read-only QualysGuard API calls without going over the network.
+"""
+from __future__ import absolute_import
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+# API v2 actions that only read data.
+read_actions = set(['list', 'fetch'])
+# Words in an action-less call that imply it changes data, such as scan_cancel.php or create/was/webapp.
+mutation_words = ('launch', 'cancel', 'edit', 'add', 'delete', 'update', 'create', 'pause', 'resume', 'purge',
+                  'remove', 'activate', 'import', 'change', 'ignore', 'login', 'logout')
+# Lifetime of cached responses per call prefix, unless overridden: scan, report & session lists change as
+# scans run, so aren't cached.
+default_ttls = {'api/2.0/fo/scan/': 0, 'api/2.0/fo/report/': 0, 'api/2.0/fo/session/': 0}
+
+
+def is_read_only(api_call, http_method, data):
+    """ Return True if this (already formatted) call only reads data.
+
+    That is an API v2 call whose action is list or fetch, or an action-less call that is a GET, *_list.php,
+    search/ or count/ call, and whose name doesn't imply a change (launch, cancel, edit, add, delete, ...).
+    """
+    action = data.get('action') if isinstance(data, dict) else None
+    if isinstance(action, list):
+        # Parsed from a query string.
+        action = action[0] if action else None
+    if action is not None:
+        return str(action) in read_actions
+    if any(word in api_call for word in mutation_words):
+        return False
+    if http_method == 'get':
+        return True
+    return api_call.endswith('_list.php') or api_call.startswith(('search/', 'count/'))
+
+
+def server_key(server):
+    """ Return prefix shared by the keys of every call to server.
+
+    """
+    return hashlib.sha256(server.encode('utf-8')).hexdigest()[:16]
+
+
+def request_key(server, username, api_version, api_call, http_method, data):
+    """ Return key identifying a call, independent of parameter order, starting with its server_key.
+
+    """
+    if isinstance(data, dict):
+        data = sorted((str(name), str(value)) for name, value in data.items())
+    key = repr((server, username, str(api_version), api_call, http_method, data))
+    return '%s-%s' % (server_key(server), hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+class MemoryCache(object):
+    """ In-memory cache backend, evicting least recently used entries once max_bytes is exceeded.
+
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> (expires, content), least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                # Expired.
+                self.size -= len(entry[1])
+                return None
+            # Mark as most recently used.
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, content, ttl):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (time.time() + ttl, content)
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[1])
+                logger.debug('Evicted %s from cache.', evicted_key)
+
+    def delete_prefix(self, prefix):
+        """ Drop every entry whose key starts with prefix.
+
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self.size -= len(self._entries.pop(key)[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(object):
+    """ On-disk cache backend storing one file per entry in directory.
+
+    Least recently used files (by modification time, refreshed on every hit) are deleted once
+    max_bytes is exceeded. Safe to share between processes, as entries are written atomically.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                # First line holds the expiry time.
+                expires = float(cache_file.readline())
+                if expires < time.time():
+                    return None
+                content = cache_file.read()
+            # Mark as most recently used.
+            os.utime(path, None)
+            return content
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, key, content, ttl):
+        if len(content) > self.max_bytes:
+            return
+        path = self._path(key)
+        temporary_path = '%s.%s.%s.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        with open(temporary_path, 'wb') as cache_file:
+            cache_file.write(('%f\n' % (time.time() + ttl)).encode('ascii'))
+            cache_file.write(content)
+        # Atomic, replaces an existing entry (os.rename on Python 2).
+        getattr(os, 'replace', os.rename)(temporary_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            size = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.cache'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+                size += stat.st_size
+            for _, file_size, name in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                size -= file_size
+                logger.debug('Evicted %s from cache.', name)
+
+    def delete_prefix(self, prefix):
+        """ Delete every entry whose key starts with prefix.
+
+        """
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix) and name.endswith('.cache'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith('.cache'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+class ResponseCache(object):
+    """ Cache policy for QGConnector.request: decides which calls are cached, for how long, and under which key.
+
+    Only read-only calls are cached, see is_read_only. ttl is the default lifetime in seconds; ttls maps
+    formatted calls (or call prefixes) to their own lifetime, 0 disabling caching for them, on top of
+    default_ttls. backend defaults to a MemoryCache.
+    """
+
+    def __init__(self, backend=None, ttl=300, ttls=None):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttl = ttl
+        self.ttls = dict(default_ttls)
+        self.ttls.update(ttls or {})
+
+    @property
+    def max_entry_bytes(self):
+        """ Return size of the largest response worth buffering for the cache.
+
+        """
+        return self.backend.max_bytes
+
+    def ttl_for(self, api_call):
+        """ Return lifetime in seconds of cached responses to api_call, from the longest matching ttls prefix.
+
+        """
+        matches = [call for call in self.ttls if api_call.startswith(call)]
+        if not matches:
+            return self.ttl
+        return self.ttls[max(matches, key=len)]
+
+    def is_cacheable(self, api_version, api_call, http_method, data):
+        """ Return True if a response to this (already formatted) call may be cached.
+
+        """
+        if self.ttl_for(api_call) <= 0:
+            return False
+        return is_read_only(api_call, http_method, data)
+
+    def key(self, server, username, api_version, api_call, http_method, data):
+        """ Return cache key for a call, independent of parameter order.
+
+        """
+        return request_key(server, username, api_version, api_call, http_method, data)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, content, ttl):
+        self.backend.set(key, content, ttl)
+
+    def invalidate(self, server, api_call):
+        """ Drop every cached response from server, after (formatted) api_call changed data.
+
+        A write can change what any other call lists (adding an asset group IP changes host lists, ...), so
+        nothing cached from server is kept.
+        """
+        logger.debug('Invalidating cached responses from %s after api_call, %s', server, api_call)
+        self.backend.delete_prefix(server_key(server))
+
+    def clear(self):
+        """ Drop every cached response.
+
+        """
+        self.backend.clear()
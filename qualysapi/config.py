@@ -52,7 +52,7 @@ class QualysConnectConfig:
 
             # apply bitmask to current mode to check ONLY user access permissions.
             if (mode & (stat.S_IRWXG | stat.S_IRWXO)) != 0:
-                logger.warning('%s permissions allows more than user access.' % (filename,))
+                logger.warning('%s permissions allows more than user access.', filename)
 
             self._cfgparse.read(self._cfgfile)
 
@@ -82,6 +82,14 @@ class QualysConnectConfig:
             self._cfgparse.set('info', 'max_retries', str(self.max_retries))
         self.max_retries = int(self.max_retries)
 
+        # Connection pool & timeout tuning.
+        self.pool_connections = self._get_number('pool_connections', int)
+        self.pool_maxsize = self._get_number('pool_maxsize', int)
+        self.pool_block = self._cfgparse.getboolean('info', 'pool_block')
+        # No timeout unless one is provided.
+        self.connect_timeout = self._get_number('connect_timeout', float)
+        self.read_timeout = self._get_number('read_timeout', float)
+
         # Proxy support
         proxy_config = proxy_url = proxy_protocol = proxy_port = proxy_username = proxy_password = None
         # User requires proxy?
@@ -109,7 +117,7 @@ class QualysConnectConfig:
                     proxy_port_url = proxy_port
                     proxy_port = self._cfgparse.get('proxy', 'proxy_port')
                     logger.warning('Proxy port from url overwritten by specified proxy_port from config:')
-                    logger.warning('%s --> %s' % (proxy_port_url, proxy_port))
+                    logger.warning('%s --> %s', proxy_port_url, proxy_port)
                 else:
                     proxy_port = self._cfgparse.get('proxy', 'proxy_port')
             if not proxy_port:
@@ -162,7 +170,10 @@ class QualysConnectConfig:
             password = getpass.getpass('QualysGuard Password: ')
             self._cfgparse.set('info', 'password', password)
 
-        logger.debug(self._cfgparse.items('info'))
+        if logger.isEnabledFor(logging.DEBUG):
+            # Never log the password.
+            logger.debug([(option, '********' if option == 'password' else value)
+                          for option, value in self._cfgparse.items('info')])
 
         if remember_me or remember_me_always:
             # Let's create that config file for next time...
@@ -186,6 +197,19 @@ class QualysConnectConfig:
                 self._cfgparse.write(config_file)
                 config_file.close()
 
+    def _get_number(self, option, number_type):
+        """ Return [info] option converted to number_type, or None if it isn't set.
+
+        """
+        if not self._cfgparse.has_option('info', option):
+            return None
+        try:
+            return number_type(self._cfgparse.get('info', option))
+        except ValueError:
+            logger.error('Value %s must be a number.', option)
+            print('Value %s must be a number.' % option)
+            exit(1)
+
     def get_config_filename(self):
         return self._cfgfile
 
@@ -8,6 +8,8 @@ __license__ = 'Apache License 2.0'
 and requesting data from it.
 """
 import logging
+import re
+import threading
 import time
 
 try:
@@ -16,11 +18,17 @@ except ImportError:
     from urlparse import urlparse
 
 from collections import defaultdict
+from xml.sax.saxutils import escape, quoteattr
 
 import requests
 
 import qualysapi.version
 import qualysapi.api_methods
+import qualysapi.cache
+import qualysapi.metrics
+import qualysapi.ratelimit
+import qualysapi.routing
+import qualysapi.streaming
 
 import qualysapi.api_actions
 import qualysapi.api_actions as api_actions
@@ -35,18 +43,186 @@ except ImportError as e:
         'Warning: Cannot consume lxml.builder E objects without lxml. Send XML strings for AM & WAS API calls.')
 
 
+try:
+    string_types = (basestring,)
+except NameError:
+    string_types = (str,)
+
+# Characters of a request or response body written to logs & error output.
+LOG_PREVIEW_SIZE = 2048
+
+# Parameters & headers whose values are never logged.
+secret_names = ('password', 'authorization', 'proxy-authorization', 'cookie', 'set-cookie')
+
+# Credentials in form data, Portal API XML and proxy URLs.
+_secrets = re.compile(r'(password=|<password>|://[^/@\s:]+:)[^&<@\s]*', re.IGNORECASE)
+
+
+def preview(value, size=LOG_PREVIEW_SIZE):
+    """ Return text to log for a body, dict or headers: credentials masked, cut after size characters.
+
+    """
+    if hasattr(value, 'items'):
+        value = dict((name, '********' if str(name).lower() in secret_names else item) for name, item in value.items())
+    elif isinstance(value, bytes):
+        # Only decode what is shown.
+        text = value[:size].decode('utf-8', 'replace')
+    if not isinstance(value, bytes):
+        value = value if isinstance(value, string_types) else str(value)
+        text = value[:size]
+    if len(value) > size:
+        text += '... (%d more)' % (len(value) - size)
+    return _secrets.sub(r'\1********', text)
+
+
+def concurrent_scans_exceeded(response):
+    """ Return True if QualysGuard API response reports the maximum number of concurrent running scans.
+
+    """
+    return ('<responseCode>INVALID_REQUEST</responseCode>' in response and
+            '<errorMessage>You have reached the maximum number of concurrent running scans' in response and
+            '<errorResolution>Please wait until your previous scans have completed</errorResolution>' in response)
+
+
+def service_request(filters=None, start_from_id=None, limit_results=None):
+    """ Return Portal API (AM, WAS) ServiceRequest XML string.
+
+    filters is a dict of field: value (EQUALS criteria), or a list of (field, operator, value) criteria.
+    """
+    if isinstance(filters, dict):
+        filters = [(field, 'EQUALS', value) for field, value in sorted(filters.items())]
+    xml = '<ServiceRequest>'
+    if filters:
+        xml += '<filters>'
+        for field, operator, value in filters:
+            xml += '<Criteria field=%s operator=%s>%s</Criteria>' % (quoteattr(str(field)), quoteattr(str(operator)),
+                                                                    escape(str(value)))
+        xml += '</filters>'
+    if start_from_id is not None or limit_results is not None:
+        xml += '<preferences>'
+        if start_from_id is not None:
+            xml += '<startFromId>%d</startFromId>' % start_from_id
+        if limit_results is not None:
+            xml += '<limitResults>%d</limitResults>' % limit_results
+        xml += '</preferences>'
+    return xml + '</ServiceRequest>'
+
+
+class ResponseInfo(object):
+    """ Metadata about the last QualysGuard API request made by a thread, see QGConnector.last_response.
+
+    """
+
+    def __init__(self, api_call, api_version, url, http_method):
+        self.api_call = api_call
+        self.api_version = api_version
+        self.url = url
+        self.http_method = http_method
+        self.status_code = None
+        self.headers = None
+        # Wall clock time the request started, seconds until the last attempt's response headers arrived,
+        # and seconds spent in request() so far, including retries & rate limit waits.
+        self.started = time.time()
+        self.elapsed = None
+        self.duration = None
+        # True if served from the response cache, without any attempt.
+        self.cached = False
+        # True if shared from an identical request in flight, without any attempt.
+        self.coalesced = False
+        self.attempts = 0
+        self.concurrent_scans_retries = 0
+        self.rate_limit_retries = 0
+        # True if request() gave up because the concurrent scan limit was still reached.
+        self.concurrent_scans_exceeded = False
+
+    def __repr__(self):
+        return '<ResponseInfo %s %s: %s in %.3fs>' % (self.http_method, self.api_call, self.status_code,
+                                                      self.duration or 0)
+
+
+class _Flight(object):
+    """ Read request in flight, whose response identical concurrent requests wait for and share.
+
+    """
+
+    def __init__(self):
+        self.thread = threading.current_thread().ident
+        self.content = None
+        self._landed = threading.Event()
+
+    def land(self, content):
+        """ Publish response body (None if the request failed or the body wasn't kept) to waiting requests.
+
+        """
+        self.content = content
+        self._landed.set()
+
+    def wait(self, timeout=None):
+        """ Return response body, or None if it isn't available within timeout seconds.
+
+        """
+        self._landed.wait(timeout)
+        return self.content
+
+
 class QGConnector(api_actions.QGActions):
     """ Qualys Connection class which allows requests to the QualysGuard API using HTTP-Basic Authentication (over SSL).
 
+    With auth_mode='session', API v2 calls instead authenticate once through api/2.0/fo/session/ and reuse the
+    QualysSession cookie, logging in again when the session expires. Use the connector as a context manager,
+    or call close(), to log out.
+
+    Thread safety: one connector may be shared by many threads. request() keeps per call state local,
+    rate limit bookkeeping, the rate limiter and session logins are locked, and the requests.Session
+    connection pool is shared (size it with pool_maxsize). last_response is tracked per thread.
+    Identical read requests made while a buffered (not streamed) one is in flight wait for it, up to
+    single_flight_timeout seconds, and share its response (single_flight).
+    Every HTTP attempt (retries included) is passed as a qualysapi.metrics.AttemptRecord to the hooks,
+    such as a qualysapi.metrics.MetricsAggregator.
+    Don't reconfigure the connector (auth, server, proxies, session adapters) while requests are in flight.
     """
 
-    def __init__(self, auth, server='qualysapi.qualys.com', proxies=None, max_retries=3):
+    def __init__(self, auth, server='qualysapi.qualys.com', proxies=None, max_retries=3, rate_limiter=True,
+                 max_rate_limit_retries=3, auth_mode='basic', pool_connections=10, pool_maxsize=10, pool_block=False,
+                 connect_timeout=None, read_timeout=None, cache=None, single_flight=True,
+                 single_flight_timeout=60, hooks=None):
         # Read username & password from file, if possible.
         self.auth = auth
+        # Authenticate with HTTP-Basic on every call ('basic'), or with a session cookie ('session').
+        if auth_mode not in ('basic', 'session'):
+            raise Exception("Unknown QualysGuard authentication mode (%s)" % (auth_mode,))
+        self.auth_mode = auth_mode
+        self.logged_in = False
+        # Serialize session logins between threads.
+        self._login_lock = threading.Lock()
         # Remember QualysGuard API server.
         self.server = server
         # Remember rate limits per call.
         self.rate_limit_remaining = defaultdict(int)
+        # Guards rate_limit_remaining & concurrency_limit, shared between threads.
+        self._rate_limit_lock = threading.Lock()
+        # Per thread state, such as last_response.
+        self._local = threading.local()
+        # Remember concurrency limits per call.
+        self.concurrency_limit = {}
+        # Pace requests per call from the rate limit headers (True for default scheduler, False to disable).
+        if rate_limiter is True:
+            rate_limiter = qualysapi.ratelimit.RateLimiter()
+        self.rate_limiter = rate_limiter or None
+        # Retry this many times when QualysGuard answers 409 with a wait time.
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # Cache responses to read-only calls (True for default in-memory cache, or a qualysapi.cache.ResponseCache).
+        if cache is True:
+            cache = qualysapi.cache.ResponseCache()
+        self.cache = cache or None
+        # Share responses between identical read requests made concurrently. Only buffered requests lead,
+        # so a slow stream consumer never holds others up; they wait at most single_flight_timeout seconds.
+        self.single_flight = single_flight
+        self.single_flight_timeout = single_flight_timeout
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        # Callables passed a qualysapi.metrics.AttemptRecord after every HTTP attempt.
+        self.hooks = list(hooks or [])
         # api_methods: Define method algorithm in a dict of set.
         # Naming convention: api_methods[api_version optional_blah] due to api_methods_with_trailing_slash testing.
         self.api_methods = qualysapi.api_methods.api_methods
@@ -54,157 +230,158 @@ class QGConnector(api_actions.QGActions):
         # Keep track of methods with ending slashes to autocorrect user when they forgot slash.
         self.api_methods_with_trailing_slash = qualysapi.api_methods.api_methods_with_trailing_slash
         self.proxies = proxies
-        logger.debug('proxies = \n%s' % proxies)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('proxies = \n%s', preview(proxies))
         # Set up requests max_retries.
-        logger.debug('max_retries = \n%s' % max_retries)
+        logger.debug('max_retries = \n%s', max_retries)
+        # Size connection pool so that threads sharing the connector don't discard connections.
+        logger.debug('pool_connections = %s, pool_maxsize = %s, pool_block = %s',
+                     pool_connections, pool_maxsize, pool_block)
         self.session = requests.Session()
-        http_max_retries = requests.adapters.HTTPAdapter(max_retries=max_retries)
-        https_max_retries = requests.adapters.HTTPAdapter(max_retries=max_retries)
+        http_max_retries = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                                         max_retries=max_retries, pool_block=pool_block)
+        https_max_retries = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                                          max_retries=max_retries, pool_block=pool_block)
         self.session.mount('http://', http_max_retries)
         self.session.mount('https://', https_max_retries)
+        # Set up (connect, read) timeouts in seconds, None waits forever.
+        self.timeout = (connect_timeout, read_timeout)
+        logger.debug('timeout = \n%s', self.timeout)
 
     def __call__(self):
         return self
 
+    @property
+    def last_response(self):
+        """ Return ResponseInfo for the last request made by the calling thread, or None.
+
+        """
+        return getattr(self._local, 'last_response', None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_hook(self, hook):
+        """ Register hook(record) to be passed a qualysapi.metrics.AttemptRecord after every HTTP attempt;
+        returns hook, so it can decorate.
+
+        Hooks run on the requesting thread, so they should be quick; exceptions they raise are logged and ignored.
+        """
+        self.hooks.append(hook)
+        return hook
+
+    def _emit(self, attempt, response_bytes=None):
+        """ Finish attempt and pass it to the hooks.
+
+        """
+        if attempt is None:
+            return
+        attempt.finish(response_bytes)
+        for hook in self.hooks:
+            try:
+                hook(attempt)
+            except Exception:
+                logger.exception('Metrics hook %r failed.', hook)
+
+    def close(self):
+        """ Log out of the QualysGuard session, if any, and release pooled connections.
+
+        """
+        if self.logged_in:
+            self.logout()
+        self.session.close()
+
+    def login(self):
+        """ Log in through api/2.0/fo/session/ so later API v2 calls are authenticated by the QualysSession cookie.
+
+        """
+        api_call, api_version, url, http_method, headers, data = self.prepare_request(
+            'api/2.0/fo/session/', {'action': 'login', 'username': self.auth[0], 'password': self.auth[1]})
+        logger.debug('Logging in to QualysGuard session.')
+        request = self.session.post(url, data=data, headers=headers, proxies=self.proxies, timeout=self.timeout)
+        request.raise_for_status()
+        if 'QualysSession' not in self.session.cookies:
+            logger.error('Content = \n%s', preview(request.content))
+            raise Exception("QualysGuard session login failed, no QualysSession cookie received.")
+        self.logged_in = True
+
+    def logout(self):
+        """ Log out of the QualysGuard session.
+
+        """
+        api_call, api_version, url, http_method, headers, data = self.prepare_request(
+            'api/2.0/fo/session/', {'action': 'logout'})
+        logger.debug('Logging out of QualysGuard session.')
+        try:
+            self.session.post(url, data=data, headers=headers, proxies=self.proxies, timeout=self.timeout)
+        finally:
+            self.logged_in = False
+            self.session.cookies.clear()
+
+    def _relogin(self, cookie):
+        """ Log in again, unless another thread already replaced the expired cookie.
+
+        """
+        with self._login_lock:
+            if self.session.cookies.get('QualysSession') == cookie:
+                self.login()
+
+    def request_auth(self, api_version):
+        """ Return requests auth to send with a call to api_version, logging in first if needed.
+
+        """
+        if self.auth_mode != 'session' or api_version != 2:
+            # Portal APIs (& API v1) only support HTTP-Basic Authentication.
+            return self.auth
+        if not self.logged_in:
+            with self._login_lock:
+                if not self.logged_in:
+                    self.login()
+        return None
+
     def format_api_version(self, api_version):
         """ Return QualysGuard API version for api_version specified.
 
         """
-        # Convert to int.
-        if type(api_version) == str:
-            api_version = api_version.lower()
-            if api_version[0] == 'v' and api_version[1].isdigit():
-                # Remove first 'v' in case the user typed 'v1' or 'v2', etc.
-                api_version = api_version[1:]
-            # Check for input matching Qualys modules.
-            if api_version in ('asset management', 'assets', 'tag', 'tagging', 'tags'):
-                # Convert to Asset Management API.
-                api_version = 'am'
-            elif api_version in ('am2'):
-                # Convert to Asset Management API v2
-                api_version = 'am2'
-            elif api_version in ('webapp', 'web application scanning', 'webapp scanning'):
-                # Convert to WAS API.
-                api_version = 'was'
-            elif api_version in ('pol', 'pc'):
-                # Convert PC module to API number 2.
-                api_version = 2
-            else:
-                api_version = int(api_version)
-        return api_version
+        return qualysapi.routing.parse_api_version(api_version)
 
     def which_api_version(self, api_call):
         """ Return QualysGuard API version for api_call specified.
 
         """
-        # Leverage patterns of calls to API methods.
-        if api_call.endswith('.php'):
-            # API v1.
-            return 1
-        elif api_call.startswith('api/2.0/'):
-            # API v2.
-            return 2
-        elif '/am/' in api_call:
-            # Asset Management API.
-            return 'am'
-        elif '/was/' in api_call:
-            # WAS API.
-            return 'was'
-        return False
+        return qualysapi.routing.detect_api_version(api_call)
 
     def url_api_version(self, api_version):
         """ Return base API url string for the QualysGuard api_version and server.
 
         """
         # Set base url depending on API version.
-        if api_version == 1:
-            # QualysGuard API v1 url.
-            url = "https://%s/msp/" % (self.server,)
-        elif api_version == 2:
-            # QualysGuard API v2 url.
-            url = "https://%s/" % (self.server,)
-        elif api_version == 'was':
-            # QualysGuard REST v3 API url (Portal API).
-            url = "https://%s/qps/rest/3.0/" % (self.server,)
-        elif api_version == 'am':
-            # QualysGuard REST v1 API url (Portal API).
-            url = "https://%s/qps/rest/1.0/" % (self.server,)
-        elif api_version == 'am2':
-            # QualysGuard REST v1 API url (Portal API).
-            url = "https://%s/qps/rest/2.0/" % (self.server,)
-        else:
+        if api_version not in qualysapi.routing.base_paths:
             raise Exception("Unknown QualysGuard API Version Number (%s)" % (api_version,))
-        logger.debug("Base url =\n%s" % (url))
+        url = "https://%s/%s" % (self.server, qualysapi.routing.base_paths[api_version])
+        logger.debug("Base url =\n%s", url)
         return url
 
     def format_http_method(self, api_version, api_call, data):
         """ Return QualysGuard API http method, with POST preferred..
 
         """
-        # Define get methods for automatic http request methodology.
-        #
-        # All API v2 requests are POST methods.
-        if api_version == 2:
-            return 'post'
-        elif api_version == 1:
-            if api_call in self.api_methods['1 post']:
-                return 'post'
-            else:
-                return 'get'
-        elif api_version == 'was':
-            # WAS API call.
-            # Because WAS API enables user to GET API resources in URI, let's chop off the resource.
-            # '/download/was/report/18823' --> '/download/was/report/'
-            api_call_endpoint = api_call[:api_call.rfind('/') + 1]
-            if api_call_endpoint in self.api_methods['was get']:
-                return 'get'
-            # Post calls with no payload will result in HTTPError: 415 Client Error: Unsupported Media Type.
-            if not data:
-                # No post data. Some calls change to GET with no post data.
-                if api_call_endpoint in self.api_methods['was no data get']:
-                    return 'get'
-                else:
-                    return 'post'
-            else:
-                # Call with post data.
-                return 'post'
-        else:
-            # Asset Management API call.
-            if api_call in self.api_methods['am get']:
-                return 'get'
-            else:
-                return 'post'
+        return qualysapi.routing.default_http_method(api_version, api_call, data)
 
     def preformat_call(self, api_call):
         """ Return properly formatted QualysGuard API call.
 
         """
-        # Remove possible starting slashes or trailing question marks in call.
-        api_call_formatted = api_call.lstrip('/')
-        api_call_formatted = api_call_formatted.rstrip('?')
-        if api_call != api_call_formatted:
-            # Show difference
-            logger.debug('api_call post strip =\n%s' % api_call_formatted)
-        return api_call_formatted
+        return qualysapi.routing.strip_call(api_call)
 
     def format_call(self, api_version, api_call):
         """ Return properly formatted QualysGuard API call according to api_version etiquette.
 
         """
-        # Remove possible starting slashes or trailing question marks in call.
-        api_call = api_call.lstrip('/')
-        api_call = api_call.rstrip('?')
-        logger.debug('api_call post strip =\n%s' % api_call)
-        # Make sure call always ends in slash for API v2 calls.
-        if (api_version == 2 and api_call[-1] != '/'):
-            # Add slash.
-            logger.debug('Adding "/" to api_call.')
-            api_call += '/'
-        if api_call in self.api_methods_with_trailing_slash[api_version]:
-            # Add slash.
-            logger.debug('Adding "/" to api_call.')
-            api_call += '/'
-        return api_call
+        return qualysapi.routing.normalize_call(api_version, api_call)
 
     def format_payload(self, api_version, data):
         """ Return appropriate QualysGuard API call.
@@ -215,131 +392,322 @@ class QGConnector(api_actions.QGActions):
             # Check if string type.
             if type(data) == str:
                 # Convert to dictionary.
-                logger.debug('Converting string to dict:\n%s' % data)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Converting string to dict:\n%s', preview(data))
                 # Remove possible starting question mark & ending ampersands.
                 data = data.lstrip('?')
                 data = data.rstrip('&')
                 # Convert to dictionary.
                 data = urlparse.parse_qs(data)
-                logger.debug('Converted:\n%s' % str(data))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Converted:\n%s', preview(data))
         elif api_version in ('am', 'was', 'am2'):
             if type(data) == etree._Element:
                 logger.debug('Converting lxml.builder.E to string')
                 data = etree.tostring(data)
-                logger.debug('Converted:\n%s' % data)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Converted:\n%s', preview(data))
         return data
 
-    def request(self, api_call, data=None, api_version=None, http_method=None, concurrent_scans_retries=0,
-                concurrent_scans_retry_delay=0):
-        """ Return QualysGuard API response.
+    def prepare_request(self, api_call, data=None, api_version=None, http_method=None):
+        """ Return formatted (api_call, api_version, url, http_method, headers, data) for a QualysGuard API request.
 
+        API version, call & default http method come from qualysapi.routing, in a single lookup for known calls.
         """
-        logger.debug('api_call =\n%s' % api_call)
-        logger.debug('api_version =\n%s' % api_version)
-        logger.debug('data %s =\n %s' % (type(data), str(data)))
-        logger.debug('http_method =\n%s' % http_method)
-        logger.debug('concurrent_scans_retries =\n%s' % str(concurrent_scans_retries))
-        logger.debug('concurrent_scans_retry_delay =\n%s' % str(concurrent_scans_retry_delay))
-        concurrent_scans_retries = int(concurrent_scans_retries)
-        concurrent_scans_retry_delay = int(concurrent_scans_retry_delay)
-        #
-        # Determine API version.
-        # Preformat call.
-        api_call = self.preformat_call(api_call)
-        if api_version:
-            # API version specified, format API version inputted.
-            api_version = self.format_api_version(api_version)
-        else:
-            # API version not specified, determine automatically.
-            api_version = self.which_api_version(api_call)
+        route = qualysapi.routing.resolve(api_call, api_version)
+        api_version = route.api_version
         #
         # Set up base url.
         url = self.url_api_version(api_version)
         #
         # Set up headers.
         headers = {"X-Requested-With": "Parag Baxi QualysAPI (python) v%s" % (qualysapi.version.__version__,)}
-        logger.debug('headers =\n%s' % (str(headers)))
+        logger.debug('headers =\n%s', headers)
         # Portal API takes in XML text, requiring custom header.
         if api_version in ('am', 'was', 'am2'):
             headers['Content-type'] = 'text/xml'
         #
         # Set up http request method, if not specified.
         if not http_method:
-            http_method = self.format_http_method(api_version, api_call, data)
-        logger.debug('http_method =\n%s' % http_method)
+            http_method = route.default_http_method(data)
+        logger.debug('http_method =\n%s', http_method)
         #
         # Format API call.
-        api_call = self.format_call(api_version, api_call)
-        logger.debug('api_call =\n%s' % (api_call))
+        api_call = route.api_call
+        logger.debug('api_call =\n%s', api_call)
         # Append api_call to url.
         url += api_call
         #
         # Format data, if applicable.
         if data is not None:
             data = self.format_payload(api_version, data)
-        # Make request at least once (more if concurrent_retry is enabled).
-        retries = 0
-        #
+        return api_call, api_version, url, http_method, headers, data
+
+    def update_rate_limits(self, api_call, headers):
+        """ Remember rate & concurrency limits for api_call from QualysGuard API response headers.
+
+        """
+        with self._rate_limit_lock:
+            self._update_rate_limits(api_call, headers)
+
+    def _update_rate_limits(self, api_call, headers):
         # set a warning threshold for the rate limit
         rate_warn_threshold = 10
+        # Remember how many times left user can make against api_call.
+        try:
+            self.rate_limit_remaining[api_call] = int(headers['x-ratelimit-remaining'])
+            logger.debug('rate limit for api_call, %s = %s', api_call, self.rate_limit_remaining[api_call])
+            if (self.rate_limit_remaining[api_call] > rate_warn_threshold):
+                logger.debug('rate limit for api_call, %s = %s', api_call, self.rate_limit_remaining[api_call])
+            elif (self.rate_limit_remaining[api_call] <= rate_warn_threshold) and (self.rate_limit_remaining[api_call] > 0):
+                logger.warning('Rate limit is about to being reached (remaining api calls = %s)',
+                               self.rate_limit_remaining[api_call])
+            elif self.rate_limit_remaining[api_call] <= 0:
+                logger.critical('ATTENTION! RATE LIMIT HAS BEEN REACHED (remaining api calls = %s)!',
+                                self.rate_limit_remaining[api_call])
+        except KeyError as e:
+            # Likely a bad api_call.
+            logger.debug(e)
+            pass
+        except TypeError as e:
+            # Likely an asset search api_call.
+            logger.debug(e)
+            pass
+        # Remember how many requests against api_call may run at once.
+        if 'x-concurrency-limit-limit' in headers:
+            self.concurrency_limit[api_call] = int(headers['x-concurrency-limit-limit'])
+            logger.debug('concurrency limit for api_call, %s = %s', api_call, self.concurrency_limit[api_call])
+
+    def request(self, api_call, data=None, api_version=None, http_method=None, concurrent_scans_retries=0,
+                concurrent_scans_retry_delay=0, stream=False, headers=None, cache=True):
+        """ Return QualysGuard API response.
+
+        With stream=True, return a qualysapi.streaming.ResponseStream instead of a string. The body is
+        then read from the socket as it is consumed, and error checks only look at the first chunk.
+        headers are extra HTTP request headers (such as Range); such requests are neither cached nor shared.
+        With cache=False, the response cache is bypassed (but not updated) for this call. Calls that
+        change data drop cached responses to the same api_call.
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('api_call =\n%s', api_call)
+            logger.debug('api_version =\n%s', api_version)
+            logger.debug('data %s =\n %s', type(data), preview(data))
+            logger.debug('http_method =\n%s', http_method)
+            logger.debug('concurrent_scans_retries =\n%s', concurrent_scans_retries)
+            logger.debug('concurrent_scans_retry_delay =\n%s', concurrent_scans_retry_delay)
+            logger.debug('stream =\n%s', stream)
+        extra_headers = headers
+        concurrent_scans_retries = int(concurrent_scans_retries)
+        concurrent_scans_retry_delay = int(concurrent_scans_retry_delay)
+        api_call, api_version, url, http_method, headers, data = self.prepare_request(api_call, data, api_version,
+                                                                                       http_method)
+        if extra_headers:
+            headers.update(extra_headers)
+        # Expose metadata to the calling thread only.
+        info = ResponseInfo(api_call, api_version, url, http_method)
+        self._local.last_response = info
+        # Serve read-only calls from cache, if possible.
+        cache_key = None
+        if self.cache and not qualysapi.cache.is_read_only(api_call, http_method, data):
+            try:
+                return self._request(info, api_call, api_version, url, http_method, headers, data,
+                                     concurrent_scans_retries, concurrent_scans_retry_delay, stream, None, 0)
+            finally:
+                # Even a failed call may have changed data.
+                self.cache.invalidate(self.server, api_call)
+        if cache and self.cache and not extra_headers and self.cache.is_cacheable(api_version, api_call, http_method, data):
+            cache_key = self.cache.key(self.server, self.auth[0], api_version, api_call, http_method, data)
+            content = self.cache.get(cache_key)
+            if content is not None:
+                logger.debug('Cache hit for api_call, %s', api_call)
+                info.cached = True
+                info.duration = time.time() - info.started
+                if stream:
+                    return qualysapi.streaming.ResponseStream(None, content, iter(()))
+                return str(content)
+        # Share the response of an identical read request already in flight.
+        flight = None
+        if self.single_flight and not extra_headers and qualysapi.cache.is_read_only(api_call, http_method, data):
+            flight_key = qualysapi.cache.request_key(self.server, self.auth[0], api_version, api_call, http_method,
+                                                     data)
+            with self._flights_lock:
+                flight = self._flights.get(flight_key)
+                # Streams don't lead: their body is only complete once the caller has read all of it.
+                leading = flight is None and not stream
+                if leading:
+                    flight = self._flights[flight_key] = _Flight()
+            if flight is not None and not leading:
+                # The thread in flight may be this one, calling back in from a metrics hook.
+                content = None
+                if flight.thread != threading.current_thread().ident:
+                    content = flight.wait(self.single_flight_timeout)
+                if content is not None:
+                    logger.debug('Shared response in flight for api_call, %s', api_call)
+                    info.coalesced = True
+                    info.duration = time.time() - info.started
+                    if stream:
+                        return qualysapi.streaming.ResponseStream(None, content, iter(()))
+                    return str(content)
+                # Request in flight failed or is too slow, make our own.
+                flight = None
+        if not (cache_key or flight):
+            return self._request(info, api_call, api_version, url, http_method, headers, data,
+                                 concurrent_scans_retries, concurrent_scans_retry_delay, stream, None, 0)
+        cache_ttl = self.cache.ttl_for(api_call) if cache_key else 0
+
+        def complete(content):
+            # Whole body received (None if it failed or was too large to keep).
+            if flight:
+                with self._flights_lock:
+                    if self._flights.get(flight_key) is flight:
+                        del self._flights[flight_key]
+                flight.land(content)
+            if cache_key and content is not None:
+                self.cache.set(cache_key, content, cache_ttl)
+        max_bytes = self.cache.max_entry_bytes if cache_key else 0
+        try:
+            response = self._request(info, api_call, api_version, url, http_method, headers, data,
+                                     concurrent_scans_retries, concurrent_scans_retry_delay, stream, complete,
+                                     max_bytes)
+        except BaseException:
+            complete(None)
+            raise
+        if not response:
+            complete(None)
+        return response
+
+    def _request(self, info, api_call, api_version, url, http_method, headers, data, concurrent_scans_retries,
+                 concurrent_scans_retry_delay, stream, on_complete, max_bytes):
+        """ Make request (retrying as needed) and return response, passing the whole body to on_complete.
+
+        """
+        # Make request at least once (more if concurrent_retry is enabled).
+        retries = 0
+        rate_limit_retries = 0
+        relogged_in = False
         while retries <= concurrent_scans_retries:
             # Make request.
-            logger.debug('url =\n%s' % (str(url)))
-            logger.debug('data =\n%s' % (str(data)))
-            logger.debug('headers =\n%s' % (str(headers)))
-            if http_method == 'get':
-                # GET
-                logger.debug('GET request.')
-                request = self.session.get(url, params=data, auth=self.auth, headers=headers, proxies=self.proxies)
-            else:
-                # POST
-                logger.debug('POST request.')
-                # Make POST request.
-                request = self.session.post(url, data=data, auth=self.auth, headers=headers, proxies=self.proxies)
-            logger.debug('response headers =\n%s' % (str(request.headers)))
-            #
-            # Remember how many times left user can make against api_call.
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('url =\n%s', url)
+                logger.debug('data =\n%s', preview(data))
+                logger.debug('headers =\n%s', preview(headers))
+            auth = self.request_auth(api_version)
+            cookie = self.session.cookies.get('QualysSession')
+            # Wait for the rate limit scheduler to allow the call.
+            request = None
+            if self.rate_limiter:
+                self.rate_limiter.acquire(api_call)
+            attempt = None
+            if self.hooks:
+                attempt = qualysapi.metrics.AttemptRecord(api_call, api_version, http_method, info.attempts + 1)
             try:
-                self.rate_limit_remaining[api_call] = int(request.headers['x-ratelimit-remaining'])
-                logger.debug('rate limit for api_call, %s = %s' % (api_call, self.rate_limit_remaining[api_call]))
-                if (self.rate_limit_remaining[api_call] > rate_warn_threshold):
-                    logger.debug('rate limit for api_call, %s = %s' % (api_call, self.rate_limit_remaining[api_call]))
-                elif (self.rate_limit_remaining[api_call] <= rate_warn_threshold) and (self.rate_limit_remaining[api_call] > 0):
-                    logger.warning('Rate limit is about to being reached (remaining api calls = %s)' % self.rate_limit_remaining[api_call])
-                elif self.rate_limit_remaining[api_call] <= 0:
-                    logger.critical('ATTENTION! RATE LIMIT HAS BEEN REACHED (remaining api calls = %s)!' % self.rate_limit_remaining[api_call])
-            except KeyError as e:
-                # Likely a bad api_call.
-                logger.debug(e)
-                pass
-            except TypeError as e:
-                # Likely an asset search api_call.
-                logger.debug(e)
-                pass
+                if http_method == 'get':
+                    # GET
+                    logger.debug('GET request.')
+                    request = self.session.get(url, params=data, auth=auth, headers=headers,
+                                               proxies=self.proxies, stream=stream, timeout=self.timeout)
+                else:
+                    # POST
+                    logger.debug('POST request.')
+                    # Make POST request.
+                    request = self.session.post(url, data=data, auth=auth, headers=headers,
+                                                proxies=self.proxies, stream=stream, timeout=self.timeout)
+            except Exception as e:
+                if attempt:
+                    attempt.error = type(e).__name__
+                    self._emit(attempt)
+                raise
+            finally:
+                if self.rate_limiter:
+                    if stream and request is not None:
+                        # Slot is released once the caller is done with the stream.
+                        self.rate_limiter.update(api_call, request.headers)
+                    else:
+                        self.rate_limiter.release(api_call, request.headers if request is not None else None)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('response headers =\n%s', preview(request.headers))
+            info.attempts += 1
+            info.status_code = request.status_code
+            info.headers = request.headers
+            info.elapsed = request.elapsed.total_seconds()
+            info.duration = time.time() - info.started
+            info.concurrent_scans_retries = retries
+            info.rate_limit_retries = rate_limit_retries
+            if attempt:
+                attempt.received(request, retries, rate_limit_retries)
+            #
+            self.update_rate_limits(api_call, request.headers)
+            # Check for expired QualysGuard session.
+            if request.status_code == 401 and auth is None and not relogged_in:
+                relogged_in = True
+                request.close()
+                self._release_stream(api_call, stream)
+                self._emit(attempt)
+                logger.info('QualysGuard session expired, logging in again.')
+                self._relogin(cookie)
+                continue
+            # Check for rate or concurrency limit exceeded.
+            towait = qualysapi.ratelimit.int_header(request.headers, 'x-ratelimit-towait-sec')
+            if request.status_code == 409 and towait and rate_limit_retries < self.max_rate_limit_retries:
+                rate_limit_retries += 1
+                request.close()
+                self._release_stream(api_call, stream)
+                self._emit(attempt)
+                logger.warning('Rate limit exceeded for %s, waiting %d seconds until retry #%d.',
+                               api_call, towait, rate_limit_retries)
+                if not self.rate_limiter:
+                    time.sleep(towait)
+                # Otherwise the scheduler holds the next call back for exactly towait seconds.
+                continue
             # Response received.
-            response = str(request.content)
-            logger.debug('response text =\n%s' % (response))
+            if stream:
+                # Only pull the first chunk off the wire; it is enough to detect QualysGuard errors.
+                chunks = request.iter_content(chunk_size=qualysapi.streaming.CHUNK_SIZE)
+                if self.rate_limiter:
+                    chunks = qualysapi.streaming.iter_closing(chunks, lambda: self.rate_limiter.release(api_call))
+                try:
+                    first_chunk = next(chunks, b'')
+                except BaseException:
+                    request.close()
+                    if self.rate_limiter:
+                        chunks.close()
+                    raise
+                if attempt:
+                    # Attempt ends once the caller is done with the stream.
+                    chunks = qualysapi.streaming.iter_counted(
+                        chunks, lambda size, attempt=attempt: self._emit(attempt, size), first_chunk)
+                response = first_chunk.decode('utf-8', 'replace')
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('response first chunk =\n%s', preview(first_chunk))
+            else:
+                response = str(request.content)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('response text =\n%s', preview(request.content))
+                self._emit(attempt, len(request.content))
             # Keep track of how many retries.
             retries += 1
             # Check for concurrent scans limit.
-            if not ('<responseCode>INVALID_REQUEST</responseCode>' in response and
-                    '<errorMessage>You have reached the maximum number of concurrent running scans' in response and
-                    '<errorResolution>Please wait until your previous scans have completed</errorResolution>' in response):
+            if not concurrent_scans_exceeded(response):
                 # Did not hit concurrent scan limit.
                 break
             else:
                 # Hit concurrent scan limit.
-                logger.critical(response)
+                logger.critical(preview(response))
+                if stream:
+                    # Release connection before retrying.
+                    request.close()
+                    chunks.close()
                 # If trying again, delay next try by concurrent_scans_retry_delay.
                 if retries <= concurrent_scans_retries:
-                    logger.warning('Waiting %d seconds until next try.' % concurrent_scans_retry_delay)
+                    logger.warning('Waiting %d seconds until next try.', concurrent_scans_retry_delay)
                     time.sleep(concurrent_scans_retry_delay)
                     # Inform user of how many retries.
-                    logger.critical('Retry #%d' % retries)
+                    logger.critical('Retry #%d', retries)
                 else:
                     # Ran out of retries. Let user know.
                     print('Alert! Ran out of concurrent_scans_retries!')
                     logger.critical('Alert! Ran out of concurrent_scans_retries!')
+                    info.concurrent_scans_exceeded = True
                     return False
         # Check to see if there was an error.
         try:
@@ -347,16 +715,76 @@ class QGConnector(api_actions.QGActions):
         except requests.HTTPError as e:
             # Error
             print('Error! Received a 4XX client error or 5XX server error response.')
-            print('Content = \n', response)
-            logger.error('Content = \n%s' % response)
-            print('Headers = \n', request.headers)
-            logger.error('Headers = \n%s' % str(request.headers))
+            print('Content = \n', preview(response))
+            logger.error('Content = \n%s', preview(response))
+            print('Headers = \n', preview(request.headers))
+            logger.error('Headers = \n%s', preview(request.headers))
+            if stream:
+                request.close()
+                chunks.close()
             request.raise_for_status()
         if '<RETURN status="FAILED" number="2007">' in response:
             print('Error! Your IP address is not in the list of secure IPs. Manager must include this IP (QualysGuard VM > Users > Security).')
-            print('Content = \n', response)
-            logger.error('Content = \n%s' % response)
-            print('Headers = \n', request.headers)
-            logger.error('Headers = \n%s' % str(request.headers))
+            print('Content = \n', preview(response))
+            logger.error('Content = \n%s', preview(response))
+            print('Headers = \n', preview(request.headers))
+            logger.error('Headers = \n%s', preview(request.headers))
+            if stream:
+                request.close()
+                chunks.close()
             return False
+        if on_complete:
+            if stream:
+                # Pass body on once the caller has streamed all of it.
+                chunks = qualysapi.streaming.iter_teed(chunks, on_complete, max_bytes, first_chunk)
+            else:
+                on_complete(request.content)
+        if stream:
+            return qualysapi.streaming.ResponseStream(request, first_chunk, chunks)
         return response
+
+    def _release_stream(self, api_call, stream):
+        """ Release the rate limiter slot held by a streamed response dropped before its body was read.
+
+        """
+        if stream and self.rate_limiter:
+            self.rate_limiter.release(api_call)
+
+    def search_iter(self, object_type, filters=None, page_size=100, api_version=None, prefetch=False):
+        """ Return a lazy iterator over each objectified record of a Portal API search call, page after page.
+
+        object_type is the searched object, such as 'am/hostasset', 'am/tag' or 'was/webapp' (use
+        api_version='am2' for Asset Management API v2). filters are as for service_request. Pages of
+        page_size records are requested with startFromId past the previous page's lastId, for as long as
+        hasMoreRecords is true. Each page is parsed as it arrives; with prefetch=True, the next page is
+        fetched in the background while the caller consumes the current one.
+        Yielded elements are cleared once the caller advances, so copy out what is needed.
+        """
+        records = self._iter_search_pages('search/%s' % object_type.strip('/'), filters, page_size, api_version)
+        if prefetch:
+            records = qualysapi.streaming.iter_prefetched(records, page_size)
+        return records
+
+    def _iter_search_pages(self, call, filters, page_size, api_version):
+        """ Yield records from each page of a Portal API search call.
+
+        """
+        start_from_id = None
+        while True:
+            data = service_request(filters, start_from_id, page_size)
+            response = self.request(call, data, api_version, stream=True)
+            if not response:
+                # Error already reported by request().
+                return
+            summary = {}
+            with response:
+                for record in qualysapi.streaming.iter_service_records(response, summary):
+                    yield record
+            if summary.get('responseCode', 'SUCCESS') != 'SUCCESS':
+                logger.error('Content = \n%s', summary)
+                raise Exception("QualysGuard %s failed with %s: %s" % (call, summary.get('responseCode'),
+                                                                       summary.get('errorMessage')))
+            if summary.get('hasMoreRecords') != 'true' or not summary.get('lastId'):
+                break
+            logger.debug('Fetching next page of %s after id %s.', call, summary['lastId'])
+            start_from_id = int(summary['lastId']) + 1
@@ -0,0 +1,91 @@
+""" Module that contains DetectionSync, which follows host detections
+incrementally through api/2.0/fo/asset/host/vm/detection/ and reports what
+changed since the previous run.
+"""
+from __future__ import absolute_import
+import logging
+
+import qualysapi.util
+from qualysapi.store import Store
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+
+class DetectionEvent(object):
+    """ Change to one detection: kind is 'add' (newly found or re-opened), 'update' (still open) or 'fixed'.
+
+    detection is the objectified DETECTION element.
+    """
+
+    def __init__(self, kind, host_id, ip, qid, detection):
+        self.kind = kind
+        self.host_id = host_id
+        self.ip = ip
+        self.qid = qid
+        self.detection = detection
+
+    def __repr__(self):
+        return '<DetectionEvent %s host %s QID %s>' % (self.kind, self.host_id, self.qid)
+
+
+class DetectionSync(Store):
+    """ Incremental host detection sync, checkpointed per scope.
+
+    A scope is a dict of host detection filters, such as {'ag_ids': '1234'} or
+    {'tag_set_by': 'id', 'tag_set_include': '5678'}. Each sync() of a scope only asks for hosts with
+    vm_processed_after its previous checkpoint, and compares their detections against the open QIDs
+    remembered per host to emit DetectionEvents. With a path, checkpoints and open QIDs persist on
+    disk (shelve) between runs; otherwise they live in memory.
+    """
+
+    def __init__(self, conn, path=None):
+        Store.__init__(self, path)
+        self.conn = conn
+
+    def _scope_key(self, scope):
+        return 'checkpoint:' + '&'.join('%s=%s' % item for item in sorted((scope or {}).items()))
+
+    def checkpoint(self, scope=None):
+        """ Return vm_processed_after datetime the next sync() of scope will use, or None if never synced.
+
+        """
+        return self._store.get(self._scope_key(scope))
+
+    def sync(self, scope=None, truncation_limit=None, **parameters):
+        """ Yield a DetectionEvent for each detection processed since the last sync of scope.
+
+        Truncated responses are followed, so large deltas complete. The checkpoint only moves once
+        every event has been consumed; extra keyword arguments are passed as API parameters.
+        """
+        call = '/api/2.0/fo/asset/host/vm/detection/'
+        key = self._scope_key(scope)
+        # Taken before the first request, so nothing processed during the run is skipped next time.
+        started = qualysapi.util.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        request_parameters = {'action': 'list', 'status': 'New,Active,Re-Opened,Fixed'}
+        request_parameters.update(scope or {})
+        request_parameters.update(parameters)
+        checkpoint = self._store.get(key)
+        if checkpoint:
+            request_parameters['vm_processed_after'] = checkpoint
+        logger.debug('Syncing detections for %s processed after %s.', key, checkpoint)
+        for host in self.conn.iter_records(call, request_parameters, 'HOST', truncation_limit=truncation_limit):
+            host_id = int(host.ID)
+            ip = host.findtext('IP')
+            host_key = 'host:%d' % host_id
+            open_qids = set(self._store.get(host_key, ()))
+            for detection in host.iterfind('DETECTION_LIST/DETECTION'):
+                qid = int(detection.QID)
+                status = detection.findtext('STATUS')
+                if status == 'Fixed':
+                    open_qids.discard(qid)
+                    kind = 'fixed'
+                elif qid in open_qids and status != 'Re-Opened':
+                    kind = 'update'
+                else:
+                    open_qids.add(qid)
+                    kind = 'add'
+                yield DetectionEvent(kind, host_id, ip, qid, detection)
+            self._store[host_key] = open_qids
+        self._store[key] = started
+        self.flush()
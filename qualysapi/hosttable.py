@@ -0,0 +1,159 @@
+""" Module that contains HostTable, a columnar (NumPy) view of a host list
+for fleet-wide filters and group-bys without a Python object per host.
+
+Requires NumPy (pip install qualysapi[numpy]).
+"""
+from __future__ import absolute_import
+import datetime
+
+import numpy
+
+import qualysapi.sharding
+from qualysapi.api_objects import Host
+
+# Categorical columns, stored as codes into a list of labels.
+categorical_columns = ('os', 'tracking_method')
+
+
+class HostTable(object):
+    """ Hosts stored as typed columns:
+
+    id               int64
+    ip               uint32, IPv4 packed as an integer (0 if the host has no IPv4 address)
+    last_scan        datetime64[s] in UTC, NaT if never scanned
+    os               int32 codes into os_labels
+    tracking_method  int32 codes into tracking_method_labels
+
+    Filter methods return boolean masks, which combine with & | ~ and select rows with table[mask].
+    """
+
+    def __init__(self, id, ip, last_scan, os, os_labels, tracking_method, tracking_method_labels):
+        self.id = id
+        self.ip = ip
+        self.last_scan = last_scan
+        self.os = os
+        self.os_labels = os_labels
+        self.tracking_method = tracking_method
+        self.tracking_method_labels = tracking_method_labels
+
+    @classmethod
+    def from_elements(cls, hosts):
+        """ Return HostTable built from an iterable of HOST elements, such as QGActions.iter_records yields.
+
+        """
+        ids = []
+        ips = []
+        last_scans = []
+        codes = dict((column, ([], {})) for column in categorical_columns)
+        for host in hosts:
+            ids.append(int(host.findtext('ID')))
+            ip = host.findtext('IP')
+            ips.append(qualysapi.sharding.ip_to_int(ip) if ip and ':' not in ip else 0)
+            # '2013-07-03T10:31:57Z', NumPy doesn't take the UTC designator.
+            last_scan = host.findtext('LAST_VULN_SCAN_DATETIME')
+            last_scans.append(last_scan[:19] if last_scan else 'NaT')
+            for column, tag in (('os', 'OS'), ('tracking_method', 'TRACKING_METHOD')):
+                column_codes, labels = codes[column]
+                column_codes.append(labels.setdefault(host.findtext(tag) or '', len(labels)))
+        os_codes, os_labels = codes['os']
+        tracking_method_codes, tracking_method_labels = codes['tracking_method']
+        return cls(numpy.array(ids, dtype=numpy.int64),
+                   numpy.array(ips, dtype=numpy.uint32),
+                   numpy.array(last_scans, dtype='datetime64[s]'),
+                   numpy.array(os_codes, dtype=numpy.int32),
+                   sorted(os_labels, key=os_labels.get),
+                   numpy.array(tracking_method_codes, dtype=numpy.int32),
+                   sorted(tracking_method_labels, key=tracking_method_labels.get))
+
+    def __len__(self):
+        return len(self.id)
+
+    def __getitem__(self, rows):
+        """ Return HostTable of the selected rows (boolean mask, indices or slice).
+
+        """
+        return HostTable(self.id[rows], self.ip[rows], self.last_scan[rows], self.os[rows], self.os_labels,
+                         self.tracking_method[rows], self.tracking_method_labels)
+
+    def _codes(self, column, labels):
+        column_labels = getattr(self, column + '_labels')
+        return [column_labels.index(label) for label in labels if label in column_labels]
+
+    def labels(self, column):
+        """ Return array of column's labels, one per host.
+
+        """
+        return numpy.array(getattr(self, column + '_labels'), dtype=object)[getattr(self, column)]
+
+    def is_in(self, column, *labels):
+        """ Return mask of hosts whose categorical column is one of labels.
+
+        """
+        return numpy.isin(getattr(self, column), self._codes(column, labels))
+
+    def os_matches(self, substring):
+        """ Return mask of hosts whose OS contains substring (case insensitive).
+
+        """
+        codes = [code for code, label in enumerate(self.os_labels) if substring.lower() in label.lower()]
+        return numpy.isin(self.os, codes)
+
+    def in_ip_range(self, start, end):
+        """ Return mask of hosts whose IPv4 address is within start-end, inclusive.
+
+        """
+        start = qualysapi.sharding.ip_to_int(start)
+        end = qualysapi.sharding.ip_to_int(end)
+        return (self.ip >= start) & (self.ip <= end)
+
+    def never_scanned(self):
+        """ Return mask of hosts without a last scan datetime.
+
+        """
+        return numpy.isnat(self.last_scan)
+
+    def not_scanned_since(self, days, today=None):
+        """ Return mask of hosts not scanned in the last days (by date, as QGActions.notScannedSince),
+        including hosts never scanned.
+
+        """
+        today = numpy.datetime64(today or datetime.date.today(), 'D')
+        return self.never_scanned() | (self.last_scan.astype('datetime64[D]') <= today - numpy.timedelta64(days, 'D'))
+
+    def group_counts(self, by=categorical_columns, mask=None):
+        """ Return dict mapping each combination of labels of the by columns to its number of hosts.
+
+        For example table.group_counts(mask=table.not_scanned_since(30)) counts stale hosts per
+        (os, tracking_method).
+        """
+        if isinstance(by, str):
+            by = (by,)
+        codes = numpy.stack([getattr(self, column) for column in by], axis=1)
+        if mask is not None:
+            codes = codes[mask]
+        if not len(codes):
+            return {}
+        groups, counts = numpy.unique(codes, axis=0, return_counts=True)
+        labels = [getattr(self, column + '_labels') for column in by]
+        result = {}
+        for group, count in zip(groups.tolist(), counts.tolist()):
+            key = tuple(column_labels[code] for column_labels, code in zip(labels, group))
+            result[key if len(by) > 1 else key[0]] = count
+        return result
+
+    def ips(self):
+        """ Return list of dotted IPv4 addresses, '' for hosts without one.
+
+        """
+        return [qualysapi.sharding.int_to_ip(ip) if ip else '' for ip in self.ip.tolist()]
+
+    def hosts(self):
+        """ Return list of Host objects for the rows of this table.
+
+        """
+        last_scans = numpy.datetime_as_string(self.last_scan, unit='s').tolist()
+        os_labels = self.labels('os').tolist()
+        tracking_method_labels = self.labels('tracking_method').tolist()
+        return [Host('', id, ip, last_scan + 'Z' if last_scan != 'NaT' else '', '', os, tracking_method)
+                for id, ip, last_scan, os, tracking_method
+                in zip(self.id.tolist(), self.ips(), last_scans, os_labels, tracking_method_labels)]
@@ -0,0 +1,88 @@
+""" Module that contains KnowledgeBase, a local mirror of the QualysGuard
+KnowledgeBase kept up to date with incremental (last_modified_after) syncs.
+"""
+from __future__ import absolute_import
+import logging
+
+from lxml import etree, objectify
+
+import qualysapi.util
+from qualysapi.store import Store
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+# Store key holding the checkpoint; QIDs are numeric so it can't clash.
+_last_modified_key = 'last_modified'
+
+
+class KnowledgeBase(Store):
+    """ Local mirror of api/2.0/fo/knowledge_base/vuln/, keyed by QID.
+
+    sync() streams only the VULNs modified since the previous sync (all of them the first time) and
+    upserts them. Lookups by QID are a single hash lookup returning the objectified VULN element.
+    With a path, the mirror persists on disk (shelve) between runs; otherwise it lives in memory.
+    """
+
+    def __init__(self, conn, path=None, details='All'):
+        Store.__init__(self, path)
+        self.conn = conn
+        self.details = details
+
+    @property
+    def last_modified(self):
+        """ Return checkpoint: start of the last complete sync, as last_modified_after expects it, or None before the
+        first sync.
+
+        """
+        return self._store.get(_last_modified_key)
+
+    def sync(self, truncation_limit=None):
+        """ Fetch VULNs modified after the checkpoint, upsert them, and return how many were upserted.
+
+        """
+        call = '/api/2.0/fo/knowledge_base/vuln/'
+        # Taken before the first request, so nothing modified during the run is skipped next time.
+        started = qualysapi.util.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        parameters = {'action': 'list', 'details': self.details}
+        last_modified = self.last_modified
+        if last_modified:
+            parameters['last_modified_after'] = last_modified
+        logger.debug('Syncing KnowledgeBase modified after %s.', last_modified)
+        count = 0
+        for vuln in self.conn.iter_records(call, parameters, 'VULN', truncation_limit=truncation_limit):
+            qid = vuln.findtext('QID')
+            # Serialize now, the element is cleared once the iterator advances.
+            self._store[str(qid)] = etree.tostring(vuln)
+            count += 1
+        # Only move the checkpoint once the whole delta has been stored.
+        self._store[_last_modified_key] = started
+        self.flush()
+        logger.info('Synced %d KnowledgeBase VULNs modified after %s.', count, last_modified)
+        return count
+
+    def __contains__(self, qid):
+        return str(qid) in self._store and str(qid) != _last_modified_key
+
+    def __getitem__(self, qid):
+        if str(qid) == _last_modified_key:
+            raise KeyError(qid)
+        return objectify.fromstring(self._store[str(qid)])
+
+    def get(self, qid, default=None):
+        """ Return objectified VULN for qid, or default if it isn't mirrored.
+
+        """
+        try:
+            return self[qid]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return len(self._store) - (_last_modified_key in self._store)
+
+    def qids(self):
+        """ Return list of mirrored QIDs.
+
+        """
+        return [int(key) for key in self._store.keys() if key != _last_modified_key]
@@ -0,0 +1,232 @@
+""" Module that contains per attempt instrumentation of QualysGuard API
+requests: the AttemptRecord QGConnector hooks receive, an in-memory histogram
+aggregator, and Prometheus & StatsD exporters.
+"""
+from __future__ import absolute_import
+import logging
+import re
+import socket
+import threading
+import time
+
+from collections import defaultdict
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the default duration histogram buckets.
+default_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class AttemptRecord(object):
+    """ One HTTP attempt of a QualysGuard API request, as passed to QGConnector hooks.
+
+    api_call is the formatted call (the endpoint), attempt counts from 1 within the request. Times are in
+    seconds: ttfb until the response headers arrived (as timed by requests, connection setup included),
+    duration until the body was read (for streamed responses, until the caller finished or closed the
+    stream). DNS and connect times aren't exposed by requests, so they're included in ttfb.
+    request_bytes is the size of the request body, response_bytes that of the body read (None if
+    discarded unread). rate_limit holds the X-RateLimit-* and X-Concurrency-Limit-* response headers.
+    error is the exception class name if no response was received.
+    """
+
+    def __init__(self, api_call, api_version, http_method, attempt):
+        self.api_call = api_call
+        self.api_version = api_version
+        self.http_method = http_method
+        self.attempt = attempt
+        self.started = time.time()
+        self.status_code = None
+        self.ttfb = None
+        self.duration = None
+        self.request_bytes = 0
+        self.response_bytes = None
+        self.rate_limit = {}
+        self.concurrent_scans_retries = 0
+        self.rate_limit_retries = 0
+        self.error = None
+
+    def received(self, response, concurrent_scans_retries, rate_limit_retries):
+        """ Record response headers of a requests.Response.
+
+        """
+        self.status_code = response.status_code
+        self.ttfb = response.elapsed.total_seconds()
+        body = response.request.body if response.request is not None else None
+        self.request_bytes = len(body) if body else 0
+        self.rate_limit = dict((name, value) for name, value in response.headers.items()
+                               if name.lower().startswith(('x-ratelimit', 'x-concurrency-limit')))
+        self.concurrent_scans_retries = concurrent_scans_retries
+        self.rate_limit_retries = rate_limit_retries
+
+    def finish(self, response_bytes=None):
+        self.duration = time.time() - self.started
+        self.response_bytes = response_bytes
+
+    def __repr__(self):
+        return '<AttemptRecord %s %s #%d: %s in %.3fs>' % (self.http_method, self.api_call, self.attempt,
+                                                           self.error or self.status_code, self.duration or 0)
+
+
+class Histogram(object):
+    """ Cumulative histogram of durations, with count & sum.
+
+    """
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class MetricsAggregator(object):
+    """ QGConnector hook aggregating AttemptRecords in memory, per (api_call, http_method, status).
+
+    Keeps a Histogram of durations and of ttfb, and totals of request & response bytes, attempts,
+    rate limit and concurrent scan retries. Thread safe; use as QGConnector(..., hooks=[aggregator]).
+    """
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """ Forget everything aggregated so far.
+
+        """
+        with self._lock:
+            self.durations = defaultdict(lambda: Histogram(self.buckets))
+            self.ttfbs = defaultdict(lambda: Histogram(self.buckets))
+            self.totals = defaultdict(lambda: defaultdict(int))
+
+    def __call__(self, record):
+        key = (record.api_call, record.http_method, str(record.error or record.status_code))
+        with self._lock:
+            if record.duration is not None:
+                self.durations[key].observe(record.duration)
+            if record.ttfb is not None:
+                self.ttfbs[key].observe(record.ttfb)
+            totals = self.totals[key]
+            totals['attempts'] += 1
+            totals['request_bytes'] += record.request_bytes
+            totals['response_bytes'] += record.response_bytes or 0
+            if record.attempt > 1:
+                totals['retries'] += 1
+            if record.status_code == 409:
+                totals['rate_limited'] += 1
+
+    def snapshot(self):
+        """ Return dict mapping each (api_call, http_method, status) to a dict of its aggregates.
+
+        """
+        with self._lock:
+            result = {}
+            for key, totals in self.totals.items():
+                entry = dict(totals)
+                for name, histograms in (('duration', self.durations), ('ttfb', self.ttfbs)):
+                    if key in histograms:
+                        histogram = histograms[key]
+                        entry[name] = {'count': histogram.count, 'sum': histogram.sum,
+                                       'buckets': list(zip(histogram.buckets, histogram.counts))}
+                result[key] = entry
+            return result
+
+    def slowest(self, count=10):
+        """ Return list of (api_call, http_method, status, total seconds) spending the most time, slowest first.
+
+        """
+        with self._lock:
+            spent = [key + (histogram.sum,) for key, histogram in self.durations.items()]
+        return sorted(spent, key=lambda entry: entry[-1], reverse=True)[:count]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusExporter(object):
+    """ Renders a MetricsAggregator in the Prometheus text exposition format, for a /metrics endpoint or
+    the node exporter textfile collector.
+
+    """
+
+    def __init__(self, aggregator, prefix='qualysapi'):
+        self.aggregator = aggregator
+        self.prefix = prefix
+
+    def render(self):
+        """ Return metrics as Prometheus text exposition format.
+
+        """
+        lines = []
+        snapshot = self.aggregator.snapshot()
+        for name, help_text in (('duration', 'Duration of QualysGuard API attempts, until the body was read.'),
+                                ('ttfb', 'Time until the response headers of QualysGuard API attempts arrived.')):
+            metric = '%s_request_%s_seconds' % (self.prefix, name)
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s histogram' % metric)
+            for (api_call, http_method, status), entry in sorted(snapshot.items()):
+                if name not in entry:
+                    continue
+                labels = 'endpoint="%s",method="%s",status="%s"' % (_label(api_call), _label(http_method),
+                                                                    _label(status))
+                for bound, count in entry[name]['buckets']:
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, bound, count))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, labels, entry[name]['count']))
+                lines.append('%s_sum{%s} %f' % (metric, labels, entry[name]['sum']))
+                lines.append('%s_count{%s} %d' % (metric, labels, entry[name]['count']))
+        for total, help_text in (('attempts', 'QualysGuard API attempts.'),
+                                 ('retries', 'QualysGuard API attempts that were retries.'),
+                                 ('rate_limited', 'QualysGuard API attempts refused by the rate limit (409).'),
+                                 ('request_bytes', 'Bytes sent in QualysGuard API request bodies.'),
+                                 ('response_bytes', 'Bytes received in QualysGuard API response bodies.')):
+            metric = '%s_%s_total' % (self.prefix, total)
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s counter' % metric)
+            for (api_call, http_method, status), entry in sorted(snapshot.items()):
+                lines.append('%s{endpoint="%s",method="%s",status="%s"} %d' % (
+                    metric, _label(api_call), _label(http_method), _label(status), entry.get(total, 0)))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter(object):
+    """ QGConnector hook sending each AttemptRecord to StatsD over UDP:
+
+    <prefix>.<endpoint>.<method>.<status>.duration (ms timer), .ttfb (ms timer), .attempts,
+    .request_bytes and .response_bytes (counters). Sending never raises.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='qualysapi'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _name(self, record):
+        endpoint = re.sub(r'[^A-Za-z0-9_]+', '_', record.api_call).strip('_')
+        return '%s.%s.%s.%s' % (self.prefix, endpoint, record.http_method, record.error or record.status_code)
+
+    def __call__(self, record):
+        name = self._name(record)
+        metrics = ['%s.attempts:1|c' % name, '%s.request_bytes:%d|c' % (name, record.request_bytes)]
+        if record.response_bytes is not None:
+            metrics.append('%s.response_bytes:%d|c' % (name, record.response_bytes))
+        if record.duration is not None:
+            metrics.append('%s.duration:%d|ms' % (name, record.duration * 1000))
+        if record.ttfb is not None:
+            metrics.append('%s.ttfb:%d|ms' % (name, record.ttfb * 1000))
+        try:
+            self._socket.sendto('\n'.join(metrics).encode('utf-8'), self.address)
+        except (socket.error, OSError) as e:
+            logger.debug('Could not send metrics to StatsD: %s', e)
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,188 @@
+""" Module that contains the rate limit scheduler used by QGConnector to pace
+requests according to the X-RateLimit & X-Concurrency-Limit headers returned by
+the QualysGuard API.
+"""
+from __future__ import absolute_import
+import logging
+import threading
+import time
+
+from collections import defaultdict
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+
+def int_header(headers, name):
+    """ Return integer value of header name, or None if missing or malformed.
+
+    """
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """ Token bucket for one QualysGuard API call.
+
+    Starts out unlimited. Capacity (X-RateLimit-Limit), refill rate (capacity per X-RateLimit-Window-Sec),
+    remaining tokens (X-RateLimit-Remaining), forced waits (X-RateLimit-ToWait-Sec) and concurrency
+    (X-Concurrency-Limit-Limit) are learned from each response.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.window = None
+        self.tokens = None
+        self.updated = 0.0
+        self.blocked_until = 0.0
+        self.concurrency_limit = None
+        # Calls in flight from this process, as last reported by QualysGuard, and from other clients by then.
+        self.running = 0
+        self.server_running = None
+        self.others_running = 0
+
+    def _refilled(self, now):
+        """ Return tokens available at now, or None if the bucket is not limited yet.
+
+        """
+        if self.tokens is None or not self.limit or not self.window:
+            return None
+        rate = float(self.limit) / self.window
+        return min(self.limit, self.tokens + (now - self.updated) * rate)
+
+    def delay(self, now):
+        """ Return seconds to wait before a call may start, 0 if it may start now.
+
+        """
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        tokens = self._refilled(now)
+        if tokens is None or tokens >= 1:
+            return 0
+        return (1 - tokens) * self.window / float(self.limit)
+
+    def is_saturated(self):
+        """ Return True if no more calls may run concurrently.
+
+        Calls other clients had running (X-Concurrency-Limit-Running) count against the limit, except
+        that one call may always run: only a response tells whether they are done.
+        """
+        if not self.concurrency_limit:
+            return False
+        if self.running and self.running + self.others_running >= self.concurrency_limit:
+            return True
+        return self.running >= self.concurrency_limit
+
+    def take(self, now):
+        """ Consume a token and a concurrency slot for a call starting at now.
+
+        """
+        tokens = self._refilled(now)
+        if tokens is not None:
+            self.tokens = tokens - 1
+            self.updated = now
+        self.running += 1
+
+    def update(self, headers, now):
+        """ Resynchronize bucket with the rate limit headers of a response received at now.
+
+        """
+        limit = int_header(headers, 'x-ratelimit-limit')
+        if limit is not None:
+            self.limit = limit
+        window = int_header(headers, 'x-ratelimit-window-sec')
+        if window:
+            self.window = window
+        remaining = int_header(headers, 'x-ratelimit-remaining')
+        if remaining is not None:
+            # Server count is authoritative.
+            self.tokens = remaining
+            self.updated = now
+        towait = int_header(headers, 'x-ratelimit-towait-sec')
+        if towait:
+            self.blocked_until = max(self.blocked_until, now + towait)
+        concurrency_limit = int_header(headers, 'x-concurrency-limit-limit')
+        if concurrency_limit is not None:
+            self.concurrency_limit = concurrency_limit
+        server_running = int_header(headers, 'x-concurrency-limit-running')
+        if server_running is not None:
+            self.server_running = server_running
+            # Server count includes this process' calls still in flight.
+            self.others_running = max(0, server_running - self.running)
+
+
+def slot_deadline(deadline, now, slot_timeout, api_call, bucket):
+    """ Return time by which a concurrency slot for api_call must free up, raising an Exception if it is past.
+
+    deadline is the one returned so far, None at first.
+    """
+    if slot_timeout is None:
+        return None
+    if deadline is None:
+        return now + slot_timeout
+    if now >= deadline:
+        raise Exception('No concurrency slot for %s freed up in %s seconds (%s running). Close streamed responses '
+                        'once done with them.' % (api_call, slot_timeout, bucket.running))
+    return deadline
+
+
+class RateLimiter(object):
+    """ Thread-safe scheduler holding a TokenBucket per API call.
+
+    acquire() blocks until the call's bucket allows another request, update() feeds response headers into the
+    bucket, and release() hands back the slot once the response has been read. acquire() gives up after waiting
+    slot_timeout seconds (None for no limit) for a concurrency slot, as the slots are held by responses not
+    closed in that time.
+    """
+
+    def __init__(self, slot_timeout=1800):
+        self.buckets = defaultdict(TokenBucket)
+        self.slot_timeout = slot_timeout
+        self._condition = threading.Condition()
+
+    def acquire(self, api_call):
+        """ Block until a request against api_call may be sent.
+
+        """
+        with self._condition:
+            bucket = self.buckets[api_call]
+            deadline = None
+            while True:
+                now = time.time()
+                wait = bucket.delay(now)
+                if not wait and not bucket.is_saturated():
+                    bucket.take(now)
+                    return
+                if wait:
+                    logger.info('Pacing %s, waiting %.2f seconds.', api_call, wait)
+                else:
+                    logger.debug('Concurrency limit reached for %s (%s running).', api_call, bucket.running)
+                    deadline = slot_deadline(deadline, now, self.slot_timeout, api_call, bucket)
+                    if deadline is not None:
+                        wait = deadline - now
+                # Woken early by release() in case a slot frees up or the headers changed.
+                self._condition.wait(wait or None)
+
+    def update(self, api_call, headers):
+        """ Update the bucket of api_call from response headers, keeping the slot taken.
+
+        """
+        with self._condition:
+            bucket = self.buckets[api_call]
+            bucket.update(headers, time.time())
+            logger.debug('rate limit bucket for api_call, %s = %s tokens, %s running on server', api_call,
+                         bucket.tokens, bucket.server_running)
+            self._condition.notify_all()
+
+    def release(self, api_call, headers=None):
+        """ Release the slot taken by acquire(), updating the bucket from response headers if any.
+
+        """
+        if headers is not None:
+            self.update(api_call, headers)
+        with self._condition:
+            bucket = self.buckets[api_call]
+            bucket.running = max(0, bucket.running - 1)
+            self._condition.notify_all()
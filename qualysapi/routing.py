@@ -0,0 +1,203 @@
+""" Module that contains the endpoint routing table, which maps a raw QualysGuard
+API call to its API version, normalized call and default http method.
+
+Routes of the calls listed in qualysapi.api_methods are built once, at import;
+other calls are resolved on first use and memoized.
+"""
+from __future__ import absolute_import
+import logging
+import threading
+
+from collections import namedtuple, OrderedDict
+
+import qualysapi.api_methods
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+# Path of each API version's base url, after the server.
+base_paths = {1: 'msp/', 2: '', 'was': 'qps/rest/3.0/', 'am': 'qps/rest/1.0/', 'am2': 'qps/rest/2.0/'}
+
+# Calls resolved outside the prebuilt table, such as WAS calls with a resource id, are memoized up to this many.
+memo_size = 1024
+
+
+class Route(namedtuple('Route', 'api_version api_call http_method no_data_http_method')):
+    """ Immutable routing of a call: API version, normalized call (appended to the base url), and default
+    http method for requests with and without data (only some WAS calls differ).
+
+    """
+
+    __slots__ = ()
+
+    def default_http_method(self, data):
+        return self.http_method if data else self.no_data_http_method
+
+
+def parse_api_version(api_version):
+    """ Return QualysGuard API version for api_version specified, such as 'v2', 'assets' or 'webapp'.
+
+    """
+    # Convert to int.
+    if type(api_version) == str:
+        api_version = api_version.lower()
+        if api_version[0] == 'v' and api_version[1].isdigit():
+            # Remove first 'v' in case the user typed 'v1' or 'v2', etc.
+            api_version = api_version[1:]
+        # Check for input matching Qualys modules.
+        if api_version in ('asset management', 'assets', 'tag', 'tagging', 'tags'):
+            # Convert to Asset Management API.
+            api_version = 'am'
+        elif api_version in ('am2'):
+            # Convert to Asset Management API v2
+            api_version = 'am2'
+        elif api_version in ('webapp', 'web application scanning', 'webapp scanning'):
+            # Convert to WAS API.
+            api_version = 'was'
+        elif api_version in ('pol', 'pc'):
+            # Convert PC module to API number 2.
+            api_version = 2
+        else:
+            api_version = int(api_version)
+    return api_version
+
+
+def detect_api_version(api_call):
+    """ Return QualysGuard API version for api_call specified, False if unknown.
+
+    """
+    # Leverage patterns of calls to API methods.
+    if api_call.endswith('.php'):
+        # API v1.
+        return 1
+    elif api_call.startswith('api/2.0/'):
+        # API v2.
+        return 2
+    elif '/am/' in api_call:
+        # Asset Management API.
+        return 'am'
+    elif '/was/' in api_call:
+        # WAS API.
+        return 'was'
+    return False
+
+
+def strip_call(api_call):
+    """ Return api_call without starting slashes or trailing question marks.
+
+    """
+    return api_call.lstrip('/').rstrip('?')
+
+
+def normalize_call(api_version, api_call):
+    """ Return properly formatted QualysGuard API call according to api_version etiquette.
+
+    """
+    api_call = strip_call(api_call)
+    # Make sure call always ends in slash for API v2 calls.
+    if (api_version == 2 and api_call[-1] != '/'):
+        # Add slash.
+        api_call += '/'
+    if api_call in qualysapi.api_methods.api_methods_with_trailing_slash[str(api_version)]:
+        # Add slash.
+        api_call += '/'
+    return api_call
+
+
+def default_http_method(api_version, api_call, data):
+    """ Return QualysGuard API http method for (stripped) api_call, with POST preferred.
+
+    """
+    api_methods = qualysapi.api_methods.api_methods
+    # All API v2 requests are POST methods.
+    if api_version == 2:
+        return 'post'
+    elif api_version == 1:
+        if api_call in api_methods['1 post']:
+            return 'post'
+        else:
+            return 'get'
+    elif api_version == 'was':
+        # WAS API call.
+        # Because WAS API enables user to GET API resources in URI, let's chop off the resource.
+        # '/download/was/report/18823' --> '/download/was/report/'
+        api_call_endpoint = api_call[:api_call.rfind('/') + 1]
+        if api_call_endpoint in api_methods['was get']:
+            return 'get'
+        # Post calls with no payload will result in HTTPError: 415 Client Error: Unsupported Media Type.
+        if not data:
+            # No post data. Some calls change to GET with no post data.
+            if api_call_endpoint in api_methods['was no data get']:
+                return 'get'
+            else:
+                return 'post'
+        else:
+            # Call with post data.
+            return 'post'
+    else:
+        # Asset Management API call.
+        if api_call in api_methods['am get']:
+            return 'get'
+        else:
+            return 'post'
+
+
+def build_route(api_call, api_version=None):
+    """ Return Route for raw api_call and api_version (detected from the call if not specified).
+
+    """
+    api_call = strip_call(api_call)
+    if api_version:
+        api_version = parse_api_version(api_version)
+    else:
+        api_version = detect_api_version(api_call)
+    return Route(api_version, normalize_call(api_version, api_call),
+                 default_http_method(api_version, api_call, True), default_http_method(api_version, api_call, False))
+
+
+def build_table():
+    """ Return dict mapping (raw call, None) to Route for every call in qualysapi.api_methods, as typed
+    with or without a starting slash, and without the trailing slash where it is optional.
+
+    """
+    table = {}
+    for methods in qualysapi.api_methods.api_methods.values():
+        for method in methods:
+            spellings = set([method, '/' + method])
+            if method.endswith('/'):
+                spellings.update([method[:-1], '/' + method[:-1]])
+            for spelling in spellings:
+                if spelling.strip('/'):
+                    table[(spelling, None)] = build_route(spelling)
+    return table
+
+
+# Routes of known calls, never changed after import.
+table = build_table()
+
+# Least recently used routes of other calls.
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def resolve(api_call, api_version=None):
+    """ Return Route for raw api_call and api_version, as given to QGConnector.request.
+
+    """
+    key = (api_call, api_version or None)
+    route = table.get(key)
+    if route is not None:
+        return route
+    with _memo_lock:
+        route = _memo.pop(key, None)
+        if route is not None:
+            # Mark as most recently used.
+            _memo[key] = route
+            return route
+    route = build_route(api_call, api_version)
+    logger.debug('Routed %s to %s.', api_call, route)
+    with _memo_lock:
+        _memo[key] = route
+        while len(_memo) > memo_size:
+            _memo.popitem(last=False)
+    return route
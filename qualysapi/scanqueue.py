@@ -0,0 +1,120 @@
+""" Module that contains ScanLaunchQueue, which launches queued scans as soon
+as the subscription's concurrent scan limit leaves a slot free.
+"""
+from __future__ import absolute_import
+import heapq
+import logging
+import time
+
+from qualysapi.api_objects import Scan
+from qualysapi.scanwatch import ScanWatcher
+from qualysapi.store import Store
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+
+class ScanLaunchQueue(Store):
+    """ Priority queue of scans to launch through QGActions.launchScan, never running more than
+    max_concurrent at once.
+
+    Running scans are tracked by a ScanWatcher (one batched status poll per interval), and the next
+    queued scan is launched as soon as a poll shows a slot has freed up, instead of sleeping a fixed
+    concurrent_scans_retry_delay. Higher priorities launch first, in submission order among equals.
+    max_concurrent is the subscription's concurrent scan limit; if None, scans are launched until
+    QualysGuard refuses one for reaching it, and launches resume after the next poll. With a path,
+    the queue and the running scan references persist on disk (shelve), so a restarted process
+    picks up where it left off.
+    """
+
+    def __init__(self, conn, max_concurrent=None, path=None, min_interval=30, max_interval=600):
+        Store.__init__(self, path)
+        self.conn = conn
+        self.watcher = ScanWatcher(conn, min_interval=min_interval, max_interval=max_interval)
+        # Launches refused for a reason other than the concurrent scan limit.
+        self.failed = []
+        self.max_concurrent = max_concurrent
+        # Heap of (-priority, sequence, launchScan arguments).
+        self._pending = list(self._store.get('pending', []))
+        heapq.heapify(self._pending)
+        self._sequence = self._store.get('sequence', 0)
+        for ref in self._store.get('running', []):
+            # Real state arrives with the next poll.
+            self.watcher.add(Scan([], '', '', '', '', ref, 'Running', '', '', '', ''))
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def running(self):
+        """ Return list of launched Scans that haven't finished yet.
+
+        """
+        return list(self.watcher.scans.values())
+
+    def _save(self):
+        self._store['pending'] = self._pending
+        self._store['sequence'] = self._sequence
+        self._store['running'] = sorted(self.watcher.scans)
+        self.flush()
+
+    def submit(self, title, option_title, iscanner_name, asset_groups="", ip="", priority=0):
+        """ Queue a scan (arguments as for QGActions.launchScan); higher priorities launch first.
+
+        """
+        arguments = {'title': title, 'option_title': option_title, 'iscanner_name': iscanner_name,
+                     'asset_groups': asset_groups, 'ip': ip}
+        heapq.heappush(self._pending, (-priority, self._sequence, arguments))
+        self._sequence += 1
+        self._save()
+
+    def _free_slots(self):
+        if self.max_concurrent is None:
+            return len(self._pending)
+        return self.max_concurrent - len(self.watcher.scans)
+
+    def launch(self):
+        """ Launch queued scans while slots are free, and return list of launched Scans.
+
+        """
+        launched = []
+        while self._pending and self._free_slots() > 0:
+            # Only dequeued once launchScan returns, so the scan stays queued if it raises.
+            entry = self._pending[0]
+            scan = self.conn.launchScan(**entry[2])
+            if scan is None and self.conn.last_response.concurrent_scans_exceeded:
+                # Slots are taken, possibly by scans launched elsewhere; retry after the next poll.
+                logger.info('Concurrent scan limit reached at %d scans.', len(self.watcher.scans))
+                break
+            heapq.heappop(self._pending)
+            if scan is None:
+                logger.error('Could not launch scan %s.', entry[2]['title'])
+                self.failed.append(entry[2])
+                continue
+            logger.debug('Launched scan %s (%s).', scan.title, scan.ref)
+            self.watcher.add(scan)
+            launched.append(scan)
+            # Persist as we go, so a crash doesn't launch the same scan twice.
+            self._save()
+        self._save()
+        return launched
+
+    def step(self):
+        """ Poll running scans once, then launch into any freed slots; returns list of ScanTransitions.
+
+        """
+        transitions = self.watcher.poll()
+        self.launch()
+        return transitions
+
+    def run(self):
+        """ Launch every queued scan and wait until all of them have finished; returns list of ScanTransitions.
+
+        Transitions are also passed to callbacks registered with watcher.on_transition().
+        """
+        transitions = []
+        self.launch()
+        while self._pending or self.watcher.scans:
+            time.sleep(self.watcher.interval())
+            transitions.extend(self.step())
+        return transitions
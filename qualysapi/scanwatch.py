@@ -0,0 +1,160 @@
+""" Module that contains ScanWatcher, which follows the status of many scans
+with one batched api/2.0/fo/scan/ list call per poll.
+"""
+from __future__ import absolute_import
+import logging
+import time
+
+import qualysapi.util
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+# Scan states after which a scan no longer changes.
+finished_states = set(['Finished', 'Canceled', 'Cancelled', 'Error'])
+# State given to a scan dropped because polls stopped listing it (deleted, or purged from the scan list).
+missing_state = 'Missing'
+
+
+class ScanTransition(object):
+    """ Change of a watched scan's state, from old_state to new_state (scan.status).
+
+    """
+
+    def __init__(self, scan, old_state, new_state):
+        self.scan = scan
+        self.old_state = old_state
+        self.new_state = new_state
+
+    def __repr__(self):
+        return '<ScanTransition %s %s -> %s>' % (self.scan.ref, self.old_state, self.new_state)
+
+
+class ScanWatcher(object):
+    """ Keeps the status of a set of Scans up to date, polling all of them with a single
+    action=list&scan_ref=a,b,c call.
+
+    The polling interval adapts to the scans: it is cadence times the age of the most recently
+    launched scan still active, within min_interval..max_interval seconds, so short scans are
+    checked often and long-running ones rarely. Scans are dropped once they reach a finished
+    state (Finished, Canceled, Error), or with state Missing once missing_polls polls in a row
+    didn't list them. Transitions are passed to callbacks registered with on_transition(), and
+    yielded by watch().
+    """
+
+    call = '/api/2.0/fo/scan/'
+
+    def __init__(self, conn, scans=(), min_interval=30, max_interval=600, cadence=0.1, missing_polls=3):
+        self.conn = conn
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cadence = cadence
+        self.missing_polls = missing_polls
+        # Watched scans by reference, and consecutive polls that didn't list them.
+        self.scans = {}
+        self._missed = {}
+        self.callbacks = []
+        for scan in scans:
+            self.add(scan)
+
+    def add(self, scan):
+        """ Start watching scan, unless it already finished.
+
+        """
+        if scan.status not in finished_states:
+            self.scans[scan.ref] = scan
+
+    def remove(self, scan):
+        """ Stop watching scan.
+
+        """
+        self.scans.pop(scan.ref, None)
+        self._missed.pop(scan.ref, None)
+
+    def on_transition(self, callback):
+        """ Register callback(transition) to be called for every ScanTransition; returns callback, so it can decorate.
+
+        """
+        self.callbacks.append(callback)
+        return callback
+
+    def interval(self):
+        """ Return seconds to wait before the next poll.
+
+        """
+        now = qualysapi.util.utcnow()
+        ages = [(now - scan.launch_datetime).total_seconds() for scan in self.scans.values()
+                if scan.launch_datetime is not None]
+        if not ages:
+            return self.min_interval
+        return min(self.max_interval, max(self.min_interval, self.cadence * min(ages)))
+
+    def _list_parameters(self):
+        return {'action': 'list', 'scan_ref': ','.join(sorted(self.scans)), 'show_status': 1}
+
+    def _update(self, element):
+        """ Return ScanTransition if the SCAN element shows a new state for a watched scan, else None.
+
+        """
+        scan = self.scans.get(element.findtext('REF'))
+        state = element.findtext('STATUS/STATE')
+        if scan is None or not state or state == scan.status:
+            return None
+        scan.duration = element.findtext('DURATION') or scan.duration
+        return self._transition(scan, state)
+
+    def _transition(self, scan, state):
+        """ Return ScanTransition of scan to state, passed to callbacks.
+
+        """
+        transition = ScanTransition(scan, scan.status, state)
+        scan.status = state
+        if state in finished_states or state == missing_state:
+            self.remove(scan)
+        logger.debug('%s', transition)
+        for callback in self.callbacks:
+            callback(transition)
+        return transition
+
+    def _drop_missing(self, listed):
+        """ Return list of ScanTransitions of scans dropped for missing from missing_polls polls in a row.
+
+        listed is the set of references the last poll returned.
+        """
+        transitions = []
+        for ref, scan in list(self.scans.items()):
+            if ref in listed:
+                self._missed.pop(ref, None)
+                continue
+            self._missed[ref] = self._missed.get(ref, 0) + 1
+            if self._missed[ref] >= self.missing_polls:
+                logger.warning('Scan %s not listed in %d polls, no longer watching it.', ref, self._missed[ref])
+                transitions.append(self._transition(scan, missing_state))
+        return transitions
+
+    def poll(self):
+        """ Refresh all watched scans with one list call, and return list of ScanTransitions.
+
+        """
+        if not self.scans:
+            return []
+        transitions = []
+        listed = set()
+        for element in self.conn.iter_records(self.call, self._list_parameters(), 'SCAN', objectified=False,
+                                              cache=False):
+            listed.add(element.findtext('REF'))
+            transition = self._update(element)
+            if transition:
+                transitions.append(transition)
+        transitions.extend(self._drop_missing(listed))
+        return transitions
+
+    def watch(self):
+        """ Yield ScanTransitions as they happen, polling until every watched scan has finished.
+
+        """
+        while self.scans:
+            for transition in self.poll():
+                yield transition
+            if self.scans:
+                time.sleep(self.interval())
@@ -17,4 +17,7 @@ else:
     default_filename = ".qcrc"
 
 defaults = {'hostname': 'qualysapi.qualys.com',
-            'max_retries': '3'}
+            'max_retries': '3',
+            'pool_connections': '10',
+            'pool_maxsize': '10',
+            'pool_block': 'False'}
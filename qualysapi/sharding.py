@@ -0,0 +1,79 @@
+""" Module that contains helpers to split QualysGuard id and IP address spaces
+into shards that can be fetched concurrently.
+"""
+from __future__ import absolute_import
+import socket
+import struct
+
+
+def ip_to_int(ip):
+    """ Return IPv4 address string as an integer.
+
+    """
+    return struct.unpack('!I', socket.inet_aton(ip.strip()))[0]
+
+
+def int_to_ip(value):
+    """ Return integer as an IPv4 address string.
+
+    """
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def split_range(low, high, count):
+    """ Return list of (low, high) inclusive integer ranges splitting low..high into at most count shards.
+
+    """
+    if high < low:
+        raise ValueError("Range end (%s) is lower than range start (%s)" % (high, low))
+    count = max(1, int(count))
+    # Round up so that no more than count shards are produced.
+    step = -(-(high - low + 1) // count)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def split_id_range(id_min, id_max, count):
+    """ Return list of parameter dicts with id_min & id_max splitting id_min..id_max into count shards.
+
+    """
+    return [{'id_min': low, 'id_max': high} for low, high in split_range(int(id_min), int(id_max), count)]
+
+
+def split_ip_range(start, end, count):
+    """ Return list of parameter dicts with ips splitting the IPv4 range start-end into count shards.
+
+    """
+    return [{'ips': '%s-%s' % (int_to_ip(low), int_to_ip(high))}
+            for low, high in split_range(ip_to_int(start), ip_to_int(end), count)]
+
+
+def compress_ips(ips):
+    """ Return sorted list of ips parameter entries covering ips, consecutive IPv4 addresses collapsed into ranges.
+
+    Entries that aren't single IPv4 addresses (IPv6 addresses, ranges, ...) are kept as they are, at the end.
+    """
+    addresses = set()
+    others = []
+    for ip in ips:
+        try:
+            addresses.add(ip_to_int(ip))
+        except (socket.error, ValueError):
+            if ip not in others:
+                others.append(ip)
+    entries = []
+    for address in sorted(addresses):
+        if entries and entries[-1][1] == address - 1:
+            entries[-1][1] = address
+        else:
+            entries.append([address, address])
+    return [int_to_ip(low) if low == high else '%s-%s' % (int_to_ip(low), int_to_ip(high))
+            for low, high in entries] + others
+
+
+def split_ips(ips, entries_per_shard):
+    """ Return list of parameter dicts with ips, each holding at most entries_per_shard compressed entries.
+
+    """
+    entries = compress_ips(ips)
+    return [{'ips': ','.join(entries[index:index + entries_per_shard])}
+            for index in range(0, len(entries), entries_per_shard)]
@@ -0,0 +1,36 @@
+""" Module that contains Store, the base class of objects keeping their state
+between runs: KnowledgeBase, DetectionSync and ScanLaunchQueue.
+"""
+from __future__ import absolute_import
+import shelve
+
+
+class Store(object):
+    """ Keeps state in self._store: on disk (shelve) with a path, in memory otherwise.
+
+    Use as a context manager, or call close(), to flush and close the on-disk store.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._store = shelve.open(path) if path else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Flush and close the on-disk store.
+
+        """
+        if self.path:
+            self._store.close()
+
+    def flush(self):
+        """ Write pending changes to the on-disk store.
+
+        """
+        if self.path:
+            self._store.sync()
@@ -0,0 +1,326 @@
+""" Module that contains helpers for consuming QualysGuard API responses
+incrementally, without buffering the whole payload in memory.
+"""
+from __future__ import absolute_import
+import copy
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from lxml import etree, objectify
+
+# Setup module level logging.
+logger = logging.getLogger(__name__)
+
+# Number of bytes read from the socket per chunk. The first chunk is used to detect
+# QualysGuard errors, so it must be large enough to hold a complete error document.
+CHUNK_SIZE = 64 * 1024
+
+
+class ResponseStream(object):
+    """ Iterable, file-like view over a streamed QualysGuard API response.
+
+    Iterating yields raw byte chunks; read() is provided so the stream can be handed to
+    anything expecting a file object (lxml.etree.iterparse, shutil.copyfileobj, ...).
+    The underlying connection is released on close(), or when used as a context manager.
+    response is None for a stream replayed from cache.
+    """
+
+    def __init__(self, response, first_chunk, chunks):
+        # Keep underlying requests.Response for headers & status.
+        self.response = response
+        self.headers = response.headers if response is not None else {}
+        self.status_code = response.status_code if response is not None else 200
+        # First chunk was already consumed to check for errors; keep it buffered.
+        self._buffer = first_chunk
+        self._chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        if self._buffer:
+            buffered, self._buffer = self._buffer, b''
+            yield buffered
+        for chunk in self._chunks:
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, size=-1):
+        """ Return up to size bytes from the stream, or the remainder if size is negative.
+
+        """
+        if size is None or size < 0:
+            data = self._buffer + b''.join(self._chunks)
+            self._buffer = b''
+            return data
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                # Exhausted.
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        """ Release the underlying connection back to the pool.
+
+        """
+        if not self.closed:
+            if self.response is not None:
+                self.response.close()
+            if hasattr(self._chunks, 'close'):
+                self._chunks.close()
+            self.closed = True
+
+
+def iter_closing(chunks, on_close):
+    """ Yield chunks unchanged, then call on_close once: at the end of the stream, or when closed or dropped
+    after the first chunk was asked for.
+
+    on_close must not refer back to the returned generator, so dropping it closes it right away.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        on_close()
+
+
+def iter_teed(chunks, on_complete, max_bytes, head=b''):
+    """ Return iterator yielding chunks unchanged, which then passes the whole body (head included) to on_complete.
+
+    on_complete is called exactly once: with the body at the end of the stream, or with None if the body grew
+    beyond max_bytes or the iterator is closed before the end.
+    """
+    return TeedChunks(chunks, on_complete, max_bytes, head)
+
+
+def iter_counted(chunks, on_complete, head=b''):
+    """ Return iterator yielding chunks unchanged, which then passes the number of bytes seen (head included)
+    to on_complete.
+
+    on_complete is called exactly once, at the end of the stream or when the iterator is closed.
+    """
+    return TeedChunks(chunks, on_complete, 0, head, counted=True)
+
+
+class TeedChunks(object):
+    """ Iterator returned by iter_teed and iter_counted; size is the number of bytes seen so far.
+
+    on_complete gets size instead of the body if counted is True.
+    """
+
+    def __init__(self, chunks, on_complete, max_bytes, head=b'', counted=False):
+        self._source = chunks
+        self._chunks = iter(chunks)
+        self._on_complete = on_complete
+        self._max_bytes = max_bytes
+        self._counted = counted
+        self._body = None if counted else [head]
+        self.size = len(head)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._complete(b''.join(self._body) if self._body is not None else None)
+            raise
+        self.size += len(chunk)
+        if self._body is not None:
+            if self.size > self._max_bytes:
+                # Too large to keep, stop collecting.
+                self._body = None
+            else:
+                self._body.append(chunk)
+        return chunk
+
+    next = __next__
+
+    def _complete(self, body):
+        on_complete, self._on_complete = self._on_complete, None
+        if on_complete is not None:
+            on_complete(self.size if self._counted else body)
+
+    def close(self):
+        """ Stop collecting; on_complete gets None unless the stream was already read to the end.
+
+        """
+        self._complete(None)
+        if hasattr(self._source, 'close'):
+            self._source.close()
+
+    def __del__(self):
+        # Don't leave on_complete pending if the stream is dropped without close().
+        self.close()
+
+
+def iter_elements(chunks, tag, objectified=True):
+    """ Yield each objectified (or, if objectified is False, plain lxml.etree) tag element parsed
+    from an iterable of XML byte chunks.
+
+    Elements are yielded as soon as their closing tag arrives, then cleared (along with
+    already processed siblings) when the consumer asks for the next one, so memory stays
+    flat however long the list is. Copy out anything needed before advancing.
+    """
+    parser = element_parser(tag, objectified)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for element in read_elements(parser):
+            yield element
+    parser.close()
+    for element in read_elements(parser):
+        yield element
+
+
+def element_parser(tag, objectified=True):
+    """ Return incremental parser emitting tag elements as data is fed to it.
+
+    Elements are objectified unless objectified is False, which skips objectify's per-element
+    class lookup for callers that only read text (findtext, xpath).
+    """
+    # Pull parser is the feed-driven counterpart of etree.iterparse; unlike iterparse it
+    # accepts an element class lookup, so records keep objectify attribute access.
+    parser = etree.XMLPullParser(events=('end',), tag=tag, remove_blank_text=True, huge_tree=True)
+    if objectified:
+        parser.set_element_class_lookup(objectify.ObjectifyElementClassLookup())
+    return parser
+
+
+def read_elements(parser):
+    """ Yield pending elements from parser, freeing each one after it is consumed.
+
+    """
+    for _, element in parser.read_events():
+        yield element
+        element.clear()
+        # Drop references the parent holds to earlier, already processed siblings.
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                parent.remove(element.getprevious())
+
+
+def iter_service_records(chunks, summary):
+    """ Yield each objectified record (child of <data>) of a Portal API ServiceResponse parsed from XML byte chunks.
+
+    Records are cleared once the consumer advances, as in iter_elements. The response's other fields
+    (responseCode, count, hasMoreRecords, lastId, errorMessage, ...) are stored in the summary dict.
+    """
+    parser = element_parser(None)
+
+    def records():
+        for _, element in parser.read_events():
+            parent = element.getparent()
+            if parent is None:
+                continue
+            if parent.tag == 'data':
+                yield element
+                element.clear()
+                # Drop references the parent holds to earlier, already processed siblings.
+                while element.getprevious() is not None:
+                    parent.remove(element.getprevious())
+            elif parent.tag in ('ServiceResponse', 'responseErrorDetails') and element.tag != 'data':
+                summary[element.tag] = element.text
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for record in records():
+            yield record
+    parser.close()
+    for record in records():
+        yield record
+
+
+class _Failure(object):
+    """ Wrap an exception raised in the prefetch thread so the consumer can re-raise it.
+
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def iter_prefetched(records, buffer_size=1000):
+    """ Yield records while a background thread keeps reading up to buffer_size records ahead.
+
+    Keeps the network busy fetching the next page while the caller works on the current
+    one. Records are deep copied before hand-off, since the parser clears the originals.
+    """
+    return iter_merged([records], 1, buffer_size)
+
+
+def iter_merged(sources, workers=1, buffer_size=1000):
+    """ Yield records from a list of record iterables, consumed concurrently on up to workers threads.
+
+    Records are yielded in whatever order the sources produce them. As with iter_prefetched,
+    each record is deep copied before it is handed to the caller.
+    """
+    buffer = queue.Queue(maxsize=buffer_size)
+    pending = queue.Queue()
+    for source in sources:
+        pending.put(source)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer went away, rather than blocking on a full buffer forever.
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            while not stop.is_set():
+                try:
+                    records = pending.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    for record in records:
+                        if not put(copy.deepcopy(record)):
+                            break
+                finally:
+                    if hasattr(records, 'close'):
+                        # Release the streamed response if the consumer stopped early.
+                        records.close()
+        except Exception as e:
+            logger.debug('Prefetch failed: %s', e)
+            put(_Failure(e))
+        else:
+            put(_DONE)
+
+    workers = max(1, min(workers, len(sources)))
+    for _ in range(workers):
+        producer = threading.Thread(target=produce, name='qualysapi-prefetch')
+        producer.daemon = True
+        producer.start()
+    try:
+        done = 0
+        while done < workers:
+            item = buffer.get()
+            if item is _DONE:
+                done += 1
+                continue
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
@@ -1,5 +1,6 @@
 """ A set of utility functions for QualysConnect module. """
 from __future__ import absolute_import
+import datetime
 import logging
 
 import qualysapi.config as qcconf
@@ -24,6 +25,22 @@ def connect(config_file=qcs.default_filename, remember_me=False, remember_me_alw
     connect = qcconn.QGConnector(conf.get_auth(),
                                  conf.get_hostname(),
                                  conf.proxies,
-                                 conf.max_retries)
+                                 conf.max_retries,
+                                 pool_connections=conf.pool_connections,
+                                 pool_maxsize=conf.pool_maxsize,
+                                 pool_block=conf.pool_block,
+                                 connect_timeout=conf.connect_timeout,
+                                 read_timeout=conf.read_timeout)
     logger.info("Finished building connector.")
     return connect
+
+
+def utcnow():
+    """ Return the current UTC time as a naive datetime, like the QualysGuard datetimes parsed by api_objects.
+
+    """
+    try:
+        return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    except AttributeError:
+        # Python 2 has no datetime.timezone.
+        return datetime.datetime.utcnow()
@@ -51,4 +51,10 @@ setup(name=__pkgname__,
       install_requires=[
           'requests',
       ],
+      extras_require={
+          # AsyncQGConnector (Python 3.6+).
+          'async': ['aiohttp'],
+          # HostTable.
+          'numpy': ['numpy'],
+      },
      )
@@ -0,0 +1,36 @@
+""" Fixtures shared by the tests: a MockQualys server on localhost and connectors talking to it.
+
+"""
+from __future__ import absolute_import
+import sys
+
+import pytest
+
+from benchmarks.mockserver import MockConnector, MockQualys
+
+# AsyncQGConnector requires Python 3.6+.
+collect_ignore = ['test_async.py'] if sys.version_info < (3, 6) else []
+
+
+@pytest.fixture
+def server():
+    server = MockQualys(hosts=250, scans=5)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def connector(server):
+    """ Return factory of MockConnectors to server, without rate limiter unless asked for.
+
+    """
+    connectors = []
+
+    def make(**kwargs):
+        kwargs.setdefault('rate_limiter', False)
+        conn = MockConnector(server, **kwargs)
+        connectors.append(conn)
+        return conn
+    yield make
+    for conn in connectors:
+        conn.session.close()
@@ -0,0 +1,111 @@
+""" Tests for AsyncQGConnector & AsyncQGActions against MockQualys.
+
+"""
+import asyncio
+
+import pytest
+
+from qualysapi.async_connector import AsyncQGConnector, AsyncRateLimiter
+from qualysapi.connector import QGConnector
+
+call = '/api/2.0/fo/asset/host/'
+
+
+class MockAsyncConnector(AsyncQGConnector):
+    """ AsyncQGConnector talking plain HTTP to a MockServer.
+
+    """
+
+    def __init__(self, server, **kwargs):
+        AsyncQGConnector.__init__(self, ('user', 'password'), server=server.address, **kwargs)
+
+    def url_api_version(self, api_version):
+        return QGConnector.url_api_version(self, api_version).replace('https://', 'http://', 1)
+
+
+def run(server, test, **kwargs):
+    """ Return result of coroutine function test(conn), run with a MockAsyncConnector to server.
+
+    """
+    async def main():
+        async with MockAsyncConnector(server, **kwargs) as conn:
+            return await test(conn)
+    return asyncio.run(main())
+
+
+def test_request(server):
+    async def test(conn):
+        return await conn.request(call, {'action': 'list', 'truncation_limit': 0})
+    response = run(server, test)
+    assert response.count('<HOST>') == 250
+
+
+def test_stream(server):
+    async def test(conn):
+        async with await conn.request(call, {'action': 'list', 'truncation_limit': 0}, stream=True) as stream:
+            return await stream.read()
+    assert run(server, test).count(b'<HOST>') == 250
+
+
+def test_stream_holds_slot_until_closed(server):
+    async def test(conn):
+        conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].concurrency_limit = 1
+        stream = await conn.request(call, {'action': 'list', 'truncation_limit': 0}, stream=True)
+        with pytest.raises(Exception, match='No concurrency slot'):
+            await conn.request(call, {'action': 'list', 'ids': '1'})
+        stream.close()
+        return await conn.request(call, {'action': 'list', 'ids': '1'})
+    assert '<HOST_LIST_OUTPUT>' in run(server, test, rate_limiter=AsyncRateLimiter(slot_timeout=0.2))
+
+
+def test_stream_releases_slot_when_dropped(server):
+    async def test(conn):
+        conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].concurrency_limit = 1
+        stream = await conn.request(call, {'action': 'list', 'truncation_limit': 0}, stream=True)
+        del stream
+        return await conn.request(call, {'action': 'list', 'ids': '1'})
+    assert '<HOST_LIST_OUTPUT>' in run(server, test, rate_limiter=AsyncRateLimiter(slot_timeout=0.2))
+
+
+def test_rate_limit_error_retried(server):
+    server.rate_limit_errors = 1
+
+    async def test(conn):
+        return await conn.request(call, {'action': 'list', 'ids': '1'})
+    assert '<HOST_LIST_OUTPUT>' in run(server, test)
+    assert server.hits[call] == 2
+
+
+def test_iter_records_follows_truncation(server):
+    async def test(conn):
+        return [int(host.findtext('ID')) async for host in
+                conn.iter_records(call, {'action': 'list'}, truncation_limit=100, objectified=False)]
+    assert run(server, test) == list(range(1, 251))
+    assert server.hits[call] == 3
+
+
+def test_iter_records_releases_slots(server):
+    async def test(conn):
+        conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].concurrency_limit = 1
+        ids = [int(host.ID) async for host in conn.iter_records(call, {'action': 'list'}, truncation_limit=100)]
+        return ids, conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].running
+    ids, running = run(server, test)
+    assert len(ids) == 250 and running == 0
+
+
+def test_get_hosts(server):
+    async def test(conn):
+        return await conn.getHosts(['10.0.0.1', '10.0.0.2', '10.0.0.150', '10.0.1.200'], ips_per_request=2)
+    hosts = run(server, test)
+    assert hosts['10.0.0.1'].id == 1 and hosts['10.0.0.150'].id == 150
+    # Unknown to QualysGuard.
+    assert hosts['10.0.1.200'].id is None
+    assert server.hits[call] == 2
+
+
+def test_concurrent_scans_error(server):
+    server.concurrent_scan_errors = 1
+
+    async def test(conn):
+        return await conn.request('/api/2.0/fo/scan/', {'action': 'launch'})
+    assert run(server, test) is False
@@ -0,0 +1,167 @@
+""" Tests for the response cache: keys, eviction, invalidation and what QGConnector caches.
+
+"""
+from __future__ import absolute_import
+import time
+
+import qualysapi.cache
+from qualysapi.cache import DiskCache, MemoryCache, ResponseCache
+
+call = '/api/2.0/fo/asset/host/'
+
+
+def key(data, server='qualysapi.qualys.com', username='user', api_call='api/2.0/fo/asset/host/'):
+    return qualysapi.cache.request_key(server, username, 2, api_call, 'post', data)
+
+
+def test_key_ignores_parameter_order():
+    assert key({'action': 'list', 'ids': '1', 'details': 'All'}) == key({'details': 'All', 'ids': '1',
+                                                                           'action': 'list'})
+
+
+def test_key_differs_by_call_identity():
+    base = key({'action': 'list'})
+    assert base != key({'action': 'list', 'ids': '1'})
+    assert base != key({'action': 'list'}, server='qualysapi.qg2.apps.qualys.com')
+    assert base != key({'action': 'list'}, username='other')
+    assert base != key({'action': 'list'}, api_call='api/2.0/fo/asset/group/')
+
+
+def test_key_starts_with_server():
+    prefix = qualysapi.cache.server_key('qualysapi.qualys.com')
+    assert key({'action': 'list'}).startswith(prefix)
+    assert key({'action': 'list'}, username='other').startswith(prefix)
+    assert key({'action': 'list'}, api_call='api/2.0/fo/asset/group/').startswith(prefix)
+    assert not key({'action': 'list'}, server='qualysapi.qg2.apps.qualys.com').startswith(prefix)
+
+
+def test_is_read_only():
+    is_read_only = qualysapi.cache.is_read_only
+    assert is_read_only('api/2.0/fo/asset/host/', 'post', {'action': 'list'})
+    assert is_read_only('api/2.0/fo/asset/host/', 'post', {'action': ['fetch']})
+    assert not is_read_only('api/2.0/fo/scan/', 'post', {'action': 'launch'})
+    assert is_read_only('asset_group_list.php', 'post', None)
+    assert not is_read_only('scan_cancel.php', 'get', None)
+    assert is_read_only('search/am/hostasset', 'post', '<ServiceRequest/>')
+    assert not is_read_only('update/am/hostasset', 'post', '<ServiceRequest/>')
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_bytes=10)
+    cache.set('a', b'aaaa', 60)
+    cache.set('b', b'bbbb', 60)
+    assert cache.get('a') == b'aaaa'
+    cache.set('c', b'cccc', 60)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa' and cache.get('c') == b'cccc'
+    assert cache.size == 8
+    cache.set('d', b'd' * 11, 60)
+    assert cache.get('d') is None
+
+
+def test_memory_cache_expires():
+    cache = MemoryCache()
+    cache.set('a', b'a', -1)
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_memory_cache_delete_prefix():
+    cache = MemoryCache()
+    cache.set('x-1', b'1', 60)
+    cache.set('x-2', b'2', 60)
+    cache.set('y-1', b'3', 60)
+    cache.delete_prefix('x-')
+    assert cache.get('x-1') is None and cache.get('x-2') is None
+    assert cache.get('y-1') == b'3'
+    assert cache.size == 1
+
+
+def test_disk_cache(tmpdir):
+    # Files hold a line with the expiry too, so two of these entries fit.
+    cache = DiskCache(str(tmpdir), max_bytes=130)
+    cache.set('x-1', b'a' * 40, 60)
+    time.sleep(0.01)
+    cache.set('x-2', b'b' * 40, 60)
+    time.sleep(0.01)
+    assert cache.get('x-1') == b'a' * 40
+    cache.set('y-1', b'c' * 40, 60)
+    # x-2 was used least recently.
+    assert cache.get('x-2') is None
+    cache.delete_prefix('x-')
+    assert cache.get('x-1') is None
+    assert cache.get('y-1') == b'c' * 40
+    cache.set('z-1', b'z', -1)
+    assert cache.get('z-1') is None
+
+
+def test_ttls():
+    cache = ResponseCache(ttl=300, ttls={'api/2.0/fo/asset/': 60, 'api/2.0/fo/asset/group/': 0,
+                                         'api/2.0/fo/report/': 30})
+    assert cache.ttl_for('api/2.0/fo/asset/host/') == 60
+    assert cache.ttl_for('api/2.0/fo/asset/group/') == 0
+    assert cache.ttl_for('api/2.0/fo/knowledge_base/vuln/') == 300
+    # Defaults can be overridden.
+    assert cache.ttl_for('api/2.0/fo/report/') == 30
+    assert cache.ttl_for('api/2.0/fo/scan/') == 0
+    assert not cache.is_cacheable(2, 'api/2.0/fo/scan/', 'post', {'action': 'list'})
+
+
+def test_connector_serves_repeated_reads(server, connector):
+    conn = connector(cache=True)
+    first = conn.request(call, {'action': 'list', 'ids': '1-10'})
+    assert not conn.last_response.cached
+    assert conn.request(call, {'ids': '1-10', 'action': 'list'}) == first
+    assert conn.last_response.cached
+    assert server.hits[call] == 1
+    conn.request(call, {'action': 'list', 'ids': '1-20'})
+    assert server.hits[call] == 2
+
+
+def test_connector_streams_from_cache(server, connector):
+    conn = connector(cache=True)
+    records = list(conn.iter_records(call, {'action': 'list'}, objectified=False))
+    assert len(list(conn.iter_records(call, {'action': 'list'}, objectified=False))) == len(records) == 250
+    assert conn.last_response.cached
+    assert server.hits[call] == 1
+
+
+def test_connector_bypasses_cache(server, connector):
+    conn = connector(cache=True)
+    conn.request(call, {'action': 'list'})
+    conn.request(call, {'action': 'list'}, cache=False)
+    assert not conn.last_response.cached
+    assert server.hits[call] == 2
+
+
+def test_connector_invalidates_on_writes(server, connector):
+    conn = connector(cache=True)
+    conn.request(call, {'action': 'list', 'ids': '1'})
+    conn.request(call, {'action': 'list', 'ids': '2'})
+    conn.request('asset_group_list.php')
+    conn.request(call, {'action': 'purge', 'ids': '1'})
+    conn.request(call, {'action': 'list', 'ids': '1'})
+    conn.request(call, {'action': 'list', 'ids': '2'})
+    assert server.hits[call] == 5
+    assert not conn.last_response.cached
+
+
+def test_connector_invalidates_related_lists(server, connector):
+    conn = connector(cache=True)
+    conn.request('asset_group_list.php')
+    conn.request(call, {'action': 'list'})
+    # Adding IPs to a group changes the asset group & host lists.
+    conn.request('/api/2.0/fo/asset/group/', {'action': 'edit', 'id': '1', 'add_ips': '10.0.0.1'})
+    conn.request('asset_group_list.php')
+    assert not conn.last_response.cached
+    conn.request(call, {'action': 'list'})
+    assert not conn.last_response.cached
+    assert server.hits['/msp/asset_group_list.php'] == 2
+    assert server.hits[call] == 2
+
+
+def test_connector_does_not_cache_scans(server, connector):
+    conn = connector(cache=True)
+    conn.request('/api/2.0/fo/scan/', {'action': 'list'})
+    conn.request('/api/2.0/fo/scan/', {'action': 'list'})
+    assert server.hits['/api/2.0/fo/scan/'] == 2
@@ -0,0 +1,64 @@
+""" Tests for incremental host detection syncs (DetectionSync).
+
+"""
+from __future__ import absolute_import
+
+from qualysapi.detection import DetectionSync
+
+call = '/api/2.0/fo/asset/host/vm/detection/'
+
+
+def events(sync, scope=None):
+    return sorted((event.kind, event.host_id, event.qid) for event in sync.sync(scope))
+
+
+def test_first_sync_adds_open_detections(server, connector):
+    server.detections = {1: ('2018-01-01T00:00:00Z', {100: 'New', 101: 'Active'}),
+                         2: ('2018-01-01T00:00:00Z', {100: 'Active'})}
+    sync = DetectionSync(connector())
+    assert sync.checkpoint() is None
+    assert events(sync) == [('add', 1, 100), ('add', 1, 101), ('add', 2, 100)]
+    assert 'vm_processed_after' not in server.parameters[call]
+    assert sync.checkpoint() > '2018-01-01T00:00:00Z'
+
+
+def test_sync_reports_changes(server, connector):
+    server.detections = {1: ('2018-01-01T00:00:00Z', {100: 'New', 101: 'Active'}),
+                         2: ('2018-01-01T00:00:00Z', {100: 'Active'})}
+    sync = DetectionSync(connector())
+    events(sync)
+    checkpoint = sync.checkpoint()
+    server.detections[1] = ('2099-01-01T00:00:00Z', {100: 'Fixed', 101: 'Active', 102: 'New'})
+    assert events(sync) == [('add', 1, 102), ('fixed', 1, 100), ('update', 1, 101)]
+    assert server.parameters[call]['vm_processed_after'] == checkpoint
+    server.detections[1] = ('2099-01-01T00:00:00Z', {100: 'Re-Opened'})
+    assert events(sync) == [('add', 1, 100)]
+
+
+def test_scopes_have_own_checkpoints(server, connector):
+    server.detections = {1: ('2018-01-01T00:00:00Z', {100: 'New'})}
+    sync = DetectionSync(connector())
+    events(sync, {'ag_ids': '1'})
+    assert server.parameters[call]['ag_ids'] == '1'
+    assert sync.checkpoint({'ag_ids': '1'}) is not None
+    assert sync.checkpoint({'ag_ids': '2'}) is None
+
+
+def test_checkpoint_moves_once_consumed(server, connector):
+    server.detections = {1: ('2018-01-01T00:00:00Z', {100: 'New'}), 2: ('2018-01-01T00:00:00Z', {100: 'New'})}
+    sync = DetectionSync(connector())
+    next(sync.sync())
+    assert sync.checkpoint() is None
+
+
+def test_resumes_after_restart(server, connector, tmpdir):
+    server.detections = {1: ('2018-01-01T00:00:00Z', {100: 'New', 101: 'Active'})}
+    path = str(tmpdir.join('detections'))
+    with DetectionSync(connector(), path) as sync:
+        events(sync)
+        checkpoint = sync.checkpoint()
+    server.detections[1] = ('2099-01-01T00:00:00Z', {100: 'Active', 101: 'Fixed'})
+    with DetectionSync(connector(), path) as sync:
+        assert sync.checkpoint() == checkpoint
+        assert events(sync) == [('fixed', 1, 101), ('update', 1, 100)]
+        assert server.parameters[call]['vm_processed_after'] == checkpoint
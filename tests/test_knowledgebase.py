@@ -0,0 +1,48 @@
+""" Tests for the incremental KnowledgeBase mirror.
+
+"""
+from __future__ import absolute_import
+
+from qualysapi.knowledgebase import KnowledgeBase
+
+call = '/api/2.0/fo/knowledge_base/vuln/'
+
+
+def test_first_sync_mirrors_everything(server, connector):
+    server.vulns = dict((qid, '2018-01-01T00:00:00Z') for qid in range(1, 11))
+    kb = KnowledgeBase(connector())
+    assert kb.last_modified is None
+    assert kb.sync() == 10
+    assert 'last_modified_after' not in server.parameters[call]
+    assert len(kb) == 10 and sorted(kb.qids()) == list(range(1, 11))
+    assert kb[3].TITLE == 'Vulnerability 3'
+    assert 3 in kb and 11 not in kb
+    assert kb.get(11) is None
+
+
+def test_sync_fetches_changes_only(server, connector):
+    server.vulns = dict((qid, '2018-01-01T00:00:00Z') for qid in range(1, 11))
+    kb = KnowledgeBase(connector())
+    kb.sync()
+    checkpoint = kb.last_modified
+    assert checkpoint > '2018-01-01T00:00:00Z'
+    server.vulns[4] = '2099-01-01T00:00:00Z'
+    server.vulns[11] = '2099-01-01T00:00:00Z'
+    assert kb.sync() == 2
+    assert server.parameters[call]['last_modified_after'] == checkpoint
+    assert len(kb) == 11
+
+
+def test_resumes_after_restart(server, connector, tmpdir):
+    server.vulns = dict((qid, '2018-01-01T00:00:00Z') for qid in range(1, 11))
+    path = str(tmpdir.join('kb'))
+    with KnowledgeBase(connector(), path) as kb:
+        kb.sync()
+        checkpoint = kb.last_modified
+    server.vulns[11] = '2099-01-01T00:00:00Z'
+    with KnowledgeBase(connector(), path) as kb:
+        assert kb.last_modified == checkpoint
+        assert len(kb) == 10
+        assert kb.sync() == 1
+        assert server.parameters[call]['last_modified_after'] == checkpoint
+        assert kb[11].QID == 11
@@ -0,0 +1,103 @@
+""" Tests for the rate limit scheduler (qualysapi.ratelimit) and how QGConnector holds its slots.
+
+"""
+from __future__ import absolute_import
+import threading
+import time
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+from qualysapi.ratelimit import RateLimiter, TokenBucket
+
+call = '/api/2.0/fo/asset/host/'
+parameters = {'action': 'list', 'truncation_limit': 0}
+
+
+def headers(values):
+    """ Return response headers, looked up case-insensitively like requests' are.
+
+    """
+    return CaseInsensitiveDict(values)
+
+
+def test_bucket_starts_unlimited():
+    bucket = TokenBucket()
+    assert bucket.delay(time.time()) == 0
+    assert not bucket.is_saturated()
+
+
+def test_bucket_syncs_with_headers():
+    bucket = TokenBucket()
+    now = time.time()
+    bucket.update(headers({'X-RateLimit-Limit': '300', 'X-RateLimit-Window-Sec': '3600',
+                           'X-RateLimit-Remaining': '0'}), now)
+    assert (bucket.limit, bucket.window, bucket.tokens) == (300, 3600, 0)
+    # One token every 12 seconds.
+    assert bucket.delay(now) == pytest.approx(12)
+    assert bucket.delay(now + 12) == 0
+    bucket.update(headers({'X-RateLimit-Remaining': '5', 'X-RateLimit-ToWait-Sec': '30'}), now)
+    assert bucket.delay(now) == pytest.approx(30)
+
+
+def test_bucket_counts_other_clients():
+    bucket = TokenBucket()
+    bucket.take(time.time())
+    bucket.update(headers({'X-Concurrency-Limit-Limit': '2', 'X-Concurrency-Limit-Running': '2'}), time.time())
+    assert bucket.others_running == 1
+    assert bucket.is_saturated()
+    bucket.running = 0
+    # One call may always run.
+    assert not bucket.is_saturated()
+
+
+def test_limiter_waits_for_a_slot():
+    limiter = RateLimiter()
+    limiter.buckets['call'].concurrency_limit = 1
+    limiter.acquire('call')
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(limiter.acquire('call')))
+    thread.start()
+    thread.join(0.2)
+    assert not acquired
+    limiter.release('call')
+    thread.join(5)
+    assert acquired
+
+
+def test_limiter_times_out():
+    limiter = RateLimiter(slot_timeout=0.2)
+    limiter.buckets['call'].concurrency_limit = 1
+    limiter.acquire('call')
+    with pytest.raises(Exception, match='No concurrency slot'):
+        limiter.acquire('call')
+
+
+def test_rate_limit_error_retried(server, connector):
+    conn = connector(rate_limiter=True)
+    server.rate_limit_errors = 1
+    started = time.time()
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+    # Held back for X-RateLimit-ToWait-Sec.
+    assert time.time() - started >= 1
+    assert conn.last_response.rate_limit_retries == 1
+    assert server.hits[call] == 2
+
+
+def test_stream_holds_slot_until_closed(server, connector):
+    conn = connector(rate_limiter=RateLimiter(slot_timeout=0.2))
+    conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].concurrency_limit = 1
+    stream = conn.request(call, parameters, stream=True)
+    with pytest.raises(Exception, match='No concurrency slot'):
+        conn.request(call, parameters)
+    stream.close()
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+
+
+def test_stream_releases_slot_when_dropped(server, connector):
+    conn = connector(rate_limiter=RateLimiter(slot_timeout=0.2))
+    conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].concurrency_limit = 1
+    stream = conn.request(call, parameters, stream=True)
+    del stream
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+    assert conn.rate_limiter.buckets['api/2.0/fo/asset/host/'].running == 0
@@ -0,0 +1,45 @@
+""" Tests for parsing API v2 list responses record by record (qualysapi.streaming.iter_elements,
+QGActions.iter_records).
+
+"""
+from __future__ import absolute_import
+
+import qualysapi.streaming
+from benchmarks.mockserver import host_list
+
+call = '/api/2.0/fo/asset/host/'
+
+
+def chunked(body, size):
+    return [body[index:index + size] for index in range(0, len(body), size)]
+
+
+def test_iter_elements_across_chunks():
+    hosts = qualysapi.streaming.iter_elements(chunked(host_list(50), 100), 'HOST', objectified=False)
+    assert [int(host.findtext('ID')) for host in hosts] == list(range(1, 51))
+
+
+def test_iter_elements_objectified():
+    hosts = qualysapi.streaming.iter_elements(chunked(host_list(3), 1000), 'HOST')
+    assert [(int(host.ID), host.IP.text) for host in hosts] == [(1, '10.0.0.1'), (2, '10.0.0.2'), (3, '10.0.0.3')]
+
+
+def test_iter_elements_clears_consumed_records():
+    hosts = qualysapi.streaming.iter_elements([host_list(3)], 'HOST', objectified=False)
+    first = next(hosts)
+    assert first.findtext('ID') == '1'
+    next(hosts)
+    assert len(first) == 0
+
+
+def test_iter_records(server, connector):
+    conn = connector()
+    hosts = conn.iter_records(call, {'action': 'list', 'truncation_limit': 0}, objectified=False)
+    assert [int(host.findtext('ID')) for host in hosts] == list(range(1, 251))
+    assert server.hits[call] == 1
+
+
+def test_list_scans(server, connector):
+    scans = connector().listScans()
+    assert [scan.ref for scan in scans] == ['scan/1514764800.%05d' % i for i in range(5)]
+    assert scans[0].status == 'Finished'
@@ -0,0 +1,94 @@
+""" Tests for downloading reports (Report.download_to): resuming dropped downloads and checksums.
+
+"""
+from __future__ import absolute_import
+import hashlib
+import io
+import zlib
+
+import pytest
+
+from qualysapi.api_objects import Report
+
+call = '/api/2.0/fo/report/'
+
+
+def report(status='Finished'):
+    return Report('2018-01-09T03:04:05Z', '1', '2018-01-02T03:04:05Z', 'PDF', '300000', status, 'Scan', 'user')
+
+
+def record_ranges(server):
+    """ Return list the Range header of each report fetch is appended to.
+
+    """
+    ranges = []
+    route = server.routes[call]
+
+    def recorded(handler, body):
+        ranges.append(handler.headers.get('Range'))
+        return route(handler, body)
+    server.routes[call] = recorded
+    return ranges
+
+
+def test_download(server, connector):
+    destination = io.BytesIO()
+    checksum = report().download_to(connector(), destination)
+    assert destination.getvalue() == server.report_content
+    assert checksum == hashlib.sha256(server.report_content).hexdigest()
+
+
+def test_download_to_path(server, connector, tmpdir):
+    path = str(tmpdir.join('report.pdf'))
+    checksum = report().download_to(connector(), path)
+    with open(path, 'rb') as report_file:
+        assert report_file.read() == server.report_content
+    assert checksum == hashlib.sha256(server.report_content).hexdigest()
+
+
+def test_resumes_dropped_download(server, connector):
+    ranges = record_ranges(server)
+    server.report_drops = 1
+    destination = io.BytesIO()
+    progress = []
+    checksum = report().download_to(connector(), destination, progress=lambda received, total: progress.append(total))
+    assert destination.getvalue() == server.report_content
+    assert checksum == hashlib.sha256(server.report_content).hexdigest()
+    # Resumed where the connection dropped, whole chunks in.
+    assert len(ranges) == 2 and ranges[0] is None
+    assert 0 < int(ranges[1][len('bytes='):-1]) <= len(server.report_content) // 2
+    assert set(progress) == set([len(server.report_content)])
+
+
+def test_restarts_when_range_is_ignored(server, connector):
+    ranges = record_ranges(server)
+    server.report_drops = 1
+    server.ignore_range = True
+    destination = io.BytesIO()
+    checksum = report().download_to(connector(), destination)
+    assert destination.getvalue() == server.report_content
+    assert checksum == hashlib.sha256(server.report_content).hexdigest()
+    assert len(ranges) == 2
+
+
+def test_gives_up(server, connector):
+    server.report_drops = 3
+    with pytest.raises(IOError):
+        report().download_to(connector(), io.BytesIO(), max_resumes=2)
+    assert server.hits[call] == 3
+
+
+def test_decompress(server, connector):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    text = b'<REPORT>' + b'<ROW/>' * 50000 + b'</REPORT>'
+    server.report_content = compressor.compress(text) + compressor.flush()
+    server.report_drops = 1
+    destination = io.BytesIO()
+    checksum = report().download_to(connector(), destination, decompress=True)
+    assert destination.getvalue() == text
+    assert checksum == hashlib.sha256(text).hexdigest()
+
+
+def test_not_finished(server, connector):
+    with pytest.raises(ValueError):
+        report('Running').download_to(connector(), io.BytesIO())
@@ -0,0 +1,150 @@
+""" Tests that the precompiled endpoint table (qualysapi.routing) routes every call exactly as
+QGConnector.prepare_request did before it.
+
+"""
+from __future__ import absolute_import
+import itertools
+
+import pytest
+
+import qualysapi.api_methods
+import qualysapi.routing
+from qualysapi.connector import QGConnector
+
+api_methods = qualysapi.api_methods.api_methods
+api_methods_with_trailing_slash = qualysapi.api_methods.api_methods_with_trailing_slash
+
+api_versions = (None, 1, 2, '1', 'v1', 'v2', 'V2', 'am', 'am2', 'was', 'assets', 'webapp', 'pc')
+payloads = (None, '', {}, {'action': 'list'}, 'action=list&ids=1', '<ServiceRequest/>')
+
+
+def legacy_api_version(api_version):
+    """ Return api_version as formatted by QGConnector.format_api_version before the routing table.
+
+    """
+    if type(api_version) == str:
+        api_version = api_version.lower()
+        if api_version[0] == 'v' and api_version[1].isdigit():
+            api_version = api_version[1:]
+        if api_version in ('asset management', 'assets', 'tag', 'tagging', 'tags'):
+            api_version = 'am'
+        elif api_version in ('am2'):
+            api_version = 'am2'
+        elif api_version in ('webapp', 'web application scanning', 'webapp scanning'):
+            api_version = 'was'
+        elif api_version in ('pol', 'pc'):
+            api_version = 2
+        else:
+            api_version = int(api_version)
+    return api_version
+
+
+def legacy_which_api_version(api_call):
+    if api_call.endswith('.php'):
+        return 1
+    elif api_call.startswith('api/2.0/'):
+        return 2
+    elif '/am/' in api_call:
+        return 'am'
+    elif '/was/' in api_call:
+        return 'was'
+    return False
+
+
+def legacy_http_method(api_version, api_call, data):
+    if api_version == 2:
+        return 'post'
+    elif api_version == 1:
+        return 'post' if api_call in api_methods['1 post'] else 'get'
+    elif api_version == 'was':
+        api_call_endpoint = api_call[:api_call.rfind('/') + 1]
+        if api_call_endpoint in api_methods['was get']:
+            return 'get'
+        if not data and api_call_endpoint in api_methods['was no data get']:
+            return 'get'
+        return 'post'
+    return 'get' if api_call in api_methods['am get'] else 'post'
+
+
+def legacy_format_call(api_version, api_call):
+    api_call = api_call.lstrip('/').rstrip('?')
+    if api_version == 2 and api_call[-1] != '/':
+        api_call += '/'
+    if api_call in api_methods_with_trailing_slash[api_version]:
+        api_call += '/'
+    return api_call
+
+
+def legacy_route(conn, api_call, data, api_version):
+    """ Return (api_call, api_version, url, http_method) as QGConnector.prepare_request built them before the
+    routing table.
+
+    """
+    api_call = api_call.lstrip('/').rstrip('?')
+    if api_version:
+        api_version = legacy_api_version(api_version)
+    else:
+        api_version = legacy_which_api_version(api_call)
+    url = conn.url_api_version(api_version)
+    http_method = legacy_http_method(api_version, api_call, data)
+    api_call = legacy_format_call(api_version, api_call)
+    if data is not None:
+        # Fails alike for both, on payloads it can't format.
+        conn.format_payload(api_version, data)
+    return api_call, api_version, url + api_call, http_method
+
+
+def calls():
+    """ Return sorted list of every api_methods call, with and without slashes or a trailing question mark, and
+    with a resource id.
+
+    """
+    spellings = set()
+    for method in set(itertools.chain.from_iterable(api_methods.values())):
+        stripped = method.rstrip('/')
+        for spelling in (method, stripped, stripped + '/18823', stripped + '/18823/'):
+            for variant in (spelling, '/' + spelling, spelling + '?', '/' + spelling + '?'):
+                if variant.strip('/?'):
+                    spellings.add(variant)
+    return sorted(spellings)
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e)
+
+
+@pytest.fixture(scope='module')
+def conn():
+    return QGConnector(('user', 'password'))
+
+
+def test_prepare_request_matches_legacy_routing(conn):
+    combinations = 0
+    mismatches = []
+    for api_call, api_version, data in itertools.product(calls(), api_versions, payloads):
+        expected = outcome(legacy_route, conn, api_call, data, api_version)
+        routed = outcome(lambda: conn.prepare_request(api_call, data, api_version)[:4])
+        if routed != expected:
+            mismatches.append((api_call, api_version, data, expected, routed))
+        combinations += 1
+    assert combinations > 50000
+    assert mismatches == []
+
+
+def test_resolve_memoizes_unknown_calls():
+    route = qualysapi.routing.resolve('/get/was/webapp/18823')
+    assert route == qualysapi.routing.resolve('/get/was/webapp/18823')
+    assert ('/get/was/webapp/18823', None) in qualysapi.routing._memo
+    assert route.api_version == 'was'
+    assert route.api_call == 'get/was/webapp/18823'
+
+
+def test_memo_is_bounded(monkeypatch):
+    monkeypatch.setattr(qualysapi.routing, 'memo_size', 10)
+    for resource in range(20):
+        qualysapi.routing.resolve('/get/was/webapp/%d' % resource)
+    assert len(qualysapi.routing._memo) <= 10
+    assert ('/get/was/webapp/19', None) in qualysapi.routing._memo
@@ -0,0 +1,97 @@
+""" Tests for ScanLaunchQueue and the scan launches it relies on.
+
+"""
+from __future__ import absolute_import
+
+import pytest
+import requests
+
+from benchmarks.mockserver import scan_list
+from qualysapi.scanqueue import ScanLaunchQueue
+
+call = '/api/2.0/fo/scan/'
+
+
+def submit(queue, count, **kwargs):
+    for i in range(count):
+        queue.submit('Scan %d' % i, 'Initial Options', 'scanner', ip='10.0.0.%d' % i, **kwargs)
+
+
+def test_launch_scan_lists_launched_scan(server, connector):
+    scan = connector().launchScan('Weekly', 'Initial Options', 'scanner', asset_groups='Group 1')
+    assert scan.ref == server.launched[0][0]
+    assert scan.status == 'Queued'
+    assert scan.title == 'Weekly'
+
+
+def test_launch_scan_not_listed_yet(server, connector):
+    # Lists nothing, as QualysGuard may right after a launch.
+    route = server.routes[call]
+    server.routes[call] = lambda handler, body: (route(handler, body) if handler.parameters(body)['action'] == 'launch'
+                                                 else (200, {}, scan_list(0)))
+    scan = connector().launchScan('Weekly', 'Initial Options', 'scanner', asset_groups='Group 1, Group 2')
+    assert scan.ref == server.launched[0][0]
+    assert scan.status == 'Submitted'
+    assert scan.title == 'Weekly'
+    assert scan.assetgroups == ['Group 1', 'Group 2']
+
+
+def test_launches_up_to_max_concurrent(server, connector):
+    queue = ScanLaunchQueue(connector(), max_concurrent=2)
+    submit(queue, 3)
+    assert len(queue.launch()) == 2
+    assert len(queue) == 1 and len(queue.running) == 2
+    assert queue.launch() == []
+    server.launched[0][1] = 'Finished'
+    queue.step()
+    assert len(queue) == 0 and len(queue.running) == 2
+
+
+def test_launches_by_priority(server, connector):
+    queue = ScanLaunchQueue(connector())
+    queue.submit('Low', 'Initial Options', 'scanner', ip='10.0.0.1')
+    queue.submit('High', 'Initial Options', 'scanner', ip='10.0.0.2', priority=1)
+    queue.submit('Low too', 'Initial Options', 'scanner', ip='10.0.0.3')
+    assert [scan.title for scan in queue.launch()] == ['High', 'Low', 'Low too']
+
+
+def test_refused_launch_waits_for_next_poll(server, connector):
+    queue = ScanLaunchQueue(connector())
+    submit(queue, 3)
+    server.concurrent_scan_errors = 1
+    assert queue.launch() == []
+    # Not retried until the next poll, and the limit isn't learned from it.
+    assert server.hits[call] == 1
+    assert len(queue) == 3 and queue.max_concurrent is None
+    assert len(queue.launch()) == 3
+    assert len(queue) == 0
+
+
+def test_failed_launch_stays_queued(server, connector, tmpdir):
+    path = str(tmpdir.join('queue'))
+    route = server.routes[call]
+    server.routes[call] = lambda handler, body: (500, {}, b'Internal error')
+    with ScanLaunchQueue(connector(), path=path) as queue:
+        submit(queue, 1)
+        with pytest.raises(requests.HTTPError):
+            queue.launch()
+        assert len(queue) == 1
+    server.routes[call] = route
+    with ScanLaunchQueue(connector(), path=path) as queue:
+        assert len(queue) == 1
+        assert len(queue.launch()) == 1
+
+
+def test_resumes_after_restart(server, connector, tmpdir):
+    path = str(tmpdir.join('queue'))
+    with ScanLaunchQueue(connector(), max_concurrent=1, path=path) as queue:
+        submit(queue, 2)
+        launched = queue.launch()
+    with ScanLaunchQueue(connector(), max_concurrent=1, path=path) as queue:
+        assert len(queue) == 1
+        assert [scan.ref for scan in queue.running] == [launched[0].ref]
+        assert queue.launch() == []
+        server.launched[0][1] = 'Finished'
+        queue.step()
+        assert len(queue) == 0
+        assert [scan.ref for scan in queue.running] == [server.launched[1][0]]
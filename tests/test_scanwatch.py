@@ -0,0 +1,61 @@
+""" Tests for polling many scans with one list call (ScanWatcher).
+
+"""
+from __future__ import absolute_import
+import datetime
+
+import pytest
+
+import qualysapi.util
+from qualysapi.api_objects import Scan
+from qualysapi.scanwatch import ScanWatcher
+
+call = '/api/2.0/fo/scan/'
+
+
+def launch(conn, count):
+    return [conn.launchScan('Scan %d' % i, 'Initial Options', 'scanner', ip='10.0.0.%d' % i) for i in range(count)]
+
+
+def test_polls_all_scans_at_once(server, connector):
+    conn = connector()
+    watcher = ScanWatcher(conn, launch(conn, 3))
+    hits = server.hits[call]
+    server.launched[0][1] = 'Running'
+    server.launched[1][1] = 'Finished'
+    transitions = watcher.poll()
+    assert server.hits[call] == hits + 1
+    assert sorted((t.scan.ref, t.old_state, t.new_state) for t in transitions) == [
+        (server.launched[0][0], 'Queued', 'Running'), (server.launched[1][0], 'Queued', 'Finished')]
+    # Finished scans are no longer watched.
+    assert sorted(watcher.scans) == [server.launched[0][0], server.launched[2][0]]
+
+
+def test_callbacks(server, connector):
+    conn = connector()
+    watcher = ScanWatcher(conn, launch(conn, 1))
+    seen = []
+    watcher.on_transition(seen.append)
+    server.launched[0][1] = 'Finished'
+    assert list(watcher.watch()) == seen
+    assert [transition.new_state for transition in seen] == ['Finished']
+
+
+def test_drops_scans_no_longer_listed(server, connector):
+    conn = connector()
+    watcher = ScanWatcher(conn, [Scan.launched('scan/1514851200.99999', 'Gone', 'Initial Options')], missing_polls=2)
+    assert watcher.poll() == []
+    transitions = watcher.poll()
+    assert [transition.new_state for transition in transitions] == ['Missing']
+    assert not watcher.scans
+
+
+def test_interval_follows_scan_age(server, connector):
+    conn = connector()
+    watcher = ScanWatcher(conn, min_interval=30, max_interval=600, cadence=0.1)
+    assert watcher.interval() == 30
+    scan = Scan.launched('scan/1', 'Recent', 'Initial Options')
+    scan._launch_datetime = (qualysapi.util.utcnow() - datetime.timedelta(minutes=50)).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+    watcher.add(scan)
+    assert watcher.interval() == pytest.approx(300, abs=1)
@@ -0,0 +1,68 @@
+""" Tests for session based authentication (QGConnector auth_mode='session').
+
+"""
+from __future__ import absolute_import
+import threading
+
+import pytest
+import requests
+
+call = '/api/2.0/fo/asset/host/'
+parameters = {'action': 'list', 'truncation_limit': 0}
+
+
+def test_basic_does_not_log_in(server, connector):
+    conn = connector()
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+    assert server.logins == 0
+
+
+def test_logs_in_once(server, connector):
+    conn = connector(auth_mode='session')
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+    assert server.logins == 1
+    assert conn.logged_in
+    # API v1 keeps HTTP-Basic Authentication.
+    assert '<ASSET_GROUP_LIST>' in conn.request('asset_group_list.php')
+    assert server.logins == 1
+
+
+def test_logs_in_again_when_session_expires(server, connector):
+    conn = connector(auth_mode='session')
+    conn.request(call, parameters)
+    server.expire_sessions()
+    assert '<HOST_LIST_OUTPUT>' in conn.request(call, parameters)
+    assert server.logins == 2
+    assert server.hits[call] == 3
+
+
+def test_logs_in_again_once(server, connector):
+    conn = connector(auth_mode='session')
+    server.routes[call] = lambda handler, body: (401, {}, b'Unauthorized')
+    with pytest.raises(requests.HTTPError):
+        conn.request(call, parameters)
+    assert server.logins == 2
+
+
+def test_login_is_serialized(server, connector):
+    server.latency = 0.2
+    conn = connector(auth_mode='session', single_flight=False)
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(conn.request(call, parameters)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(responses) == 5
+    assert server.logins == 1
+
+
+def test_logs_out_on_exit(server, connector):
+    with connector(auth_mode='session') as conn:
+        conn.request(call, parameters)
+        assert server.sessions
+    assert server.logouts == 1
+    assert not server.sessions
+    assert not conn.logged_in
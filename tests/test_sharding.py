@@ -0,0 +1,58 @@
+""" Tests for splitting id & IP ranges into shards fetched concurrently (QGActions.iter_records_sharded).
+
+"""
+from __future__ import absolute_import
+
+import pytest
+
+import qualysapi.sharding
+
+call = '/api/2.0/fo/asset/host/'
+
+
+def host_ids(records):
+    return [int(record.findtext('ID')) for record in records]
+
+
+def test_ip_conversion():
+    assert qualysapi.sharding.ip_to_int('10.0.1.2') == 167772418
+    assert qualysapi.sharding.int_to_ip(167772418) == '10.0.1.2'
+
+
+def test_split_range():
+    assert qualysapi.sharding.split_range(1, 10, 3) == [(1, 4), (5, 8), (9, 10)]
+    assert qualysapi.sharding.split_range(1, 2, 4) == [(1, 1), (2, 2)]
+    with pytest.raises(ValueError):
+        qualysapi.sharding.split_range(2, 1, 4)
+
+
+def test_split_id_range():
+    assert qualysapi.sharding.split_id_range('1', '250', 2) == [{'id_min': 1, 'id_max': 125},
+                                                                {'id_min': 126, 'id_max': 250}]
+
+
+def test_split_ip_range():
+    assert qualysapi.sharding.split_ip_range('10.0.0.0', '10.0.1.255', 2) == [{'ips': '10.0.0.0-10.0.0.255'},
+                                                                             {'ips': '10.0.1.0-10.0.1.255'}]
+
+
+def test_sharded_by_id(server, connector):
+    conn = connector()
+    records = conn.iter_records_sharded(call, {'action': 'list'}, id_range=(1, 250), shards=3, truncation_limit=50,
+                                        objectified=False)
+    assert sorted(host_ids(records)) == list(range(1, 251))
+    # 3 shards of up to 84 hosts, 2 pages each.
+    assert server.hits[call] == 6
+
+
+def test_sharded_by_ip(server, connector):
+    conn = connector()
+    records = conn.iter_records_sharded(call, {'action': 'list'}, ip_range=('10.0.0.1', '10.0.0.200'), shards=4,
+                                        max_workers=2)
+    assert sorted(int(record.ID) for record in records) == list(range(1, 201))
+    assert server.hits[call] == 4
+
+
+def test_sharded_needs_one_range(server, connector):
+    with pytest.raises(ValueError):
+        connector().iter_records_sharded(call, {'action': 'list'})
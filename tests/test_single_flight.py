@@ -0,0 +1,106 @@
+""" Tests for sharing identical read requests in flight (QGConnector single_flight).
+
+"""
+from __future__ import absolute_import
+import threading
+import time
+
+call = '/api/2.0/fo/asset/host/'
+parameters = {'action': 'list', 'truncation_limit': 0}
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return threads
+
+
+def test_concurrent_reads_share_one_request(server, connector):
+    server.latency = 0.3
+    conn = connector()
+    responses = []
+    coalesced = []
+
+    def read():
+        responses.append(conn.request(call, parameters))
+        coalesced.append(conn.last_response.coalesced)
+    run_threads(5, read)
+    assert server.hits[call] == 1
+    assert len(responses) == 5 and len(set(responses)) == 1
+    assert sorted(coalesced) == [False, True, True, True, True]
+
+
+def test_writes_are_not_shared(server, connector):
+    server.latency = 0.3
+    conn = connector()
+    run_threads(3, lambda: conn.request(call, {'action': 'purge', 'ids': '1'}))
+    assert server.hits[call] == 3
+
+
+def test_disabled(server, connector):
+    server.latency = 0.3
+    conn = connector(single_flight=False)
+    run_threads(3, lambda: conn.request(call, parameters))
+    assert server.hits[call] == 3
+
+
+def test_stream_does_not_block_reads(server, connector):
+    conn = connector()
+    stream = conn.request(call, parameters, stream=True)
+    try:
+        done = []
+        thread = threading.Thread(target=lambda: done.append(conn.request(call, parameters)))
+        thread.start()
+        thread.join(5)
+        assert done and '<HOST_LIST_OUTPUT>' in done[0]
+        assert server.hits[call] == 2
+    finally:
+        stream.close()
+
+
+def test_stream_follows_buffered_leader(server, connector):
+    server.latency = 0.3
+    conn = connector()
+    leader = threading.Thread(target=lambda: conn.request(call, parameters))
+    leader.start()
+    time.sleep(0.1)
+    with conn.request(call, parameters, stream=True) as stream:
+        body = stream.read()
+    leader.join(5)
+    assert conn.last_response.coalesced
+    assert body.count(b'<HOST>') == 250
+    assert server.hits[call] == 1
+
+
+def test_slow_leader_times_out(server, connector):
+    server.latency = 1
+    conn = connector(single_flight_timeout=0.1)
+    coalesced = []
+
+    def read():
+        conn.request(call, parameters)
+        coalesced.append(conn.last_response.coalesced)
+    run_threads(2, read)
+    assert server.hits[call] == 2
+    assert coalesced == [False, False]
+
+
+def test_hook_calling_back_in_does_not_deadlock(server, connector):
+    conn = connector()
+    nested = []
+
+    @conn.add_hook
+    def hook(record):
+        # Called while this thread still leads the flight.
+        if not nested:
+            nested.append(None)
+            nested[0] = conn.request(call, parameters)
+    thread = threading.Thread(target=lambda: conn.request(call, parameters))
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert nested and '<HOST_LIST_OUTPUT>' in nested[0]
+    assert server.hits[call] == 2
@@ -0,0 +1,63 @@
+""" Tests for streamed responses (QGConnector.request(stream=True)): QualysGuard errors are detected on the
+first chunk, before the caller reads the body.
+
+"""
+from __future__ import absolute_import
+
+import pytest
+import requests
+
+import qualysapi.streaming
+from benchmarks.mockserver import concurrent_scans_error
+
+call = '/api/2.0/fo/asset/host/'
+secure_ip_error = (b'<?xml version="1.0" encoding="UTF-8" ?>\n<GENERIC_RETURN><API name="asset_group_list.php" '
+                   b'username="user" at="2018-01-02T03:04:05Z" /><RETURN status="FAILED" number="2007">Your IP '
+                   b'address is not in the list of secure IPs.</RETURN></GENERIC_RETURN>')
+
+
+def test_stream_matches_buffered(server, connector):
+    conn = connector(single_flight=False)
+    with conn.request(call, {'action': 'list', 'truncation_limit': 0}, stream=True) as stream:
+        body = stream.read()
+    assert body.count(b'<HOST>') == 250
+    assert str(body) == conn.request(call, {'action': 'list', 'truncation_limit': 0})
+
+
+def test_concurrent_scans_error(server, connector):
+    conn = connector()
+    server.concurrent_scan_errors = 1
+    assert conn.request('/api/2.0/fo/scan/', {'action': 'launch'}, stream=True) is False
+    assert conn.last_response.concurrent_scans_exceeded
+
+
+def test_concurrent_scans_error_retried(server, connector):
+    conn = connector()
+    server.concurrent_scan_errors = 1
+    with conn.request('/api/2.0/fo/scan/', {'action': 'launch'}, stream=True, concurrent_scans_retries=1) as stream:
+        assert b'<KEY>REFERENCE</KEY>' in stream.read()
+    assert conn.last_response.attempts == 2
+    assert server.hits['/api/2.0/fo/scan/'] == 2
+
+
+def test_secure_ip_error(server, connector):
+    conn = connector()
+    server.routes['/msp/asset_group_list.php'] = lambda handler, body: (200, {}, secure_ip_error)
+    assert conn.request('asset_group_list.php', stream=True) is False
+
+
+def test_http_error(server, connector):
+    conn = connector()
+    server.routes['/msp/asset_group_list.php'] = lambda handler, body: (400, {}, secure_ip_error)
+    with pytest.raises(requests.HTTPError):
+        conn.request('asset_group_list.php', stream=True)
+
+
+def test_checks_first_chunk_only(server, connector):
+    conn = connector()
+    # Chunked response whose error only comes after the first chunk the connector reads.
+    padding = b'<!--' + b' ' * qualysapi.streaming.CHUNK_SIZE + b'-->'
+    server.routes['/api/2.0/fo/scan/'] = lambda handler, body: (200, {}, iter([padding, concurrent_scans_error]))
+    with conn.request('/api/2.0/fo/scan/', {'action': 'launch'}, stream=True) as stream:
+        assert stream.read().endswith(concurrent_scans_error)
+    assert not conn.last_response.concurrent_scans_exceeded
@@ -0,0 +1,46 @@
+""" Tests for following truncated API v2 lists page by page (QGActions.iter_records).
+
+"""
+from __future__ import absolute_import
+
+call = '/api/2.0/fo/asset/host/'
+
+
+def host_ids(records):
+    return [int(record.findtext('ID')) for record in records]
+
+
+def test_follows_truncation(server, connector):
+    conn = connector()
+    ids = host_ids(conn.iter_records(call, {'action': 'list'}, truncation_limit=100, objectified=False))
+    assert ids == list(range(1, 251))
+    assert server.hits[call] == 3
+
+
+def test_keeps_other_parameters(server, connector):
+    conn = connector()
+    ids = host_ids(conn.iter_records(call, {'action': 'list', 'id_max': 150}, truncation_limit=40,
+                                     objectified=False))
+    assert ids == list(range(1, 151))
+    assert server.hits[call] == 4
+
+
+def test_untruncated_list(server, connector):
+    conn = connector()
+    assert len(host_ids(conn.iter_records(call, {'action': 'list'}, truncation_limit=0, objectified=False))) == 250
+    assert server.hits[call] == 1
+
+
+def test_first_page_only(server, connector):
+    conn = connector()
+    records = conn.iter_records(call, {'action': 'list'}, truncation_limit=100, follow_truncation=False,
+                                objectified=False)
+    assert host_ids(records) == list(range(1, 101))
+    assert server.hits[call] == 1
+
+
+def test_prefetch(server, connector):
+    conn = connector()
+    records = conn.iter_records(call, {'action': 'list'}, truncation_limit=100, prefetch=True)
+    assert sorted(int(record.ID) for record in records) == list(range(1, 251))
+